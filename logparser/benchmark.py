@@ -0,0 +1,348 @@
+"""
+Module provides reproducible benchmarks of loading and searching logs.
+
+Logs are generated with generate_log() from a seeded random generator, so
+runs with the same options measure the same log. Sizes, cardinalities of
+session and business ids, ratio of multiline messages and of entries out
+of date order are configurable, eg:
+
+    python -m logparser.benchmark --sizes 10000,100000,1000000
+    python -m logparser.benchmark --save-baseline baseline.json
+    python -m logparser.benchmark --baseline baseline.json
+
+For each size the log is loaded with CustomLog.load_file() and searched
+with each find_entries_* function. Run times are collected with
+PerformanceTester, results hold latencies of the operations, load
+throughput and peak memory of the process that measured them. Results
+compared to a baseline saved earlier report operations which got slower
+or took more memory than tolerated, the command exits with status 1 then.
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+
+from .logparser import (CustomLog,
+                        find_entries_with_log_level,
+                        find_entries_with_business_id,
+                        find_entries_with_session_id,
+                        find_entries_within_date_range)
+from .perftester import PerformanceTester, qualified_name
+
+_loglevels = [('DEBUG', 0.8), ('WARN', 0.15), ('ERROR', 0.05)]
+
+_messages = [
+    "'Starting new session'",
+    "'Authenticating User'",
+    "'Invalid asset ID %d'",
+    "'Loading asset %d from cache'",
+    "'Request took %d ms'",
+    "'Missing Authentication token'",
+]
+
+# messages which span more lines, the newline is within the message
+_multiline_messages = [
+    "'Missing\nAuthentication token'",
+    "'Deleting asset\nwith ID %d'",
+    "'Traceback (most recent call last):\n  File \"app.py\", line %d\n"
+    "KeyError: asset'",
+]
+
+
+def generate_log(stream, num_entries, sessions=None, businesses=None,
+                 multiline_ratio=0.05, disorder_ratio=0.01, max_disorder=60,
+                 entries_per_second=10, start=datetime(2012, 9, 13),
+                 seed=0):
+    """
+    Writes num_entries of a synthetic log to stream
+
+    Entries belong to sessions 'SID:1' to 'SID:<sessions>', each session to
+    one of businesses 'BID:1' to 'BID:<businesses>'. By default there's
+    a session per 20 entries and a business per 100 sessions. Entries of a
+    session share a request id for a few entries in a row.
+
+    Dates advance by entries_per_second from start, disorder_ratio of
+    entries are dated up to max_disorder seconds earlier than the entries
+    around them. multiline_ratio of entries have messages of more lines.
+
+    The same arguments always give the same log.
+    """
+
+    sessions = sessions or max(1, num_entries // 20)
+    businesses = businesses or max(1, sessions // 100)
+    rng = random.Random(seed)
+    random_number = rng.random
+    randint = rng.randint
+    loglevel_limits = []
+    limit = 0.0
+    for loglevel, ratio in _loglevels:
+        limit += ratio
+        loglevel_limits.append((limit, loglevel))
+    # current request id of each session, given when the session starts
+    requests = {}
+    next_request = 1
+    formatted_second = None
+    formatted_date = None
+    lines = []
+    for number in xrange(num_entries):
+        second = number // entries_per_second
+        if random_number() < disorder_ratio:
+            date = (start + timedelta(seconds=max(
+                0, second - randint(1, max_disorder)))).strftime(
+                    CustomLog.date_format)
+        else:
+            if second != formatted_second:
+                formatted_second = second
+                formatted_date = (start + timedelta(seconds=second)).strftime(
+                    CustomLog.date_format)
+            date = formatted_date
+
+        threshold = random_number()
+        for limit, loglevel in loglevel_limits:
+            if threshold < limit:
+                break
+
+        session = randint(1, sessions)
+        request = requests.get(session)
+        if request is None or random_number() < 0.3:
+            request = requests[session] = next_request
+            next_request += 1
+
+        if random_number() < multiline_ratio:
+            message = rng.choice(_multiline_messages)
+        else:
+            message = rng.choice(_messages)
+        if '%d' in message:
+            message = message % randint(1, 999999)
+
+        lines.append('%s %s SID:%d BID:%d RID:%x %s\n' % (
+            date, loglevel, session, session % businesses + 1,
+            request & 0xffffff, message))
+        if len(lines) >= 10000:
+            stream.write(''.join(lines))
+            lines = []
+    stream.write(''.join(lines))
+
+
+def _peak_memory():
+    """Returns peak resident memory of this process in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def measure(path, num_entries, repeat=10, parser='fast',
+            start=datetime(2012, 9, 13), entries_per_second=10):
+    """
+    Loads log file generated by generate_log() and searches it repeat times
+    with each find_entries_* function, returns results of the operations
+    by name as returned by PerformanceTester.results() and peak_memory
+    in bytes. start and entries_per_second are those the log was
+    generated with, searched dates are within the log.
+
+    Load also gets entries_per_sec, the load throughput. Memory is peak
+    memory of the process, measure in a fresh process to compare sizes,
+    see run_benchmark().
+    """
+
+    span = max(1, num_entries // entries_per_second)
+    perf_tester = PerformanceTester()
+    log_container = CustomLog(parser)
+    load = perf_tester.test(log_container.load_file)
+    operations = [(find_entries_with_log_level, [('DEBUG',), ('ERROR',)]),
+                  (find_entries_with_business_id, [('BID:1',), ('BID:2',)]),
+                  (find_entries_with_session_id, [('SID:1',), ('SID:2',)]),
+                  (find_entries_within_date_range, [
+                      # one minute and a tenth of the log
+                      (start + timedelta(seconds=span // 2),
+                       start + timedelta(seconds=span // 2 + 60)),
+                      (start + timedelta(seconds=span // 2),
+                       start + timedelta(seconds=span // 2 + span // 10))])]
+
+    load(path)
+    # first search of each field also sorts entries added by the load
+    for function, arguments in operations:
+        function(log_container, *arguments[0])
+    for function, arguments in operations:
+        tested = perf_tester.test(function)
+        for _ in xrange(repeat):
+            for args in arguments:
+                tested(log_container, *args)
+
+    tested_results = perf_tester.results()
+    results = {'peak_memory': _peak_memory()}
+    results['load'] = tested_results[qualified_name(
+        log_container.load_file)]
+    results['load']['entries_per_sec'] = (log_container._count()
+                                          / results['load']['avg_time'])
+    for function, _ in operations:
+        results[function.__name__] = tested_results[qualified_name(function)]
+    return results
+
+
+def _measure(arguments):
+    path, num_entries, repeat, parser, log_options = arguments
+    dates = dict((name, log_options[name])
+                 for name in ('start', 'entries_per_second')
+                 if name in log_options)
+    return measure(path, num_entries, repeat, parser, **dates)
+
+
+def run_benchmark(sizes, repeat=10, parser='fast', directory=None,
+                  **log_options):
+    """
+    Generates logs of sizes entries with generate_log(), given log_options,
+    measures each with measure() in a fresh process so peak memory is the
+    memory of that size alone. Returns results keyed by size as a string,
+    the way they are stored in JSON.
+
+    Logs are generated in directory, a temporary one by default, and
+    deleted after they're measured.
+    """
+
+    results = {}
+    work_directory = tempfile.mkdtemp(dir=directory)
+    try:
+        for size in sizes:
+            path = os.path.join(work_directory, 'benchmark-%d.log' % size)
+            with open(path, 'wb') as log_file:
+                generate_log(log_file, size, **log_options)
+            pool = multiprocessing.Pool(1)
+            try:
+                results[str(size)] = pool.apply(
+                    _measure, [(path, size, repeat, parser, log_options)])
+            finally:
+                pool.close()
+                pool.join()
+            os.remove(path)
+    finally:
+        shutil.rmtree(work_directory)
+    return results
+
+
+# metrics compared to the baseline, higher values are worse
+compared_metrics = ('avg_time', 'p95')
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Compares results of run_benchmark() to baseline results, returns list
+    of (size, operation, metric, baseline value, value) of metrics worse
+    than the baseline by more than tolerance, a fraction of the baseline
+    value. Sizes and operations missing in either results are skipped.
+    """
+
+    regressions = []
+    for size in sorted(set(results) & set(baseline), key=int):
+        measured, expected = results[size], baseline[size]
+        if measured['peak_memory'] > expected['peak_memory'] * (1 + tolerance):
+            regressions.append((size, 'process', 'peak_memory',
+                                expected['peak_memory'],
+                                measured['peak_memory']))
+        for operation in sorted(set(measured) & set(expected)):
+            if operation == 'peak_memory':
+                continue
+            for metric in compared_metrics:
+                value = measured[operation][metric]
+                expected_value = expected[operation][metric]
+                if value > expected_value * (1 + tolerance):
+                    regressions.append((size, operation, metric,
+                                        expected_value, value))
+    return regressions
+
+
+def print_results(results):
+    """Prints results of run_benchmark() as a table"""
+
+    form = "%10s %-32s %12s %12s %12s"
+    print form % ("Entries", "Operation", "Avg secs", "P95 secs",
+                  "Entries/sec")
+    for size in sorted(results, key=int):
+        measured = results[size]
+        for operation in sorted(measured):
+            if operation == 'peak_memory':
+                continue
+            result = measured[operation]
+            print form % (size, operation, '%0.6f' % result['avg_time'],
+                          '%0.6f' % result['p95'],
+                          '%d' % result['entries_per_sec']
+                          if 'entries_per_sec' in result else '')
+        print form % (size, 'peak memory', '', '',
+                      '%0.1f MB' % (measured['peak_memory'] / 1048576.0))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m logparser.benchmark',
+        description='Measures loading and searching of generated logs')
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='comma separated numbers of entries of logs '
+                             '(default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='times each search is repeated '
+                             '(default: %(default)s)')
+    parser.add_argument('--parser', default='fast',
+                        choices=sorted(CustomLog._parsers),
+                        help='parser of log lines (default: %(default)s)')
+    parser.add_argument('--sessions', type=int,
+                        help='number of session ids (default: one per 20 '
+                             'entries)')
+    parser.add_argument('--businesses', type=int,
+                        help='number of business ids (default: one per 100 '
+                             'sessions)')
+    parser.add_argument('--multiline-ratio', type=float, default=0.05,
+                        help='ratio of entries with multiline messages '
+                             '(default: %(default)s)')
+    parser.add_argument('--disorder-ratio', type=float, default=0.01,
+                        help='ratio of entries out of date order '
+                             '(default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the generated logs '
+                             '(default: %(default)s)')
+    parser.add_argument('--directory',
+                        help='directory to generate logs in (default: '
+                             'temporary directory)')
+    parser.add_argument('--output', help='file to write results to as JSON')
+    parser.add_argument('--save-baseline', metavar='PATH',
+                        help='file to write results to as the baseline')
+    parser.add_argument('--baseline', metavar='PATH',
+                        help='baseline to compare results to')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='fraction by which results may be worse than '
+                             'the baseline (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = run_benchmark(sizes, args.repeat, args.parser, args.directory,
+                            sessions=args.sessions,
+                            businesses=args.businesses,
+                            multiline_ratio=args.multiline_ratio,
+                            disorder_ratio=args.disorder_ratio,
+                            seed=args.seed)
+    print_results(results)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as results_file:
+                json.dump(results, results_file, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, args.tolerance)
+        for size, operation, metric, expected, value in regressions:
+            print ("Regression: %s of %s with %s entries is %g, baseline %g"
+                   % (metric, operation, size, value, expected))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""
+Module provides client of the log server, see logparser.serve.
+
+Usage:
+
+    client = LogClient('localhost:8470')
+    for entry in client.find_entries_with_log_level('ERROR'):
+        print entry
+
+Entries are CustomLog.LogEntry objects, the same as returned by a local
+CustomLog. They are received as the results are iterated, so huge results
+don't have to fit in memory.
+"""
+
+from datetime import datetime
+import socket
+
+from .logparser import CustomLog
+from .serve import address_family, decode_message, encode_message, \
+    parse_address
+
+
+class LogClient(object):
+    """
+    LogClient sends searches to a log server at address, given as
+    'host:port', (host, port) or path of a Unix socket.
+
+    Search methods return generators of found entries. Results of a search
+    are read before the next search is sent, unread entries are skipped,
+    also when the generator was closed.
+    Errors reported by the server are raised as ValueError.
+    """
+
+    def __init__(self, address, timeout=None):
+        address = parse_address(address)
+        self._socket = socket.socket(address_family(address),
+                                     socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        self._socket.connect(address)
+        self._file = self._socket.makefile('rb')
+        self._last_id = 0
+        self._results = None
+
+    date_format = CustomLog.date_format
+
+    def find_by(self, field_name, value, value_to=None):
+        """Finds entries like LogContainer.find_by()"""
+
+        if field_name == 'date':
+            value = self._date(value)
+            value_to = self._date(value_to)
+        return self.search('find_by', field_name=field_name, value=value,
+                           value_to=value_to)
+
+    def query(self, **conditions):
+        """Finds entries like LogContainer.query()"""
+
+        date = conditions.get('date')
+        if isinstance(date, tuple):
+            conditions['date'] = [self._date(value) for value in date]
+        elif date is not None:
+            conditions['date'] = self._date(date)
+        return self.search('query', **conditions)
+
+    def find_entries_with_log_level(self, log_level):
+        """Finds entries with the specified log level."""
+        return self.search('find_entries_with_log_level',
+                           log_level=log_level)
+
+    def find_entries_with_business_id(self, business_id):
+        """Finds entries with the specified business id"""
+        return self.search('find_entries_with_business_id',
+                           business_id=business_id)
+
+    def find_entries_within_date_range(self, date_from, date_to):
+        """Finds entries within the range of dates specified"""
+        return self.search('find_entries_within_date_range',
+                           date_from=self._date(date_from),
+                           date_to=self._date(date_to))
+
+    def find_entries_with_session_id(self, session_id):
+        """Finds entries with the specified session id"""
+        return self.search('find_entries_with_session_id',
+                           session_id=session_id)
+
+    def _date(self, value):
+        if isinstance(value, datetime):
+            return value.strftime(self.date_format)
+        return value
+
+    def search(self, method, **params):
+        """Sends request to call method with params, returns found entries"""
+
+        if self._results is not None:
+            # rest of the previous results precedes the answer
+            try:
+                for _ in self._results:
+                    pass
+            except ValueError:
+                pass
+        self._last_id += 1
+        self._socket.sendall(encode_message({'id': self._last_id,
+                                             'method': method,
+                                             'params': params}))
+        results = self._results = self._read_results(self._last_id)
+        return results
+
+    def _read_results(self, request_id):
+        make_entry = CustomLog.LogEntry._make
+        date_format = self.date_format
+        strptime = datetime.strptime
+        # entries often share dates
+        dates = {}
+        try:
+            while True:
+                line = self._file.readline()
+                if not line:
+                    raise IOError("Connection closed by the server")
+                message = decode_message(line)
+                if message.get('id') != request_id:
+                    # rest of results of a previous search left unread
+                    continue
+                entry = message.get('entry')
+                if entry is not None:
+                    date = dates.get(entry[0])
+                    if date is None:
+                        date = dates[entry[0]] = strptime(entry[0],
+                                                          date_format)
+                    entry[0] = date
+                    yield make_entry(entry)
+                elif 'error' in message:
+                    raise ValueError(message['error'])
+                elif message.get('done'):
+                    return
+        finally:
+            if self._results is not None and request_id == self._last_id:
+                self._results = None
+
+    def close(self):
+        """Closes connection to the server"""
+
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,482 @@
+"""
+Module provides columnar storage for logs in the format of the assignment.
+
+ColumnarCustomLog keeps every field of the entries in its own compact
+column instead of keeping an entry object per log line:
+
+    date - epoch seconds in an array of doubles
+    loglevel, sessionid, businessid - codes in arrays of integers,
+        each column has a dictionary of its distinct values
+    requestid, message - one character pool, an array of offsets marks
+        where each of them starts
+
+Sorted buckets store their values in arrays too (or share one string per
+distinct id), so an entry costs a few dozens of bytes instead of a few
+hundreds. Entries are materialised as CustomLog.LogEntry objects only
+when they are accessed, eg. returned from find_by().
+
+aggregate() counts entries straight from the columns, using NumPy when
+it's installed.
+
+Container can be saved to a snapshot file with ColumnarCustomLog.save()
+and reopened with ColumnarCustomLog.open(). The snapshot stores columns
+and indexes as they are in memory:
+
+    magic string
+    length of the header (8 bytes, little endian)
+    header - JSON object describing the container, arrays are described
+        by their typecode, offset and length
+    arrays - contents of the arrays, each starting at multiple of 8 bytes
+
+The header holds data only, opening a snapshot doesn't run any code from
+it. Strings in the header are decoded as latin-1, so any bytes round trip.
+"""
+
+from array import array
+from collections import namedtuple
+from datetime import timedelta
+import json
+import mmap
+import struct
+import sys
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .logparser import CustomLog, SortedIndex, _estimated_size
+
+
+# location of an array in the snapshot, relative to the start of arrays
+_Section = namedtuple('_Section', ['typecode', 'offset', 'length'])
+
+
+def source_checksum(path):
+    """Returns checksum of the file, used to tell if a snapshot is stale"""
+
+    checksum = 0
+    with open(path, 'rb') as source:
+        while True:
+            block = source.read(1 << 20)
+            if not block:
+                break
+            checksum = zlib.crc32(block, checksum)
+    return checksum & 0xffffffff
+
+
+def _aligned(size):
+    return (size + 7) & ~7
+
+
+def _from_json(value):
+    """Returns value decoded from the snapshot header with strings as str
+    and arrays as _Section"""
+
+    if isinstance(value, unicode):
+        return value.encode('latin-1')
+    if isinstance(value, list):
+        return [_from_json(item) for item in value]
+    if isinstance(value, dict):
+        if sorted(value) == sorted(_Section._fields):
+            return _Section(str(value['typecode']), value['offset'],
+                            value['length'])
+        return dict([(_from_json(key), _from_json(item))
+                     for key, item in value.iteritems()])
+    return value
+
+
+class ColumnarCustomLog(CustomLog):
+    """
+    CustomLog which stores entries in columns.
+
+    Usage is the same as of CustomLog:
+
+        log_container = ColumnarCustomLog()
+        log_container.load(stream)
+        log_container.find_by('loglevel', 'ERROR')
+    """
+
+    def __init__(self, parser='fast', searchable_fields=None):
+        self._dates = array('d')
+        self._codes = {
+            'loglevel': array('B'),
+            'sessionid': array('l'),
+            'businessid': array('l'),
+        }
+        # distinct values of coded columns and codes assigned to them
+        self._dictionaries = dict([(field, []) for field in self._codes])
+        self._code_of = dict([(field, {}) for field in self._codes])
+        # requestid and message of each entry follow each other in the pool
+        # offsets hold where requestid of each entry starts, where its
+        # message starts and, as the last item, where the pool ends
+        self._text = array('c')
+        self._text_offsets = array('l', [0])
+        # marshalled ids shared by all values in buckets
+        self._marshalled_ids = {}
+        # dates of materialised entries keyed by their epoch seconds
+        self._datetimes = {}
+        super(ColumnarCustomLog, self).__init__(parser, searchable_fields)
+        self._converters['sessionid'] = self._shared_xid_converter
+        self._converters['businessid'] = self._shared_xid_converter
+        self._entries = None
+
+    _bucket_typecodes = {
+        'date': 'd',
+        'loglevel': 'B',
+    }
+
+    @property
+    def entries(self):
+        """Provide access to entries"""
+        return self._entries_at(xrange(self._count()))
+
+    _snapshot_magic = 'LOGPARSER SNAPSHOT\n'
+
+    _snapshot_version = 2
+
+    def save(self, path, source=None):
+        """
+        Saves entries and indexes to a snapshot file.
+
+        If path of the source log file is given, its checksum is saved so
+        that open() can check whether the snapshot is up to date.
+        """
+
+        arrays = []
+        sizes = [0]
+
+        def section(value):
+            if not isinstance(value, array):
+                return value
+            arrays.append(value)
+            size = len(value) * value.itemsize
+            sizes.append(sizes[-1] + _aligned(size))
+            return _Section(value.typecode, sizes[-2], len(value))._asdict()
+
+        with self._lock:
+            header = {
+                'version': self._snapshot_version,
+                'byteorder': sys.byteorder,
+                'source_checksum': source and source_checksum(source),
+                'parser': self._parser,
+                'searchable_fields': self._index_spec(),
+                'dictionaries': self._dictionaries,
+                'dates': section(self._dates),
+                'codes': dict([(field, section(column))
+                               for field, column in self._codes.iteritems()]),
+                'text': section(self._text),
+                'text_offsets': section(self._text_offsets),
+                'buckets': dict([
+                    (field, dict([(name, section(value)) for name, value
+                                  in self._buckets[field].state().items()]))
+                    for field in self._searchable_fields]),
+            }
+            header = json.dumps(header, encoding='latin-1',
+                                separators=(',', ':'))
+
+            with open(path, 'wb') as snapshot:
+                snapshot.write(self._snapshot_magic)
+                snapshot.write(struct.pack('<Q', len(header)))
+                snapshot.write(header)
+                for value in arrays:
+                    snapshot.write('\0' * (_aligned(snapshot.tell())
+                                            - snapshot.tell()))
+                    value.tofile(snapshot)
+
+    @classmethod
+    def open(cls, path, source=None):
+        """
+        Opens snapshot file written by save().
+
+        Arrays are copied straight from the memory mapped file, one copy
+        each, rather than backed by the mapping: columns and indexes are
+        arrays which grow as entries are added. If path of the source log
+        file is given and its checksum doesn't match the one saved in the
+        snapshot ValueError is raised.
+        """
+
+        with open(path, 'rb') as snapshot:
+            snapshot_map = mmap.mmap(snapshot.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+        try:
+            return cls._from_snapshot_map(snapshot_map, path, source)
+        finally:
+            snapshot_map.close()
+
+    @classmethod
+    def _from_snapshot_map(cls, snapshot_map, path, source):
+        magic = cls._snapshot_magic
+        if snapshot_map[:len(magic)] != magic:
+            raise ValueError("%s isn't a log snapshot" % path)
+        header_start = len(magic) + 8
+        header_size, = struct.unpack('<Q',
+                                     snapshot_map[len(magic):header_start])
+        try:
+            header = _from_json(json.loads(
+                snapshot_map[header_start:header_start + header_size]))
+        except ValueError:
+            raise ValueError("Unsupported header of snapshot %s" % path)
+        if header['version'] != cls._snapshot_version:
+            raise ValueError("Unsupported snapshot version %s"
+                             % header['version'])
+        if source and source_checksum(source) != header['source_checksum']:
+            raise ValueError("Snapshot %s doesn't match log %s"
+                             % (path, source))
+
+        arrays_start = _aligned(header_start + header_size)
+
+        def load(value):
+            if not isinstance(value, _Section):
+                return value
+            loaded = array(value.typecode)
+            loaded.fromstring(buffer(snapshot_map,
+                                     arrays_start + value.offset,
+                                     value.length * loaded.itemsize))
+            if header['byteorder'] != sys.byteorder:
+                loaded.byteswap()
+            return loaded
+
+        log_container = cls(header['parser'], header['searchable_fields'])
+        log_container._dates = load(header['dates'])
+        log_container._codes = dict([(field, load(column)) for field, column
+                                     in header['codes'].iteritems()])
+        log_container._text = load(header['text'])
+        log_container._text_offsets = load(header['text_offsets'])
+        log_container._dictionaries = header['dictionaries']
+        log_container._code_of = dict([
+            (field, dict([(value, code) for code, value
+                          in enumerate(dictionary)]))
+            for field, dictionary in header['dictionaries'].iteritems()])
+        for field, state in header['buckets'].iteritems():
+            index_type = type(log_container._buckets[field])
+            log_container._buckets[field] = index_type.from_state(
+                dict([(name, load(value))
+                      for name, value in state.iteritems()]))
+        return log_container
+
+    def _count(self):
+        return len(self._dates)
+
+    def _drop_stored(self, count):
+        del self._dates[:count]
+        offsets = self._text_offsets
+        start = offsets[2 * count]
+        del self._text[:start]
+        self._text_offsets = array('l', (offset - start
+                                         for offset in offsets[2 * count:]))
+        for field, column in self._codes.items():
+            del column[:count]
+            self._recode(field)
+        # ids which aren't in the dictionaries anymore aren't shared
+        ids = set(self._dictionaries['sessionid'])
+        ids.update(self._dictionaries['businessid'])
+        self._marshalled_ids = dict([
+            (xid, marshalled) for xid, marshalled
+            in self._marshalled_ids.iteritems() if xid in ids])
+
+    def _recode(self, field):
+        """Drops values no entry has from the dictionary of field"""
+
+        column = self._codes[field]
+        dictionary = self._dictionaries[field]
+        used = sorted(set(column))
+        if len(used) == len(dictionary):
+            return
+        new_codes = dict([(code, new_code)
+                          for new_code, code in enumerate(used)])
+        self._codes[field] = array(column.typecode,
+                                   (new_codes[code] for code in column))
+        self._dictionaries[field] = [dictionary[code] for code in used]
+        self._code_of[field] = dict([
+            (value, code) for code, value
+            in enumerate(self._dictionaries[field])])
+
+    def _memory_usage(self):
+        usage = super(ColumnarCustomLog, self)._memory_usage()
+        columns = [self._dates, self._text, self._text_offsets]
+        columns.extend(self._codes.itervalues())
+        usage['entries'] = (
+            sum(sys.getsizeof(column) for column in columns)
+            + sum(_estimated_size(dictionary)
+                  for dictionary in self._dictionaries.itervalues())
+            + sum(sys.getsizeof(code_of)
+                  for code_of in self._code_of.itervalues())
+            + sys.getsizeof(self._marshalled_ids))
+        return usage
+
+    def _make_bucket(self, field, index_type):
+        typecode = self._bucket_typecodes.get(field)
+        if typecode and self.index_types.get(index_type) is SortedIndex:
+            return SortedIndex(values=array(typecode))
+        return super(ColumnarCustomLog, self)._make_bucket(field, index_type)
+
+    def _shared_xid_converter(self, xid):
+        marshalled = self._marshalled_ids.get(xid)
+        if marshalled is None:
+            marshalled = self._marshalled_ids[xid] = self._xid_converter(xid)
+        return marshalled
+
+    def _code(self, field, value):
+        code_of = self._code_of[field]
+        code = code_of.get(value)
+        if code is None:
+            code = code_of[value] = len(code_of)
+            self._dictionaries[field].append(value)
+        return code
+
+    def _store(self, entry):
+        """Stores entry at the end and returns its position"""
+
+        # codes are found first so a bad value doesn't leave columns of
+        # different lengths
+        codes = [(column, self._code(field, getattr(entry, field)))
+                 for field, column in self._codes.iteritems()]
+        date = self._datetime_converter(entry.date)
+        text = self._text
+        text.fromstring(entry.requestid)
+        self._text_offsets.append(len(text))
+        text.fromstring(entry.message)
+        self._text_offsets.append(len(text))
+
+        self._dates.append(date)
+        for column, code in codes:
+            column.append(code)
+        return len(self._dates) - 1
+
+    def _sortable_value_at(self, position, field_name):
+        if field_name == 'date':
+            return self._dates[position]
+        value = self._dictionaries[field_name][self._codes[field_name][position]]
+        return self._marshall_value(field_name, value)
+
+    def _trace_references(self, field_name, start, stop):
+        dates = self._dates
+        if field_name in self._codes:
+            values = self._dictionaries[field_name]
+            codes = self._codes[field_name]
+            return ((values[codes[position]], dates[position], position)
+                    for position in xrange(start, stop))
+        # requestid starts each entry's part of the text pool
+        text = self._text
+        offsets = self._text_offsets
+        return ((text[offsets[2 * position]:offsets[2 * position + 1]]
+                 .tostring(), dates[position], position)
+                for position in xrange(start, stop))
+
+    def _count_groups(self, group_by, seconds, positions):
+        if not all(field in self._codes for field in group_by):
+            # other fields are only in the text pool
+            return super(ColumnarCustomLog, self)._count_groups(
+                group_by, seconds, positions)
+
+        # codes of an entry are combined into one number, code of each field
+        # is a digit in a system with radix equal to number of its values
+        # number of interval since the epoch is the most significant digit
+        radices = [len(self._dictionaries[field]) or 1 for field in group_by]
+        if numpy is not None and self._fits_int64(radices, seconds):
+            counts = self._count_keys_numpy(group_by, radices, seconds,
+                                            positions)
+        else:
+            counts = self._count_keys(group_by, radices, seconds, positions)
+
+        fields = zip([self._dictionaries[field] for field in group_by],
+                     radices)
+        fields.reverse()
+        decoded = {}
+        for key, count in counts.iteritems():
+            values = []
+            for dictionary, radix in fields:
+                key, code = divmod(key, radix)
+                values.append(dictionary[code])
+            if seconds:
+                values.append(key)
+            values.reverse()
+            decoded[tuple(values)] = count
+        return decoded
+
+    def _fits_int64(self, radices, seconds):
+        dates = self._dates
+        largest_key = reduce(lambda product, radix: product * radix,
+                             radices, 1)
+        if seconds and dates:
+            largest_key *= max(abs(min(dates)), abs(max(dates))) // seconds + 1
+        return largest_key < 2 ** 62
+
+    def _count_keys(self, group_by, radices, seconds, positions):
+        if positions is None:
+            positions = xrange(self._count())
+        dates = self._dates
+        columns = zip([self._codes[field] for field in group_by], radices)
+
+        counts = {}
+        for position in positions:
+            key = int(dates[position] // seconds) if seconds else 0
+            for column, radix in columns:
+                key = key * radix + column[position]
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def _count_keys_numpy(self, group_by, radices, seconds, positions):
+        if positions is not None:
+            positions = numpy.frombuffer(positions, dtype=positions.typecode)
+            count = len(positions)
+        else:
+            count = self._count()
+        if not count:
+            return {}
+
+        def column_values(column):
+            values = numpy.frombuffer(column, dtype=column.typecode)
+            if positions is not None:
+                values = values[positions]
+            return values
+
+        if seconds:
+            # seconds may be a float, eg. of a timedelta
+            keys = numpy.floor_divide(column_values(self._dates),
+                                      seconds).astype('l')
+        else:
+            keys = numpy.zeros(count, dtype='l')
+        for field, radix in zip(group_by, radices):
+            keys = keys * radix + column_values(
+                self._codes[field]).astype('l')
+
+        keys, counts = numpy.unique(keys, return_counts=True)
+        return dict(zip(keys.tolist(), counts.tolist()))
+
+    def _entries_at(self, positions):
+        entry_type = self.LogEntry
+        # tuple.__new__ skips the namedtuple's __new__ written in Python
+        new_entry = tuple.__new__
+        epoch = self._epoch
+        dates = self._dates
+        datetimes = self._datetimes
+        if len(datetimes) >= self._max_cached_dates:
+            datetimes.clear()
+        loglevels = self._dictionaries['loglevel']
+        sessionids = self._dictionaries['sessionid']
+        businessids = self._dictionaries['businessid']
+        loglevel_codes = self._codes['loglevel']
+        sessionid_codes = self._codes['sessionid']
+        businessid_codes = self._codes['businessid']
+        text = self._text
+        offsets = self._text_offsets
+
+        entries = []
+        for i in positions:
+            seconds = dates[i]
+            date = datetimes.get(seconds)
+            if date is None:
+                date = datetimes[seconds] = epoch + timedelta(seconds=seconds)
+            offset = 2 * i
+            message_start = offsets[offset + 1]
+            entries.append(new_entry(entry_type, (
+                date,
+                loglevels[loglevel_codes[i]],
+                sessionids[sessionid_codes[i]],
+                businessids[businessid_codes[i]],
+                text[offsets[offset]:message_start].tostring(),
+                text[message_start:offsets[offset + 2]].tostring())))
+        return entries
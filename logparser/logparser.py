@@ -22,11 +22,783 @@ contain unescaped newline chars.
 It is assumed that positions of fields in an entry never change
 """
 
-from collections import namedtuple
+from array import array
+from collections import namedtuple, OrderedDict
+from functools import wraps
+from itertools import imap, islice, izip
+from operator import attrgetter
 import bisect
+import bz2
+import gzip
+import mmap
+import multiprocessing
+import os
+import Queue
 import re
-from datetime import datetime
+from datetime import datetime, timedelta
 import sys
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+def _synchronized(method):
+    """Makes method hold the container's lock while it runs"""
+
+    @wraps(method)
+    def wrapper(self, *args, **kwds):
+        with self._lock:
+            return method(self, *args, **kwds)
+    return wrapper
+
+
+def _estimated_size(items, size_of=sys.getsizeof, samples=1000):
+    """
+    Returns estimated number of bytes taken by a list or an array and by
+    objects in it, sizes of at most about samples objects spread evenly
+    are measured with size_of
+    """
+
+    size = sys.getsizeof(items)
+    if isinstance(items, array) or not items:
+        return size
+    step = max(1, len(items) // samples)
+    sampled = [size_of(items[i]) for i in xrange(0, len(items), step)]
+    return size + sum(sampled) * len(items) // len(sampled)
+
+
+def _reference_size(reference):
+    return sum(imap(sys.getsizeof, reference), sys.getsizeof(reference))
+
+
+class SortedIndex(object):
+    """
+    SortedIndex stores references to entries sorted by value of a field.
+
+    Values and positions of entries are kept in two parallel sequences,
+    sorted by value, then by position. By default values are stored in a
+    list and positions in an array, sequences of other types may be given,
+    eg. an array for values of fixed size type.
+
+    References can be inserted one by one with insert() or added with add()
+    which defers sorting until the next search.
+    """
+
+    def __init__(self, values=None, positions=None):
+        self._values = [] if values is None else values
+        self._positions = array('l') if positions is None else positions
+        # (value, position) references added with add(), not merged yet
+        self._pending = []
+
+    def __len__(self):
+        return len(self._positions) + len(self._pending)
+
+    # values are ordered, entries can be checked against a range of them
+    ordered = True
+
+    @property
+    def pending(self):
+        """Tells if there are references not merged into the index yet"""
+        return bool(self._pending)
+
+    def insert(self, value, position):
+        """Inserts reference to entry at position preserving sorting"""
+
+        self._merge_pending()
+        values = self._values
+        low = bisect.bisect_left(values, value)
+        high = bisect.bisect_right(values, value, low)
+        index = bisect.bisect_right(self._positions, position, low, high)
+        values.insert(index, value)
+        self._positions.insert(index, position)
+
+    def add(self, value, position):
+        """Adds reference to entry at position, sorted on next search"""
+        self._pending.append((value, position))
+
+    def add_run(self, references):
+        """
+        Adds (value, position) references sorted by value then position,
+        merged on next search. Sorting recognises each added run, so runs
+        are merged with each other and the index instead of being sorted.
+        """
+        self._pending.extend(references)
+
+    def _merge_pending(self):
+        pending = self._pending
+        if not pending:
+            return
+        self._pending = []
+        if len(pending) * 16 < len(self._positions):
+            # inserting few references is cheaper than resorting
+            for value, position in pending:
+                self.insert(value, position)
+            return
+        references = zip(self._values, self._positions)
+        # sort() recognises the already sorted references as a single run,
+        # so only the new references are really sorted
+        references.extend(pending)
+        references.sort()
+        del self._values[:]
+        del self._positions[:]
+        self._values.extend(value for value, _ in references)
+        self._positions.extend(position for _, position in references)
+
+    def _bounds(self, value, value_to):
+        self._merge_pending()
+        low = bisect.bisect_left(self._values, value)
+        return low, bisect.bisect_right(self._values, value_to, low)
+
+    def find(self, value, value_to):
+        """
+        Returns positions of entries which value is between value and
+        value_to (boundary values included), in the index order
+        """
+
+        low, high = self._bounds(value, value_to)
+        return self._positions[low:high]
+
+    def state(self):
+        """Returns dict of sequences the index consists of, eg. to save it"""
+
+        self._merge_pending()
+        return {'values': self._values, 'positions': self._positions}
+
+    @classmethod
+    def from_state(cls, state):
+        """Creates index from sequences returned by state()"""
+        return cls(state['values'], state['positions'])
+
+    def compact(self, count):
+        """
+        Drops references to the first count entries, positions of the other
+        entries are shifted down by count
+        """
+
+        self._pending = [(value, position - count)
+                         for value, position in self._pending
+                         if position >= count]
+        kept = [(value, position - count) for value, position
+                in izip(self._values, self._positions) if position >= count]
+        del self._values[:]
+        del self._positions[:]
+        self._values.extend(value for value, _ in kept)
+        self._positions.extend(position for _, position in kept)
+
+    def memory_usage(self):
+        """Returns estimated number of bytes taken by the index"""
+        return (_estimated_size(self._values)
+                + sys.getsizeof(self._positions)
+                + _estimated_size(self._pending, _reference_size))
+
+    def count(self, value, value_to):
+        """Returns number of entries find() would return"""
+
+        low, high = self._bounds(value, value_to)
+        return high - low
+
+
+class HashIndex(object):
+    """
+    HashIndex maps each value of a field to an array of positions of
+    entries holding it, positions are in ascending order.
+
+    Finding entries with a value takes constant time regardless of the
+    number of entries. Range search is supported by going through values
+    within the range in sorted order, so results are ordered the same way
+    as results of SortedIndex.
+    """
+
+    def __init__(self):
+        self._positions = {}
+
+    def __len__(self):
+        return sum(len(positions) for positions in self._positions.values())
+
+    # references are never pending, they're added right away
+    pending = False
+
+    ordered = True
+
+    def insert(self, value, position):
+        """Inserts reference to entry at position"""
+
+        positions = self._positions.get(value)
+        if positions is None:
+            positions = self._positions[value] = array('l')
+        if positions and position < positions[-1]:
+            positions.insert(bisect.bisect(positions, position), position)
+        else:
+            positions.append(position)
+
+    add = insert
+
+    def find(self, value, value_to):
+        """
+        Returns positions of entries which value is between value and
+        value_to (boundary values included), ordered by value then position
+        """
+
+        if value == value_to:
+            return self._positions.get(value, array('l'))[:]
+        found = array('l')
+        for key in self._keys_between(value, value_to):
+            found.extend(self._positions[key])
+        return found
+
+    def count(self, value, value_to):
+        """Returns number of entries find() would return"""
+
+        if value == value_to:
+            return len(self._positions.get(value, ()))
+        return sum(len(self._positions[key])
+                   for key in self._keys_between(value, value_to))
+
+    def _keys_between(self, value, value_to):
+        return sorted(key for key in self._positions
+                      if value <= key <= value_to)
+
+    def state(self):
+        """
+        Returns dict of sequences the index consists of, eg. to save it:
+        values, positions of all values one after another and lengths of
+        positions of each value
+        """
+
+        values = sorted(self._positions)
+        positions = array('l')
+        lengths = array('l')
+        for value in values:
+            positions.extend(self._positions[value])
+            lengths.append(len(self._positions[value]))
+        return {'values': values, 'positions': positions, 'lengths': lengths}
+
+    @classmethod
+    def from_state(cls, state):
+        """Creates index from sequences returned by state()"""
+
+        index = cls()
+        positions = state['positions']
+        start = 0
+        for value, length in zip(state['values'], state['lengths']):
+            index._positions[value] = positions[start:start + length]
+            start += length
+        return index
+
+    def compact(self, count):
+        """
+        Drops references to the first count entries, positions of the other
+        entries are shifted down by count
+        """
+
+        index = self._positions
+        for value, positions in index.items():
+            kept = positions[bisect.bisect_left(positions, count):]
+            if kept:
+                index[value] = array('l', (position - count
+                                           for position in kept))
+            else:
+                del index[value]
+
+    def memory_usage(self):
+        """Returns estimated number of bytes taken by the index"""
+        return sum((sys.getsizeof(value) + sys.getsizeof(positions)
+                    for value, positions in self._positions.iteritems()),
+                   sys.getsizeof(self._positions))
+
+
+class TokenIndex(object):
+    """
+    TokenIndex is an inverted index of words of a text field, eg. message.
+
+    Text is split into tokens - lowercase runs of letters and digits, for
+    each token positions of entries containing it are stored along with
+    offsets of the token within the text. The searched value is a phrase,
+    entries containing its tokens one right after another are found:
+
+        'token'                 - entries containing word 'token'
+        'authentication token'  - entries containing both words in a row
+        'auth*'                 - entries containing a word starting with
+                                  'auth', the last word of a phrase can be
+                                  a prefix too
+
+    Case of letters, punctuation and line breaks don't matter. Range search
+    isn't supported.
+    """
+
+    def __init__(self):
+        # positions of entries and offsets of tokens within their texts
+        # ordered by position, then offset
+        self._postings = {}
+        # tokens in sorted order for prefix search, rebuilt when needed
+        self._sorted_tokens = None
+
+    _token_re = re.compile(r'\w+', re.UNICODE)
+
+    def __len__(self):
+        return len(set(position for positions, _
+                       in self._postings.itervalues()
+                       for position in positions))
+
+    # references are never pending, they're added right away
+    pending = False
+
+    # values can't be compared with the searched phrase, so candidates
+    # of a query are never checked one by one against them
+    ordered = False
+
+    def _tokens(self, text):
+        return self._token_re.findall(text.lower())
+
+    def insert(self, value, position):
+        """Inserts reference to entry at position for each token of value"""
+
+        for offset, token in enumerate(self._tokens(value)):
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = (array('l'), array('l'))
+                self._sorted_tokens = None
+            positions, offsets = postings
+            if positions and position < positions[-1]:
+                index = bisect.bisect(positions, position)
+                positions.insert(index, position)
+                offsets.insert(index, offset)
+            else:
+                positions.append(position)
+                offsets.append(offset)
+
+    add = insert
+
+    def find(self, value, value_to):
+        """
+        Returns positions of entries containing the phrase value, in
+        ascending order
+        """
+
+        if value != value_to:
+            raise ValueError("Range search isn't supported by TokenIndex")
+        tokens = self._tokens(value)
+        if not tokens:
+            return array('l')
+        prefix = value.rstrip().endswith('*')
+
+        # references to entries containing the tokens, starting with
+        # the rarest one
+        last = len(tokens) - 1
+        postings = [self._token_postings(token, prefix and i == last)
+                    for i, token in enumerate(tokens)]
+        order = sorted(xrange(len(tokens)),
+                       key=lambda i: len(postings[i][0]))
+        candidates = set(postings[order[0]][0])
+        for i in order[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(postings[i][0])
+        if len(tokens) == 1 or not candidates:
+            return array('l', sorted(candidates))
+
+        # phrase starts where offsets of following tokens follow the offset
+        # of the first one
+        starts = set(self._references(postings[0], candidates))
+        for i in xrange(1, len(tokens)):
+            starts.intersection_update(
+                (position, offset - i) for position, offset
+                in self._references(postings[i], candidates))
+        return array('l', sorted(set(position for position, _ in starts)))
+
+    def _token_postings(self, token, prefix):
+        if not prefix:
+            return self._postings.get(token, (array('l'), array('l')))
+        if self._sorted_tokens is None:
+            self._sorted_tokens = sorted(self._postings)
+        tokens = self._sorted_tokens
+        low = high = bisect.bisect_left(tokens, token)
+        while high < len(tokens) and tokens[high].startswith(token):
+            high += 1
+        if high - low == 1:
+            return self._postings[tokens[low]]
+        references = sorted(
+            reference for matching in tokens[low:high]
+            for reference in zip(*self._postings[matching]))
+        return (array('l', [position for position, _ in references]),
+                array('l', [offset for _, offset in references]))
+
+    def _references(self, postings, candidates):
+        positions, offsets = postings
+        if len(candidates) * 8 >= len(positions):
+            return [(position, offset)
+                    for position, offset in zip(positions, offsets)
+                    if position in candidates]
+        # few candidates are looked up rather than scanning all postings
+        references = []
+        for position in candidates:
+            low = bisect.bisect_left(positions, position)
+            high = bisect.bisect_right(positions, position, low)
+            references.extend((position, offsets[i])
+                              for i in xrange(low, high))
+        return references
+
+    def count(self, value, value_to):
+        """Returns number of entries find() would return"""
+        return len(self.find(value, value_to))
+
+    def state(self):
+        """
+        Returns dict of sequences the index consists of, eg. to save it:
+        tokens, positions and offsets of all tokens one after another and
+        lengths of positions of each token
+        """
+
+        tokens = sorted(self._postings)
+        positions = array('l')
+        offsets = array('l')
+        lengths = array('l')
+        for token in tokens:
+            token_positions, token_offsets = self._postings[token]
+            positions.extend(token_positions)
+            offsets.extend(token_offsets)
+            lengths.append(len(token_positions))
+        return {'tokens': tokens, 'positions': positions,
+                'offsets': offsets, 'lengths': lengths}
+
+    @classmethod
+    def from_state(cls, state):
+        """Creates index from sequences returned by state()"""
+
+        index = cls()
+        positions = state['positions']
+        offsets = state['offsets']
+        start = 0
+        for token, length in zip(state['tokens'], state['lengths']):
+            index._postings[token] = (positions[start:start + length],
+                                      offsets[start:start + length])
+            start += length
+        return index
+
+    def compact(self, count):
+        """
+        Drops references to the first count entries, positions of the other
+        entries are shifted down by count
+        """
+
+        postings = self._postings
+        for token, (positions, offsets) in postings.items():
+            first = bisect.bisect_left(positions, count)
+            if first == len(positions):
+                del postings[token]
+                self._sorted_tokens = None
+            else:
+                postings[token] = (array('l', (position - count for position
+                                               in positions[first:])),
+                                   offsets[first:])
+
+    def memory_usage(self):
+        """Returns estimated number of bytes taken by the index"""
+        size = sys.getsizeof(self._postings)
+        for token, postings in self._postings.iteritems():
+            size += _reference_size((token,) + postings)
+        if self._sorted_tokens is not None:
+            size += sys.getsizeof(self._sorted_tokens)
+        return size
+
+
+class TraceIndex(object):
+    """
+    TraceIndex maps each value of a field, eg. a session id, to positions
+    of entries holding it ordered by date, then position.
+
+    It's built from references given to update() in batches, positions of
+    each batch follow positions of the previous one. References of a value
+    which are older than those already indexed are merged in by date,
+    which dates of indexed positions are looked up for.
+    """
+
+    def __init__(self):
+        self._positions = {}
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def update(self, references, date_at):
+        """
+        Adds (value, date, position) references, date_at returns date of
+        an already indexed position
+        """
+
+        added = {}
+        for value, date, position in references:
+            added.setdefault(value, []).append((date, position))
+            self._length += 1
+        for value, value_references in added.iteritems():
+            value_references.sort()
+            positions = self._positions.get(value)
+            if positions is None:
+                positions = self._positions[value] = array('l')
+            elif date_at(positions[-1]) > value_references[0][0]:
+                # log isn't ordered by date, whole trace is sorted again
+                value_references.extend((date_at(position), position)
+                                        for position in positions)
+                value_references.sort()
+                del positions[:]
+            positions.extend(position for _, position in value_references)
+
+    def find(self, value):
+        """Returns positions of entries with value ordered by date"""
+        return self._positions.get(value, array('l'))[:]
+
+    def compact(self, count):
+        """
+        Drops references to the first count entries, positions of the other
+        entries are shifted down by count
+        """
+
+        index = self._positions
+        for value, positions in index.items():
+            kept = array('l', (position - count for position in positions
+                               if position >= count))
+            self._length -= len(positions) - len(kept)
+            if kept:
+                index[value] = kept
+            else:
+                del index[value]
+
+    def memory_usage(self):
+        """Returns estimated number of bytes taken by the index"""
+        return sum((sys.getsizeof(value) + sys.getsizeof(positions)
+                    for value, positions in self._positions.iteritems()),
+                   sys.getsizeof(self._positions))
+
+
+class ResultView(object):
+    """
+    ResultView is a lazy sequence of search results.
+
+    It stores positions of found entries only, entries are fetched from
+    the container when the view is iterated or indexed. Length and count()
+    don't fetch any entries, slicing returns another view, eg:
+
+        errors = log_container.find_by('loglevel', 'ERROR', lazy=True)
+        len(errors)
+        first_page = errors.page(0, 50)
+
+    Entries evicted from the container after the search (see
+    CustomLog.retain()) are skipped when the view is iterated, indexing
+    them raises IndexError. Length still counts them.
+    """
+
+    def __init__(self, log_container, positions):
+        self._log_container = log_container
+        self._positions = positions
+        # positions are shifted by entries evicted after the search
+        self._dropped = log_container._dropped
+
+    # entries are fetched from the container in chunks of this size
+    _chunk_size = 1024
+
+    def __len__(self):
+        return len(self._positions)
+
+    def count(self):
+        """Returns number of found entries"""
+        return len(self._positions)
+
+    def __iter__(self):
+        positions = self._positions
+        for start in xrange(0, len(positions), self._chunk_size):
+            for entry in self._entries_at(
+                    positions[start:start + self._chunk_size]):
+                yield entry
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            view = ResultView(self._log_container, self._positions[index])
+            view._dropped = self._dropped
+            return view
+        entries = self._entries_at([self._positions[index]])
+        if not entries:
+            raise IndexError("Entry was evicted from the container")
+        return entries[0]
+
+    def _entries_at(self, positions):
+        """Returns entries found at positions which weren't evicted"""
+
+        log_container = self._log_container
+        # entries mustn't be evicted between shifting positions and
+        # fetching the entries
+        with log_container._lock:
+            return log_container._entries_at(self._current(positions))
+
+    def _current(self, positions):
+        """Returns positions of entries which weren't evicted, shifted"""
+        return self._log_container._current_positions(positions,
+                                                      self._dropped)
+
+    def page(self, offset, limit):
+        """Returns list of at most limit entries starting at offset"""
+        return list(self[offset:offset + limit])
+
+    def __repr__(self):
+        return '<ResultView of %d entries>' % len(self)
+
+
+class ResultCache(object):
+    """
+    ResultCache keeps positions found by recent searches, keyed by
+    (field name, value, value_to) of marshalled values.
+
+    Least recently used results are dropped once their size exceeds
+    max_size bytes. When an entry is added, results of equality searches
+    it matches are extended with its position, results of range searches
+    it falls within are dropped. Numbers of hits and misses are counted.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        # keys of cached results which can't be extended by field
+        self._ranges = {}
+
+    # estimated size of a cached result apart from its positions
+    _result_overhead = 200
+
+    def __len__(self):
+        return len(self._results)
+
+    def _size_of(self, positions):
+        return self._result_overhead + len(positions) * positions.itemsize
+
+    def get(self, key):
+        """Returns cached positions of key or None"""
+
+        positions = self._results.pop(key, None)
+        if positions is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._results[key] = positions
+        return positions
+
+    def put(self, key, positions, extendable):
+        """
+        Caches positions of key, extendable tells if they can be extended
+        by positions of added entries
+        """
+
+        size = self._size_of(positions)
+        if size > self.max_size:
+            return
+        self._drop(key)
+        while self.size + size > self.max_size:
+            self._drop(next(iter(self._results)))
+        self._results[key] = positions
+        self.size += size
+        if not extendable:
+            field_name = key[0]
+            self._ranges.setdefault(field_name, set()).add(key)
+
+    def _drop(self, key):
+        positions = self._results.pop(key, None)
+        if positions is None:
+            return
+        self.size -= self._size_of(positions)
+        ranges = self._ranges.get(key[0])
+        if ranges:
+            ranges.discard(key)
+
+    def added(self, position, field_values):
+        """
+        Updates results with entry added at position, field_values are
+        (field name, marshalled value, ordered) of its searchable fields,
+        ordered tells if values of the field can be compared with searched
+        ones
+        """
+
+        results = self._results
+        for field_name, value, ordered in field_values:
+            ranges = self._ranges.get(field_name)
+            if ranges:
+                for key in [key for key in ranges
+                            if not ordered or key[1] <= value <= key[2]]:
+                    self._drop(key)
+            if not ordered:
+                continue
+            positions = results.get((field_name, value, value))
+            if positions is not None:
+                positions.append(position)
+                self.size += positions.itemsize
+        while self.size > self.max_size:
+            self._drop(next(iter(results)))
+
+    def compact(self, count):
+        """
+        Drops the first count entries from results, positions of the other
+        entries are shifted down by count
+        """
+
+        results = self._results
+        for key, positions in results.items():
+            kept = array('l', (position - count for position in positions
+                               if position >= count))
+            results[key] = kept
+            self.size -= (len(positions) - len(kept)) * positions.itemsize
+
+    def clear(self):
+        """Drops all results"""
+
+        self._results.clear()
+        self._ranges.clear()
+        self.size = 0
+
+
+class Trace(object):
+    """
+    Trace holds entries of a session or a request ordered by date, along
+    with statistics of their timing:
+
+        duration - time between the first and the last entry
+        gaps - times between consecutive entries
+        max_gap, mean_gap - the longest and the average gap
+
+    Durations and gaps are timedeltas, zero when there are less than two
+    entries.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.gaps = [entry.date - previous.date
+                     for previous, entry in zip(entries, entries[1:])]
+        if self.gaps:
+            self.duration = entries[-1].date - entries[0].date
+            self.max_gap = max(self.gaps)
+            self.mean_gap = self.duration / len(self.gaps)
+        else:
+            self.duration = self.max_gap = self.mean_gap = timedelta(0)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    @property
+    def start(self):
+        """Date of the first entry, None if there are no entries"""
+        return self.entries[0].date if self.entries else None
+
+    @property
+    def end(self):
+        """Date of the last entry, None if there are no entries"""
+        return self.entries[-1].date if self.entries else None
+
+    def __repr__(self):
+        return '<Trace of %d entries lasting %s>' % (len(self), self.duration)
+
 
 class LogContainer(object):
     """
@@ -61,6 +833,20 @@ class LogContainer(object):
         log_container.append(entry)
 
     Entries are stored in the same order as in the original log.
+
+    Fields are indexed with SortedIndex unless other index type is given
+    along with field name, eg:
+
+        log_container = LogContainer(['field_a', ('field_b', 'hash')])
+
+    Index types are registered in LogContainer.index_types: 'sorted',
+    'hash' and 'text' (TokenIndex, for searching words in text fields).
+
+    Adding many entries at once:
+        log_container.extend(entries)
+
+    defers sorting of the buckets until the next search, so that each
+    bucket is sorted once for the whole batch instead of once per entry.
     """
 
     def __init__(self, searchable_fields=None):
@@ -68,45 +854,230 @@ class LogContainer(object):
 
         self._entries = []
         # searchable_fields is assumed to store names of fields present
-        # in each log entry
-        self._searchable_fields = searchable_fields or []
-        # buckets are always sorted lists which store pointers to entries
+        # in each log entry, optionally paired with index types
+        index_types = [(field, self.default_index_type)
+                       if isinstance(field, basestring) else tuple(field)
+                       for field in searchable_fields or []]
+        self._searchable_fields = [field for field, _ in index_types]
+        # buckets are indexes which store pointers to entries
         # and allow efficient search
-        self._buckets = dict([(field, []) for field in self._searchable_fields])
+        self._buckets = dict([(field, self._make_bucket(field, index_type))
+                              for field, index_type in index_types])
+        # converters are registered per instance, they may be bound methods
+        self._converters = dict(self._converters)
+        # guards buckets while entries are added and searched in different
+        # threads, eg. when following a log file
+        self._lock = threading.RLock()
+        # ResultCache of find_by(), off unless cache_results() is called
+        self._result_cache = None
+        # number of entries evicted from the start, positions of the stored
+        # ones are shifted down by it
+        self._dropped = 0
 
     _converters = { }
 
+    index_types = {
+        'sorted': SortedIndex,
+        'hash': HashIndex,
+        'text': TokenIndex,
+    }
+
+    default_index_type = 'sorted'
+
     @property
     def entries(self):
         """Provide access to entries"""
         return self._entries[:]
 
+    def _make_bucket(self, field, index_type):
+        try:
+            return self.index_types[index_type]()
+        except KeyError:
+            raise ValueError("Unknown index type '%s'" % index_type)
+
+    def _index_spec(self):
+        """Returns searchable fields paired with types of their indexes"""
+
+        type_names = dict([(index_type, name) for name, index_type
+                           in self.index_types.iteritems()])
+        return [(field, type_names[type(self._buckets[field])])
+                for field in self._searchable_fields]
+
+    def _store(self, entry):
+        """Stores entry at the end and returns its position"""
+        self._entries.append(entry)
+        return len(self._entries) - 1
+
+    def _count(self):
+        return len(self._entries)
+
+    def _entries_at(self, positions):
+        entries = self._entries
+        return [entries[i] for i in positions]
+
+    def _drop_stored(self, count):
+        """Drops the first count stored entries"""
+        del self._entries[:count]
+
+    def _current_positions(self, positions, dropped):
+        """
+        Returns positions found when dropped entries were evicted as they
+        are now, without entries evicted since
+        """
+
+        shift = self._dropped - dropped
+        if not shift:
+            return positions
+        return [position - shift for position in positions
+                if position >= shift]
+
+    def _evict_first(self, count):
+        """
+        Drops the first count entries and references to them, positions of
+        the other entries are shifted down by count. Returns number of
+        dropped entries.
+        """
+
+        count = min(count, self._count())
+        if count <= 0:
+            return 0
+        self._drop_stored(count)
+        for bucket in self._buckets.itervalues():
+            bucket.compact(count)
+        if self._result_cache is not None:
+            self._result_cache.compact(count)
+        self._dropped += count
+        return count
+
+    @_synchronized
+    def memory_usage(self):
+        """
+        Returns estimated number of bytes of memory taken by the container
+        by component, eg:
+
+            {'entries': 1250000, 'indexes': {'date': 410000, ...},
+             'result_cache': 0, 'total': 2140000}
+
+        Sizes of long sequences are estimated from samples of their items.
+        Objects shared by entries, eg. equal dates, are counted for each
+        entry.
+        """
+
+        usage = self._memory_usage()
+        usage['total'] = sum(sum(size.itervalues())
+                             if isinstance(size, dict) else size
+                             for size in usage.itervalues())
+        return usage
+
+    def _memory_usage(self):
+        """Returns memory_usage() without the total"""
+
+        cache = self._result_cache
+        return {
+            'entries': _estimated_size(self._entries, self._entry_size),
+            'indexes': dict([(field, bucket.memory_usage())
+                             for field, bucket in self._buckets.iteritems()]),
+            'result_cache': cache.size if cache is not None else 0,
+        }
+
+    def _entry_size(self, entry):
+        if isinstance(entry, tuple):
+            # fields as stored, eg. without reading mapped messages
+            return sum(imap(sys.getsizeof, tuple.__iter__(entry)),
+                       sys.getsizeof(entry))
+        return sys.getsizeof(entry)
+
+    def _sortable_value_at(self, position, field_name):
+        return self._marshall_value(
+            field_name, getattr(self._entries[position], field_name))
+
     def _marshall_value(self, field_name, value):
         converter = self._converters.get(field_name)
         if converter:
             return converter(value)
         return value
 
-    def append(self, entry):
-        """Appends log entry to end"""
-
-        self._entries.append(entry)
-
-        # add reference to row into sorted buckets
-        last_index = len(self._entries) - 1
+    def _sortable_values(self, entry):
+        sortable_values = []
         for field in self._searchable_fields:
-            # insert entry reference into bucket while preserving sorting
-            # sort order: field value, then the entry index
             try:
-                sortable_value = self._marshall_value(field,
-                                                      getattr(entry, field))
+                value = getattr(entry, field)
             except AttributeError:
                 raise ValueError("Entry %s doesn't have field '%s'"
                                  % (entry, field))
-            bisect.insort_right(self._buckets[field],
-                                (sortable_value, last_index))
+            sortable_values.append(self._marshall_value(field, value))
+        return sortable_values
+
+    @_synchronized
+    def cache_results(self, max_size=1 << 24):
+        """
+        Turns on caching of find_by() results, at most max_size bytes of
+        them are kept, max_size=0 turns caching off. Returns ResultCache
+        which counts hits and misses, eg:
+
+            cache = log_container.cache_results(max_size=64 << 20)
+            find_entries_with_log_level(log_container, 'ERROR')
+            cache.hits, cache.misses
+
+        Cached results stay correct as entries are added.
+        """
+
+        self._result_cache = ResultCache(max_size) if max_size else None
+        return self._result_cache
+
+    @property
+    def result_cache(self):
+        """ResultCache of find_by(), None if caching is off"""
+        return self._result_cache
+
+    def _cache_added(self, position, sortable_values):
+        self._result_cache.added(position, [
+            (field, sortable_value, self._buckets[field].ordered)
+            for field, sortable_value in zip(self._searchable_fields,
+                                             sortable_values)])
+
+    @_synchronized
+    def append(self, entry):
+        """Appends log entry to end"""
 
-    def find_by(self, field_name, value, value_to=None):
+        sortable_values = self._sortable_values(entry)
+        position = self._store(entry)
+        if self._result_cache is not None:
+            self._cache_added(position, sortable_values)
+
+        # add reference to row into sorted buckets
+        for field, sortable_value in zip(self._searchable_fields,
+                                         sortable_values):
+            bucket = self._buckets[field]
+            if bucket.pending:
+                # bucket is going to be sorted on next search anyway
+                bucket.add(sortable_value, position)
+            else:
+                # insert entry reference into bucket while preserving sorting
+                # sort order: field value, then the entry index
+                bucket.insert(sortable_value, position)
+
+    @_synchronized
+    def extend(self, entries):
+        """
+        Appends log entries to end.
+
+        Buckets aren't kept sorted while adding; references to the new
+        entries are merged into them on the first search on each field.
+        """
+
+        buckets = [self._buckets[field] for field in self._searchable_fields]
+        cached = self._result_cache is not None
+        for entry in entries:
+            sortable_values = self._sortable_values(entry)
+            position = self._store(entry)
+            for bucket, sortable_value in zip(buckets, sortable_values):
+                bucket.add(sortable_value, position)
+            if cached:
+                self._cache_added(position, sortable_values)
+
+    @_synchronized
+    def find_by(self, field_name, value, value_to=None, lazy=False):
         """
         Find all log entries which field_name has given value.
 
@@ -118,31 +1089,122 @@ class LogContainer(object):
 
         Passing 'field_name' that isn't one of the searchable fields specified
         in the class's constructor raises ValueError.
+
+        With lazy=True ResultView is returned instead of a list.
+
+        Results are cached when cache_results() was called.
         """
 
-        found = []
-        value = self._marshall_value(field_name, value)
-        if value_to:
-            value_to = self._marshall_value(field_name, value_to)
-        else:
-            value_to = value
+        bucket = self._bucket(field_name)
+        value, value_to = self._marshall_range(field_name, value, value_to)
+
+        cache = self._result_cache
+        if cache is None:
+            # find referenced entries
+            return self._found(bucket.find(value, value_to), lazy)
+        key = (field_name, value, value_to)
+        positions = cache.get(key)
+        if positions is None:
+            positions = bucket.find(value, value_to)
+            cache.put(key, positions, bucket.ordered and value == value_to)
+        # cached positions are extended in place as entries are added
+        return self._found(positions[:], lazy)
+
+    def _found(self, positions, lazy):
+        if lazy:
+            return ResultView(self, positions)
+        return self._entries_at(positions)
+
+    @_synchronized
+    def query(self, lazy=False, **conditions):
+        """
+        Find all log entries matching all given conditions.
+
+        Conditions are given as field_name=value or, to search for a range
+        of values, as field_name=(value, value_to), eg:
+
+            log_container.query(field_a=1, field_b=(1, 10))
+
+        Entries are returned in the same order as they are stored, as
+        a list or, with lazy=True, as ResultView.
+
+        Conditions are checked starting from the one matching the fewest
+        entries. Positions it finds are intersected with positions matching
+        the next condition when that one matches comparable number of
+        entries, otherwise the remaining candidates are checked one by one.
+
+        Passing field that isn't one of the searchable fields raises
+        ValueError.
+        """
+
+        return self._found(self._query_positions(conditions), lazy)
+
+    def _query_positions(self, conditions):
+        """Returns positions of entries matching conditions, see query()"""
+
+        plan = []
+        for field_name, value in conditions.iteritems():
+            bucket = self._bucket(field_name)
+            if isinstance(value, tuple):
+                value, value_to = value
+            else:
+                value_to = None
+            value, value_to = self._marshall_range(field_name, value,
+                                                   value_to)
+            if bucket.ordered:
+                found = None
+                count = bucket.count(value, value_to)
+            else:
+                # text conditions are counted by finding them, positions
+                # found are kept for the intersection
+                found = bucket.find(value, value_to)
+                count = len(found)
+            plan.append((count, field_name, bucket, value, value_to, found))
+        if not plan:
+            return array('l', xrange(self._count()))
+        plan.sort(key=lambda condition: condition[0])
+
+        count, _, bucket, value, value_to, found = plan[0]
+        if found is None:
+            found = bucket.find(value, value_to)
+        candidates = sorted(found)
+        for count, field_name, bucket, value, value_to, found in plan[1:]:
+            if not candidates:
+                break
+            if (count <= self._intersect_ratio * len(candidates)
+                    or not bucket.ordered):
+                if found is None:
+                    found = bucket.find(value, value_to)
+                matching = set(found)
+                candidates = [position for position in candidates
+                              if position in matching]
+            else:
+                candidates = [
+                    position for position in candidates
+                    if value <= self._sortable_value_at(position, field_name)
+                    <= value_to]
+        return candidates
+
+    # positions matching a condition are intersected with candidates if
+    # there are at most this many times more of them, otherwise candidates
+    # are checked one by one
+    _intersect_ratio = 4
+
+    def _bucket(self, field_name):
         try:
-            bucket = self._buckets[field_name]
+            return self._buckets[field_name]
         except KeyError:
             raise ValueError(
                 "Field %s doesn't exist or doesn't support search" 
                 % field_name)
 
-        # find first occurrence of value
-        low = bisect.bisect_left(bucket, (value, 0))
-        # find last occurrence of value_to
-        high = bisect.bisect_right(bucket,
-                                   (value_to, len(self._entries)),
-                                   lo=low)
-
-        # find referenced entries
-        found = [self._entries[i] for _, i in bucket[low:high]]
-        return found
+    def _marshall_range(self, field_name, value, value_to):
+        value = self._marshall_value(field_name, value)
+        if value_to:
+            value_to = self._marshall_value(field_name, value_to)
+        else:
+            value_to = value
+        return value, value_to
 
 
 class CustomLog(LogContainer):
@@ -152,11 +1214,59 @@ class CustomLog(LogContainer):
     It provides CustomLog.load() method which parses the log stream.
     Empty lines that aren't part of entry message or lines not conforming to
     the format are ignored
+
+    Lines are parsed by one of the parser engines:
+
+        'regex' - matches every line against the entry regexp
+        'fast' - slices fields of the line on fixed positions and caches
+                 parsed dates, falls back to the regexp for lines it can't
+                 parse itself (default)
+
+    Both engines produce identical entries, eg:
+
+        log_container = CustomLog(parser='regex')
+
+    Date is indexed with SortedIndex and other fields with HashIndex,
+    searchable_fields can be given to use other index types, eg:
+
+        log_container = CustomLog(searchable_fields=[
+            'date', 'loglevel', 'sessionid', 'businessid'])
+
+    Messages are searchable when they are indexed with TokenIndex, eg:
+
+        log_container = CustomLog(searchable_fields=[
+            'date', 'loglevel', 'sessionid', 'businessid',
+            ('message', 'text')])
+        log_container.query(message='authentication token',
+                            loglevel='ERROR')
+
+    Oldest entries can be evicted to keep the container within limits of
+    size and age, see retain().
     """
 
-    def __init__(self):
-        searchable_fields = ['date', 'loglevel', 'sessionid', 'businessid']
-        super(CustomLog, self).__init__(searchable_fields)
+    def __init__(self, parser='fast', searchable_fields=None):
+        super(CustomLog, self).__init__(searchable_fields
+                                        or self._default_searchable_fields)
+        try:
+            self._match_line = getattr(self, self._parsers[parser])
+        except KeyError:
+            raise ValueError("Unknown parser '%s'" % parser)
+        self._parser = parser
+        # dates parsed by the fast parser keyed by their text
+        self._date_cache = {}
+        # TraceIndex of each traced field, built on the first trace
+        self._traces = {}
+        # (path, first, end) of files loaded with load_many()
+        self._sources = []
+        # (max_entries, max_bytes, max_age in seconds), see retain()
+        self._retention = None
+        # latest marshalled date of entries before position _dated
+        self._dated = 0
+        self._latest_date = None
+        # bytes per entry measured by memory_usage() for max_bytes and
+        # number of entries at that time
+        self._entry_bytes = None
+        self._measured_count = 0
         self._converters['date'] = self._datetime_converter
         self._converters['loglevel'] = self._loglevel_converter
         self._converters['sessionid'] = self._xid_converter
@@ -183,6 +1293,50 @@ class CustomLog(LogContainer):
         def __repr__(self):
             return '"%s"' % self.__str__()
 
+    class MappedLogEntry(LogEntry):
+        """
+        LogEntry which message is read from a memory mapped log file only
+        when accessed. The message field stores offset of the message in
+        the file and its length packed into one number.
+
+        Subclasses holding the mapping are created for each mapped file
+        with CustomLog._mapped_entry_type()
+        """
+
+        __slots__ = ()
+
+        _log_map = None
+
+        @property
+        def message(self):
+            location = tuple.__getitem__(self, 5)
+            start = location >> 32
+            return self._log_map[start:start + (location & 0xffffffff)]
+
+        def __getitem__(self, index):
+            if isinstance(index, slice):
+                return tuple(self)[index]
+            if index in (5, -1):
+                return self.message
+            return tuple.__getitem__(self, index)
+
+        def __iter__(self):
+            for index in range(5):
+                yield tuple.__getitem__(self, index)
+            yield self.message
+
+        def __eq__(self, other):
+            return tuple(self) == other
+
+        def __ne__(self, other):
+            return tuple(self) != other
+
+        def __hash__(self):
+            return hash(tuple(self))
+
+        def _replace(self, **kwds):
+            return CustomLog.LogEntry._make(self)._replace(**kwds)
+
     _message_boundary = "'"
 
     # regexp for parsing entries - only captures 1st line of
@@ -196,6 +1350,25 @@ class CustomLog(LogContainer):
         r'(?P<message>%s.*)') % _message_boundary,
     )
 
+    # date is searched by ranges, other fields usually by equality
+    _default_searchable_fields = [
+        ('date', 'sorted'),
+        ('loglevel', 'hash'),
+        ('sessionid', 'hash'),
+        ('businessid', 'hash'),
+    ]
+
+    _parsers = {
+        'regex': '_match_regex',
+        'fast': '_match_fast',
+    }
+
+    # loglevels recognised by the fast parser, lines with other words in
+    # the loglevel field are left to the regexp
+    _fast_loglevels = frozenset(['DEBUG', 'WARN', 'ERROR'])
+
+    _max_cached_dates = 100000
+
     def _loglevel_converter(self, loglevel):
         if "ERROR" == loglevel:
             return 2
@@ -205,75 +1378,1041 @@ class CustomLog(LogContainer):
             return 8
         raise ValueError("Unknown loglevel")
 
+    _epoch = datetime(1970, 1, 1)
+
     def _datetime_converter(self, date):
-        return (date - datetime(1970, 1, 1)).total_seconds()
+        return (date - self._epoch).total_seconds()
 
     def _xid_converter(self, xid):
         return xid[4:]
 
-    def load(self, data):
-        """Loads log from stream and populates itself"""
+    @_synchronized
+    def aggregate(self, group_by=(), interval=None, date_range=None):
+        """
+        Counts entries grouped by values of fields and by time intervals.
+
+        Returns dict which keys are tuples of values of group_by fields,
+        preceded by the start of the interval when interval is given, eg:
+
+            log_container.aggregate(group_by=['businessid', 'loglevel'],
+                                    interval='1m')
+
+            {(datetime(2012, 9, 13, 16, 4), 'BID:1329', 'DEBUG'): 2, ...}
+
+        interval is given as number of seconds, timedelta or string like
+        '30s', '5m', '1h' or '1d'. Intervals start at multiples of their
+        length since the epoch.
+
+        date_range (date_from, date_to) limits counted entries to those
+        within the range (boundary values included).
+        """
+
+        group_by = list(group_by)
+        seconds = parse_interval(interval) if interval else None
+        positions = None
+        if date_range:
+            date_from, date_to = date_range
+            positions = self._bucket('date').find(
+                *self._marshall_range('date', date_from, date_to))
+
+        counts = self._count_groups(group_by, seconds, positions)
+        if not seconds:
+            return counts
+        starts = {}
+        aggregated = {}
+        for key, count in counts.iteritems():
+            start = starts.get(key[0])
+            if start is None:
+                start = starts[key[0]] = (
+                    self._epoch + timedelta(seconds=key[0] * seconds),)
+            aggregated[start + key[1:]] = count
+        return aggregated
+
+    def _count_groups(self, group_by, seconds, positions):
+        """
+        Counts entries at positions (all entries if None) by group_by field
+        values, preceded by number of interval since the epoch if seconds
+        is given
+        """
+
+        if positions is None:
+            positions = array('l', xrange(self._count()))
+        if group_by:
+            get_values = attrgetter(*group_by)
+        else:
+            get_values = lambda entry: ()
+        single_field = len(group_by) == 1
+        epoch = self._epoch
+        # entries often share date objects
+        interval_of = {}
+
+        counts = {}
+        for entry in ResultView(self, positions):
+            key = get_values(entry)
+            if single_field:
+                key = (key,)
+            if seconds:
+                date = entry.date
+                interval = interval_of.get(date)
+                if interval is None:
+                    interval = interval_of[date] = int(
+                        (date - epoch).total_seconds() // seconds)
+                key = (interval,) + key
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    @_synchronized
+    def trace(self, sessionid=None, requestid=None):
+        """
+        Returns Trace of entries of the session or of the request ordered
+        by date, eg:
+
+            trace = log_container.trace(sessionid='SID:34523')
+            trace.entries, trace.duration, trace.max_gap
+
+        Index of the field is built on its first trace and is updated with
+        entries added since the last trace, so following traces only look
+        up positions of the entries.
+        """
+
+        if (sessionid is None) == (requestid is None):
+            raise ValueError("Either sessionid or requestid has to be given")
+        if sessionid is not None:
+            field_name, value = 'sessionid', sessionid
+        else:
+            field_name, value = 'requestid', requestid
+        return Trace(self._entries_at(
+            self._trace_index(field_name).find(value)))
+
+    def _trace_index(self, field_name):
+        index = self._traces.get(field_name)
+        if index is None:
+            index = self._traces[field_name] = TraceIndex()
+        count = self._count()
+        if len(index) < count:
+            index.update(
+                self._trace_references(field_name, len(index), count),
+                lambda position: self._sortable_value_at(position, 'date'))
+        return index
+
+    def _trace_references(self, field_name, start, stop):
+        """
+        Returns (value of field, sortable date, position) of entries
+        between positions start and stop
+        """
+
+        get_value = attrgetter(field_name)
+        converter = self._datetime_converter
+        positions = array('l', xrange(start, stop))
+        return ((get_value(entry), converter(entry.date), position)
+                for entry, position in izip(ResultView(self, positions),
+                                            positions))
+
+    @_synchronized
+    def append(self, entry):
+        """Appends log entry to end, evicts entries as retain() set"""
+
+        super(CustomLog, self).append(entry)
+        self._enforce_retention()
+
+    @_synchronized
+    def extend(self, entries):
+        """
+        Appends log entries to end, see LogContainer.extend(). With
+        retention set by retain() entries are added in chunks and evicted
+        after each chunk.
+        """
+
+        if self._retention is None:
+            super(CustomLog, self).extend(entries)
+            return
+        entries = iter(entries)
+        while True:
+            chunk = list(islice(entries, self._retention_chunk))
+            if not chunk:
+                break
+            super(CustomLog, self).extend(chunk)
+            self._enforce_retention()
+
+    # entries added at once by extend() with retention set
+    _retention_chunk = 10000
+
+    # once a limit is exceeded entries are evicted until the container is
+    # this fraction below it, so they're evicted in batches
+    _retention_slack = 0.1
+
+    @_synchronized
+    def retain(self, max_entries=None, max_bytes=None, max_age=None):
+        """
+        Sets retention policy, entries are evicted as they're added so that
+        the container holds at most max_entries entries, takes at most about
+        max_bytes of memory (see memory_usage()) and holds entries dated at
+        most max_age before the latest date in the log, eg:
+
+            log_container.retain(max_entries=10 ** 6, max_age='1d')
+
+        max_age is given like interval of aggregate(). Called without limits
+        retention is turned off.
+
+        Entries are evicted in the order they were added, in batches: once
+        a limit is exceeded the container is brought 10% below it. Entries
+        older than max_age are evicted from the start of the log up to the
+        first one which isn't, the log is assumed to be roughly ordered by
+        date. Buckets, traces and cached results are compacted with each
+        batch.
+
+        Returns number of entries evicted right away.
+        """
+
+        if max_entries is None and max_bytes is None and max_age is None:
+            self._retention = None
+            return 0
+        self._retention = (max_entries, max_bytes,
+                           parse_interval(max_age) if max_age else None)
+        self._entry_bytes = None
+        return self._enforce_retention()
+
+    def _enforce_retention(self):
+        """Evicts entries exceeding limits of retain(), returns their number"""
+
+        if self._retention is None:
+            return 0
+        max_entries, max_bytes, max_age = self._retention
+        keep = 1 - self._retention_slack
+        evicted = 0
+        count = self._count()
+        if max_entries is not None and count > max_entries:
+            evicted += self._evict_first(count - int(max_entries * keep))
+            count = self._count()
+        if max_bytes is not None and count:
+            # memory is measured again once the container has grown since
+            # the last measurement, in between it's estimated
+            if (self._entry_bytes is None
+                    or count > self._measured_count
+                    * (1 + self._retention_slack)):
+                self._entry_bytes = (float(self.memory_usage()['total'])
+                                     / count)
+                self._measured_count = count
+            if count * self._entry_bytes > max_bytes:
+                evicted += self._evict_first(
+                    count - int(max_bytes * keep / self._entry_bytes))
+                self._measured_count = count = self._count()
+        if max_age is not None and count:
+            latest = self._latest()
+            if self._first_date() < latest - max_age:
+                evicted += self._evict_older(latest - max_age * keep)
+        return evicted
+
+    def _first_date(self):
+        """Returns marshalled date of the first entry"""
+        return self._sortable_value_at(0, 'date')
+
+    def _latest(self):
+        """Returns the latest marshalled date of entries"""
+
+        count = self._count()
+        if self._dated < count:
+            latest = max(self._sortable_value_at(position, 'date')
+                         for position in xrange(self._dated, count))
+            if self._latest_date is None or latest > self._latest_date:
+                self._latest_date = latest
+            self._dated = count
+        return self._latest_date
+
+    def _evict_older(self, date):
+        """
+        Evicts entries from the start of the log up to the first one dated
+        at or after marshalled date, returns their number
+        """
+
+        count = self._count()
+        for position in xrange(count):
+            if self._sortable_value_at(position, 'date') >= date:
+                count = position
+                break
+        return self._evict_first(count)
+
+    def _evict_first(self, count):
+        count = super(CustomLog, self)._evict_first(count)
+        for index in self._traces.itervalues():
+            index.compact(count)
+        self._dated = max(0, self._dated - count)
+        # sources which entries were all evicted aren't needed anymore
+        self._sources = [source for source in self._sources
+                         if source[2] > self._dropped]
+        return count
+
+    def _memory_usage(self):
+        usage = super(CustomLog, self)._memory_usage()
+        usage['traces'] = dict([(field, index.memory_usage())
+                                for field, index in self._traces.iteritems()])
+        return usage
+
+    def load(self, data, bulk=False):
+        """
+        Loads log from stream and populates itself
+
+        With bulk=True the entries are added with extend() so the buckets
+        are sorted once after the load rather than on every entry.
+        """
+
+        if bulk:
+            self.extend(self._parse(data))
+        else:
+            for entry in self._parse(data):
+                self.append(entry)
+
+    def save(self, path, source=None):
+        """
+        Saves entries and indexes to a snapshot file, which can be opened
+        with ColumnarCustomLog.open(), see logparser.columnar
+        """
+
+        # columnar module depends on this one
+        from .columnar import ColumnarCustomLog
+
+        columnar_log = ColumnarCustomLog(self._parser, self._index_spec())
+        columnar_log.extend(self.entries)
+        columnar_log.save(path, source)
+
+    def follow(self, path, interval=None):
+        """
+        Loads log file and keeps loading entries appended to it later
+
+        Returns LogFollower which loads new entries on refresh(). With
+        interval given it also refreshes in a background thread every
+        interval seconds, until stopped with LogFollower.stop().
+        """
+
+        follower = LogFollower(self, path)
+        follower.refresh()
+        if interval:
+            follower.start(interval)
+        return follower
+
+    def load_file(self, path, mmap=False, bulk=True):
+        """
+        Loads log file and populates itself
+
+        The file is read with load() unless mmap=True. Then the file is
+        memory mapped and scanned for entries without reading it line by
+        line. Messages stay in the mapping and are read only when entry's
+        message is accessed, see MappedLogEntry.
+
+        Warning: with mmap=True the file mustn't be truncated or rewritten
+        while its entries are used, eg. by logrotate's copytruncate.
+        Accessing a message beyond the end of the truncated file kills
+        the process with SIGBUS.
+
+        Entries are added with extend() unless bulk=False.
+
+        Files compressed with gzip, bzip2 or zstd (requires zstandard
+        package) are recognised by their contents and decompressed while
+        they're parsed, see _parse_compressed(). mmap is ignored for them.
+        """
+
+        if mmap and not self._compression_of(path):
+            entries = self._parse_mapped(path)
+        else:
+            entries = self._parse_path(path)
+        if bulk:
+            self.extend(entries)
+        else:
+            for entry in entries:
+                self.append(entry)
+
+    def load_many(self, paths, workers=None):
+        """
+        Loads many log files and populates itself
+
+        Files are parsed by a pool of worker processes (or in this process
+        when workers=1), each worker also sorts entries of its file by
+        date. Entries are added file after file in order of paths. Sorted
+        buckets get references of each file as a run sorted by value, so
+        on the next search the runs are merged rather than sorted again.
+
+        File each entry was loaded from is recorded, see sources and
+        source_of().
+        """
+
+        workers = workers or multiprocessing.cpu_count()
+        files = [(path, self._parser) for path in paths]
+        if workers == 1:
+            self._extend_files(paths, imap(_parse_log_file, files))
+            return
+
+        pool = multiprocessing.Pool(min(workers, len(files) or 1))
+        try:
+            self._extend_files(paths, pool.imap(_parse_log_file, files))
+        finally:
+            pool.close()
+            pool.join()
+
+    def _extend_files(self, paths, parsed_files):
+        for path, (fields, date_order) in izip(paths, parsed_files):
+            with self._lock:
+                first = self._sequence_count()
+                self._extend_sorted([self.LogEntry._make(entry_fields)
+                                     for entry_fields in fields], date_order)
+                self._sources.append((path, first, self._sequence_count()))
+                self._enforce_retention()
+
+    def _extend_sorted(self, entries, date_order):
+        """
+        Appends log entries to end like extend(), date_order holds indexes
+        of entries sorted by date
+        """
+
+        fields = self._searchable_fields
+        buckets = [self._buckets[field] for field in fields]
+        # references added to sorted buckets as runs
+        runs = [[] if hasattr(bucket, 'add_run') else None
+                for bucket in buckets]
+        cached = self._result_cache is not None
+        for entry in entries:
+            sortable_values = self._sortable_values(entry)
+            position = self._store(entry)
+            for bucket, run, sortable_value in zip(buckets, runs,
+                                                   sortable_values):
+                if run is None:
+                    bucket.add(sortable_value, position)
+                else:
+                    run.append((sortable_value, position))
+            if cached:
+                self._cache_added(position, sortable_values)
+        for field, bucket, run in zip(fields, buckets, runs):
+            if run is None:
+                continue
+            if field == 'date':
+                run = [run[i] for i in date_order]
+            else:
+                run.sort()
+            bucket.add_run(run)
+
+    def _sequence_count(self):
+        """Returns number of entries added so far, including dropped ones"""
+        return self._count() + self._dropped
+
+    def _sequence_of(self, position):
+        """Returns number of entry at position in order of adding"""
+        return position + self._dropped
+
+    @property
+    def sources(self):
+        """
+        Returns (path, first, end) of files loaded with load_many(), first
+        and end are numbers of entries in order of adding, end excluded
+        """
+        return self._sources[:]
+
+    @_synchronized
+    def source_of(self, entry):
+        """
+        Returns path of file the entry was loaded from with load_many() or
+        None if it wasn't
+        """
+
+        found = self.find_by('date', entry.date, lazy=True)
+        ends = [end for _, _, end in self._sources]
+        for position, found_entry in izip(found._positions, found):
+            if found_entry == entry:
+                index = bisect.bisect_right(ends, self._sequence_of(position))
+                if index < len(ends) and \
+                        self._sources[index][1] <= self._sequence_of(position):
+                    return self._sources[index][0]
+                return None
+        return None
+
+    def _parse_path(self, path):
+        """Parses log file, compressed or not, and yields complete entries"""
+
+        compression = self._compression_of(path)
+        if compression:
+            return self._parse_compressed(path, compression)
+        return self._parse_file(path)
+
+    def _parse_file(self, path):
+        with open(path, 'rb') as log_file:
+            for entry in self._parse(log_file):
+                yield entry
+
+    # compressions recognised by the magic numbers files start with
+    _compressions = [
+        ('\x1f\x8b', 'gzip'),
+        ('BZh', 'bzip2'),
+        ('\x28\xb5\x2f\xfd', 'zstd'),
+    ]
+
+    # size of blocks the compressed file is read in
+    _compressed_block_size = 1 << 18
+
+    # decompressed blocks buffered ahead of the parser
+    _read_ahead_blocks = 16
+
+    def _compression_of(self, path):
+        with open(path, 'rb') as log_file:
+            head = log_file.read(4)
+        for magic, compression in self._compressions:
+            if head.startswith(magic):
+                return compression
+        return None
+
+    def _parse_compressed(self, path, compression):
+        """
+        Parses compressed log file and yields complete entries.
+
+        File is decompressed in a background thread which puts blocks of
+        the log into a bounded queue for the parser. zlib, bz2 and
+        zstandard release the GIL while decompressing, so decompression
+        runs alongside parsing.
+        """
+
+        blocks = Queue.Queue(self._read_ahead_blocks)
+        stopped = threading.Event()
+        reader = threading.Thread(target=self._read_decompressed,
+                                  args=(path, compression, blocks, stopped))
+        reader.daemon = True
+        reader.start()
+        try:
+            for entry in self._parse(self._queued_lines(blocks)):
+                yield entry
+        finally:
+            stopped.set()
+            reader.join()
+
+    def _read_decompressed(self, path, compression, blocks, stopped):
+        """Puts decompressed blocks and None at the end into blocks queue"""
+
+        def put(item):
+            # the parser may stop reading, eg. on error
+            while not stopped.is_set():
+                try:
+                    blocks.put(item, timeout=0.1)
+                    return True
+                except Queue.Full:
+                    pass
+            return False
+
+        try:
+            for block in self._decompressed_blocks(path, compression):
+                if block and not put(block):
+                    return
+        except Exception:
+            put(sys.exc_info())
+        else:
+            put(None)
+
+    def _decompressed_blocks(self, path, compression):
+        block_size = self._compressed_block_size
+        with open(path, 'rb') as compressed:
+            if compression == 'bzip2':
+                blocks = self._bzip2_blocks(compressed, block_size)
+            else:
+                if compression == 'gzip':
+                    # GzipFile checks CRCs and reads files of many members
+                    read = gzip.GzipFile(fileobj=compressed).read
+                elif zstandard is None:
+                    raise ValueError("zstandard package is needed to load "
+                                     "zstd compressed %s" % path)
+                else:
+                    # files of many frames, eg. concatenated, are read
+                    # through
+                    read = zstandard.ZstdDecompressor().stream_reader(
+                        compressed, read_across_frames=True).read
+                blocks = iter(lambda: read(block_size), '')
+            for block in blocks:
+                yield block
+
+    def _bzip2_blocks(self, compressed, block_size):
+        """
+        Yields decompressed blocks of bzip2 file of one or more streams,
+        BZ2File only reads the first one
+        """
+
+        decompressor = bz2.BZ2Decompressor()
+        for data in iter(lambda: compressed.read(block_size), ''):
+            while data:
+                try:
+                    block = decompressor.decompress(data)
+                except EOFError:
+                    # previous stream ended right at the end of its data
+                    decompressor = bz2.BZ2Decompressor()
+                    continue
+                yield block
+                data = decompressor.unused_data
+                if data:
+                    decompressor = bz2.BZ2Decompressor()
+        # decompressor refuses more data only after the end of stream
+        try:
+            decompressor.decompress('')
+        except EOFError:
+            return
+        raise EOFError("Compressed file ended before the end-of-stream "
+                       "marker was reached")
+
+    def _queued_lines(self, blocks):
+        partial_line = ''
+        while True:
+            block = blocks.get()
+            if block is None:
+                break
+            if isinstance(block, tuple):
+                # exception raised while decompressing
+                raise block[0], block[1], block[2]
+            lines = (partial_line + block).split('\n')
+            partial_line = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        if partial_line:
+            yield partial_line
+
+    def _mapped_entry_type(self, log_map):
+        return type('MappedLogEntry', (self.MappedLogEntry,),
+                    {'__slots__': (), '_log_map': log_map})
+
+    _whitespace = ' \t\n\r\x0b\x0c'
+
+    def _parse_mapped(self, path):
+        """
+        Parses memory mapped log file and yields complete entries.
+
+        Follows the same rules as _parse() but works on positions in the
+        mapping. Message of an entry is always a contiguous part of the
+        file, from its opening to its closing boundary, so only the
+        positions of these are kept.
+        """
+
+        with open(path, 'rb') as log_file:
+            if not os.fstat(log_file.fileno()).st_size:
+                return
+            log_map = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+        make_entry = self._mapped_entry_type(log_map)._make
+        match_line = self._match_line
+        # loglevels and ids repeat a lot, entries share one copy of each
+        shared = {}
+        boundary = self._message_boundary
+        whitespace = self._whitespace
+        size = len(log_map)
+        fields = None
+        position = 0
+        while position < size:
+            line_end = log_map.find('\n', position)
+            if line_end == -1:
+                line_end = size
+            # header can't contain the boundary so the entry regexp matches
+            # the line iff it matches the line cut after the first boundary
+            message_start = log_map.find(boundary, position, line_end)
+            matched = None
+            if message_start != -1:
+                matched = match_line(log_map[position:message_start + 1])
+            if matched:
+                date, loglevel, sessionid, businessid, requestid, _ = matched
+                fields = (date,
+                          shared.setdefault(loglevel, loglevel),
+                          shared.setdefault(sessionid, sessionid),
+                          shared.setdefault(businessid, businessid),
+                          requestid)
+                entry_start = message_start
+                if log_map[line_end - 1] == boundary:
+                    # message complete in one line
+                    yield make_entry(fields + (
+                        entry_start << 32 | line_end - entry_start,))
+                    fields = None
+            elif fields:
+                last = line_end - 1
+                while last >= position and log_map[last] in whitespace:
+                    last -= 1
+                if last >= position and log_map[last] == boundary:
+                    # it's the last line of entry
+                    yield make_entry(fields + (
+                        entry_start << 32 | last + 1 - entry_start,))
+                    fields = None
+            position = line_end + 1
+
+    def load_parallel(self, path, workers=None, chunk_size=None):
+        """
+        Loads log file using a pool of worker processes and populates itself
+
+        File is split into byte ranges of chunk_size bytes (by default
+        4 ranges per worker) which are parsed by separate processes.
+        Entry belongs to the range in which its 1st line starts, so each
+        worker skips lines until the first line starting an entry and
+        reads past the end of its range until the last entry is complete.
+        Entries are added in the same order as load() would add them.
+        """
+
+        workers = workers or multiprocessing.cpu_count()
+        file_size = os.path.getsize(path)
+        if not chunk_size:
+            chunk_size = file_size // (workers * 4) + 1
+        chunks = [(path, start, start + chunk_size, self._parser)
+                  for start in range(0, file_size, chunk_size)]
+
+        if workers == 1:
+            # no point in shipping entries between processes
+            for _, start, end, _ in chunks:
+                with open(path, 'rb') as stream:
+                    self.extend(self._parse(
+                        self._chunk_lines(stream, start, end)))
+            return
+
+        pool = multiprocessing.Pool(workers)
+        try:
+            for fields in pool.imap(_parse_chunk, chunks):
+                self._extend_fields(fields)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _extend_fields(self, fields):
+        self.extend([self.LogEntry._make(entry_fields)
+                     for entry_fields in fields])
+
+    def _chunk_lines(self, stream, start, end):
+        """Yields lines of entries which 1st line starts in [start, end)"""
+
+        if start:
+            # skip the line that started in the previous range
+            stream.seek(start - 1)
+            stream.readline()
+        position = stream.tell()
+
+        # lines up to the 1st entry belong to an entry of previous range
+        line = stream.readline()
+        while line and not self._entry_re.match(line):
+            position += len(line)
+            line = stream.readline()
+
+        while line:
+            if position >= end and self._entry_re.match(line):
+                # entry of the next range
+                break
+            yield line
+            position += len(line)
+            line = stream.readline()
+
+    def _match_regex(self, line):
+        """
+        Parses 1st line of an entry with the entry regexp.
+
+        Returns tuple of entry fields or None when line doesn't start
+        an entry
+        """
+
+        match = self._entry_re.match(line)
+        if match:
+            date, loglevel, sessionid, businessid, requestid, message = \
+                match.groups()
+            return (datetime.strptime(date, self.date_format),
+                    loglevel, sessionid, businessid, requestid, message)
+        return None
+
+    def _match_fast(self, line):
+        """
+        Parses 1st line of an entry relying on fixed positions of its fields.
+
+        Lines that don't have the typical shape are passed to _match_regex,
+        so that results are always the same as with the regexp.
+        """
+
+        parts = line.split(' ', 6)
+        if len(parts) == 7:
+            day, time, loglevel, sessionid, businessid, requestid, message = \
+                parts
+            if message[-1:] == '\n':
+                message = message[:-1]
+            if (loglevel in self._fast_loglevels
+                    and sessionid[:4] == 'SID:' and sessionid[4:].isdigit()
+                    and businessid[:4] == 'BID:' and businessid[4:].isdigit()
+                    and requestid[:4] == 'RID:' and len(requestid) > 4
+                    and not requestid[4:].strip('0123456789abcdef')
+                    and message[:1] == self._message_boundary
+                    and '\n' not in message):
+                date = None
+                if len(day) == 10 and len(time) == 8:
+                    date = (self._date_cache.get(line[:19])
+                            or self._parse_date(day, time))
+                if date is not None:
+                    return (date, loglevel, sessionid, businessid,
+                            requestid, message)
+        return self._match_regex(line)
+
+    def _parse_date(self, day, time):
+        """Parses date in date_format, returns None if it's malformed"""
+
+        if (day[4] != '-' or day[7] != '-' or time[2] != ':'
+                or time[5] != ':'):
+            return None
+        digits = day[:4] + day[5:7] + day[8:] + time[:2] + time[3:5] + time[6:]
+        if not digits.isdigit():
+            return None
+        date = datetime(int(digits[:4]), int(digits[4:6]), int(digits[6:8]),
+                        int(digits[8:10]), int(digits[10:12]),
+                        int(digits[12:]))
+        if len(self._date_cache) >= self._max_cached_dates:
+            self._date_cache.clear()
+        self._date_cache[day + ' ' + time] = date
+        return date
+
+    def _parse(self, data, incomplete=None):
+        """
+        Parses log stream and yields complete entries
+
+        When incomplete list is given, the entry which is incomplete at
+        the end of data is stored in it once data is exhausted. Passing
+        the same list to the next call continues that entry.
+        """
 
         # log stream is read one line at a time
-        # the processing loop delays adding the entry until a potentially
+        # the processing loop delays yielding the entry until a potentially
         # multiline message is complete
         # if a new entry is recognised while the old one is still incomplete
-        # then the old one is never added to the container
-        entry_data = {}
+        # then the old one is never yielded
+        match_line = self._match_line
+        make_entry = self.LogEntry._make
+        boundary = self._message_boundary
+        fields, message_lines = incomplete or (None, None)
         for line in data:
             # lines contain newline chars that are stripped at the end of full
             # entry but retained when part of the entry
-            match = self._entry_re.match(line)
-            if match:
-                entry_data = dict(
-                    date=datetime.strptime(match.group('date'),
-                                           self.date_format),
-                    loglevel=match.group('loglevel'),
-                    sessionid=match.group('sessionid'),
-                    businessid=match.group('businessid'),
-                    requestid=match.group('requestid'),
-                    message=match.group('message'))
-
-                if entry_data['message'][-1] == self._message_boundary:
+            matched = match_line(line)
+            if matched:
+                if matched[-1][-1] == boundary:
                     # message complete in one line
-                    self.append(self.LogEntry(**entry_data))
-                    entry_data = {}
+                    yield make_entry(matched)
+                    fields = None
                 else:
                     # add back the newline that regexp dropped
                     # it's part of the message
-                    entry_data['message'] += '\n'
+                    fields = matched[:-1]
+                    message_lines = [matched[-1], '\n']
 
-            elif entry_data:
+            elif fields:
                 stripped = line.rstrip() 
-                if not stripped or stripped[-1] != self._message_boundary:
+                if not stripped or stripped[-1] != boundary:
                     # part of the message field
-                    entry_data['message'] += line
+                    message_lines.append(line)
                 else:
                     # it's the last line of entry
-                    entry_data['message'] += stripped
+                    message_lines.append(stripped)
                     # create entry
-                    self.append(self.LogEntry(**entry_data))
-                    entry_data = {}
+                    yield make_entry(fields + (''.join(message_lines),))
+                    fields = None
+
+        if incomplete is not None:
+            incomplete[:] = [fields, message_lines] if fields else []
+
+
+class LogFollower(object):
+    """
+    LogFollower loads entries appended to a growing log file into a CustomLog
+
+    Each refresh() reads only data appended since the previous one. Line
+    that isn't complete yet (doesn't end with a newline) and entry which
+    message isn't complete yet are kept until the rest of them is appended.
+
+    When the file is rotated (path points to a new file) the rest of the old
+    file is read before following the new one from its start. When the file
+    is truncated it's followed from its start again. Incomplete line or
+    entry at the end of the old content is dropped in both cases.
+
+    Usage:
+
+        follower = log_container.follow(path)
+        ...
+        follower.refresh()
+    """
+
+    def __init__(self, log_container, path):
+        self._log_container = log_container
+        self._path = path
+        self._file = None
+        self._offset = 0
+        # end of the last line if it's not complete yet
+        self._partial_line = ''
+        # state of entry which message isn't complete, see CustomLog._parse
+        self._incomplete = []
+        # first bytes of the file, tell if it was truncated and rewritten
+        self._head = ''
+        self._stopped = threading.Event()
+        self._thread = None
+        # refresh() may be called while the background thread refreshes
+        self._lock = threading.RLock()
+
+    # size of blocks the file is read in
+    _block_size = 1 << 20
+
+    _head_size = 256
+
+    @property
+    def offset(self):
+        """Position in the followed file up to which it has been read"""
+        return self._offset
+
+    @_synchronized
+    def refresh(self):
+        """Loads entries appended since last refresh, returns their number"""
+
+        added = 0
+        if self._file is None:
+            self._open()
+        elif self._rotated():
+            # finish the old file before switching to the new one
+            added += self._read()
+            self._file.close()
+            self._open()
+        elif self._truncated():
+            # what was pending is gone
+            self._reset()
+        if self._file is not None:
+            added += self._read()
+        return added
+
+    def start(self, interval):
+        """Refreshes every interval seconds in a background thread"""
+
+        def follow():
+            while not self._stopped.wait(interval):
+                self.refresh()
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=follow)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops refreshing in background and closes the followed file"""
+
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open(self):
+        try:
+            self._file = open(self._path, 'rb')
+        except IOError:
+            # rotated file may not be created yet
+            self._file = None
+        self._reset()
+
+    def _reset(self):
+        self._offset = 0
+        self._partial_line = ''
+        self._incomplete = []
+        self._head = ''
+
+    def _truncated(self):
+        if os.fstat(self._file.fileno()).st_size < self._offset:
+            return True
+        self._file.seek(0)
+        return self._file.read(len(self._head)) != self._head
+
+    def _rotated(self):
+        try:
+            inode = os.stat(self._path).st_ino
+        except OSError:
+            return False
+        return inode != os.fstat(self._file.fileno()).st_ino
+
+    def _read(self):
+        log_container = self._log_container
+        added = 0
+        self._file.seek(self._offset)
+        while True:
+            block = self._file.read(self._block_size)
+            if not block:
+                break
+            if len(self._head) < self._head_size:
+                self._head += block[:self._head_size - len(self._head)]
+            self._offset += len(block)
+            lines = (self._partial_line + block).split('\n')
+            self._partial_line = lines.pop()
+            entries = list(log_container._parse(
+                [line + '\n' for line in lines], self._incomplete))
+            log_container.extend(entries)
+            added += len(entries)
+        return added
+
+
+_interval_re = re.compile(r'(\d+)([smhd])$')
+
+_interval_units = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+def parse_interval(interval):
+    """
+    Returns number of seconds of interval given as number of seconds,
+    timedelta or string like '30s', '5m', '1h' or '1d'
+    """
+
+    if isinstance(interval, timedelta):
+        seconds = interval.total_seconds()
+    elif isinstance(interval, basestring):
+        match = _interval_re.match(interval.strip())
+        if not match:
+            raise ValueError("Invalid interval '%s'" % interval)
+        seconds = int(match.group(1)) * _interval_units[match.group(2)]
+    else:
+        seconds = interval
+    if seconds <= 0:
+        raise ValueError("Interval must be positive")
+    return seconds
+
+
+def _parse_chunk(chunk):
+    """
+    Parses entries of a byte range of a log file. Returns entries as plain
+    tuples so that they can be sent from a pool's worker process.
+    """
+
+    path, start, end, parser = chunk
+    log_container = CustomLog(parser=parser)
+    with open(path, 'rb') as stream:
+        lines = log_container._chunk_lines(stream, start, end)
+        return [tuple(entry) for entry in log_container._parse(lines)]
+
+
+def _parse_log_file(log_file):
+    """
+    Parses entries of a log file. Returns entries as plain tuples so that
+    they can be sent from a pool's worker process, along with indexes of
+    entries sorted by date.
+    """
+
+    path, parser = log_file
+    log_container = CustomLog(parser=parser)
+    fields = [tuple(entry) for entry in log_container._parse_path(path)]
+    date_order = array('l', sorted(xrange(len(fields)),
+                                   key=lambda i: fields[i][0]))
+    return fields, date_order
 
 
 # functions requested in the assignment that query by particular fields
 
-def find_entries_with_log_level(log_container, log_level):
+def find_entries_with_log_level(log_container, log_level, lazy=False):
     """Finds entries with the specified log level."""
-    return log_container.find_by('loglevel', log_level)
+    return log_container.find_by('loglevel', log_level, lazy=lazy)
 
-def find_entries_with_business_id(log_container, business_id):
+def find_entries_with_business_id(log_container, business_id, lazy=False):
     """Finds entries with the specified business id"""
-    return log_container.find_by('businessid', business_id)
+    return log_container.find_by('businessid', business_id, lazy=lazy)
 
-def find_entries_within_date_range(log_container, date_from, date_to):
+def find_entries_within_date_range(log_container, date_from, date_to,
+                                   lazy=False):
     """Finds entries within the range of dates specified"""
     if isinstance(date_from, str):
         date_from = datetime.strptime(date_from, log_container.date_format)
     if isinstance(date_to, str):
         date_to = datetime.strptime(date_to, log_container.date_format)
-    return log_container.find_by('date', date_from, date_to)
+    return log_container.find_by('date', date_from, date_to, lazy=lazy)
 
-def find_entries_with_session_id(log_container, session_id):
+def find_entries_with_session_id(log_container, session_id, lazy=False):
     """Finds entries with the specified session id"""
-    return log_container.find_by('sessionid', session_id)
+    return log_container.find_by('sessionid', session_id, lazy=lazy)
+
+def find_entries_with_message(log_container, phrase, lazy=False):
+    """Finds entries which message contains the phrase, see TokenIndex"""
+    return log_container.find_by('message', phrase, lazy=lazy)
@@ -0,0 +1,501 @@
+"""
+Module provides log container partitioned by time.
+
+PartitionedCustomLog keeps entries in shards - separate CustomLog
+containers each holding entries from one time window, eg. one hour.
+Searches by date only touch shards of windows within the searched range,
+so they stay fast no matter how many windows are loaded. Old shards can
+be evicted, or spilled to snapshot files which searches open when they
+need them. Retention set with retain() evicts whole shards.
+"""
+
+from array import array
+from collections import OrderedDict
+from datetime import timedelta
+from itertools import groupby
+import bisect
+import heapq
+import os
+import sys
+
+from .logparser import CustomLog, Trace, parse_interval, _synchronized
+
+
+class PartitionedCustomLog(CustomLog):
+    """
+    CustomLog which stores entries in shards by time windows.
+
+    Usage is the same as of CustomLog, length of windows is given as
+    partition, in a form accepted by parse_interval(), eg:
+
+        log_container = PartitionedCustomLog(partition='1h')
+        log_container.load(stream)
+        find_entries_within_date_range(log_container, date_from, date_to)
+
+    Results are the same, and in the same order, as results of CustomLog.
+
+    Shards are CustomLog containers unless other shard_type is given,
+    searchable_fields are passed to shards. Results cached with
+    cache_results() are kept by the partitioned container, not by shards.
+    """
+
+    def __init__(self, partition='1h', parser='fast', searchable_fields=None,
+                 shard_type=CustomLog):
+        super(PartitionedCustomLog, self).__init__(parser, searchable_fields)
+        self._partition = parse_interval(partition)
+        self._shard_type = shard_type
+        self._shard_fields = searchable_fields
+        # shards and sequence numbers of their entries in the whole log
+        # by number of window since the epoch
+        self._shards = {}
+        self._sequences = {}
+        # snapshot files and sizes of spilled shards by window, and the
+        # first and the last sequence number of their entries
+        self._spilled = {}
+        self._spilled_sequences = {}
+        # spilled shards opened by recent searches and their sequence
+        # numbers, least recently used first
+        self._opened = OrderedDict()
+        # number of entries evicted before each shard was created, lazy
+        # results found before an eviction don't refer to shards created
+        # after it
+        self._created = {}
+        self._next_sequence = 0
+
+    @property
+    def entries(self):
+        """Provide access to entries"""
+        return self._entries_at(self._merged_references(
+            [(window, array('l', xrange(self._shard(window)._count())))
+             for window in self._windows()]))
+
+    # number of spilled shards kept open after searches which read them
+    _opened_limit = 2
+
+    @property
+    def windows(self):
+        """Returns start dates of windows which have shards"""
+
+        return [self._epoch + timedelta(seconds=window * self._partition)
+                for window in self._windows()]
+
+    def _window_of(self, date):
+        return int(self._datetime_converter(date) // self._partition)
+
+    def _windows(self, date_from=None, date_to=None):
+        """Returns sorted windows, only those within dates if given"""
+
+        windows = sorted(set(self._shards) | set(self._spilled))
+        if date_from is not None:
+            first = self._window_of(date_from)
+            last = self._window_of(date_to)
+            windows = [window for window in windows
+                       if first <= window <= last]
+        return windows
+
+    def _shard(self, window, create=False):
+        """
+        Returns shard of window, spilled shard is only opened for reading
+        unless create=True, then it's loaded back to stay in memory
+        """
+
+        shard = self._shards.get(window)
+        if shard is None:
+            if window in self._spilled:
+                if create:
+                    shard = self._load_spilled(window)
+                else:
+                    shard = self._open_spilled(window)[0]
+            elif create:
+                shard = self._shards[window] = self._shard_type(
+                    self._parser, self._shard_fields)
+                self._sequences[window] = array('l')
+                self._created[window] = self._dropped
+            else:
+                raise KeyError(window)
+        return shard
+
+    def _count(self):
+        return (sum(shard._count() for shard in self._shards.itervalues())
+                + sum(count for _, count in self._spilled.itervalues()))
+
+    # entries of shards are referred to by numbers: window in high bits,
+    # position in the shard in low 32 bits
+
+    def _entries_at(self, references):
+        entries = []
+        for window, shard_references in groupby(
+                references, lambda reference: reference >> 32):
+            entries.extend(self._shard(window)._entries_at(
+                [reference & 0xffffffff for reference in shard_references]))
+        return entries
+
+    def _merged_references(self, found):
+        """
+        Returns references to entries found in shards in order of the log,
+        found is a list of (window, positions in log order) pairs
+        """
+
+        merged = []
+        for window, positions in found:
+            sequences = self._sequences_of(window)
+            merged.append([(sequences[position], window << 32 | position)
+                           for position in positions])
+        return array('l', (reference for _, reference
+                           in heapq.merge(*merged)))
+
+    @_synchronized
+    def append(self, entry):
+        """Appends log entry to end"""
+
+        window = self._window_of(self._date_of(entry))
+        shard = self._shard(window, create=True)
+        shard.append(entry)
+        self._sequences[window].append(self._next_sequence)
+        self._next_sequence += 1
+        if self._result_cache is not None:
+            self._cache_added(window << 32 | shard._count() - 1,
+                              self._sortable_values(entry))
+        self._enforce_retention()
+
+    @_synchronized
+    def extend(self, entries):
+        """Appends log entries to end, see LogContainer.extend()"""
+
+        batch = []
+        batch_window = None
+        for entry in entries:
+            window = self._window_of(self._date_of(entry))
+            if window != batch_window and batch:
+                self._extend_shard(batch_window, batch)
+                self._enforce_retention()
+                batch = []
+            batch_window = window
+            batch.append(entry)
+        if batch:
+            self._extend_shard(batch_window, batch)
+            self._enforce_retention()
+
+    def _extend_sorted(self, entries, date_order):
+        # shards keep their own buckets
+        self.extend(entries)
+
+    def _sequence_count(self):
+        return self._next_sequence
+
+    def _sequence_of(self, reference):
+        return self._sequences_of(reference >> 32)[reference & 0xffffffff]
+
+    def _sequences_of(self, window):
+        sequences = self._sequences.get(window)
+        if sequences is None:
+            sequences = self._open_spilled(window)[1]
+        return sequences
+
+    def _date_of(self, entry):
+        try:
+            return entry.date
+        except AttributeError:
+            raise ValueError("Entry %s doesn't have field 'date'" % (entry,))
+
+    def _extend_shard(self, window, entries):
+        shard = self._shard(window, create=True)
+        count = shard._count()
+        try:
+            shard.extend(entries)
+        finally:
+            added = shard._count() - count
+            self._sequences[window].extend(
+                xrange(self._next_sequence, self._next_sequence + added))
+            self._next_sequence += added
+            if self._result_cache is not None:
+                for position, entry in enumerate(entries[:added], count):
+                    self._cache_added(window << 32 | position,
+                                      self._sortable_values(entry))
+
+    @_synchronized
+    def find_by(self, field_name, value, value_to=None, lazy=False):
+        """
+        Find all log entries which field_name has given value, see
+        LogContainer.find_by(). Searching by date only searches shards of
+        windows within the range.
+
+        Results are cached when cache_results() was called.
+        """
+
+        bucket = self._bucket(field_name)
+        cache = self._result_cache
+        if cache is None:
+            return self._found(
+                self._find_references(field_name, value, value_to), lazy)
+        key = (field_name,) + self._marshall_range(field_name, value,
+                                                   value_to)
+        references = cache.get(key)
+        if references is None:
+            references = self._find_references(field_name, value, value_to)
+            cache.put(key, references, bucket.ordered and key[1] == key[2])
+        # cached references are extended in place as entries are added
+        return self._found(references[:], lazy)
+
+    def _find_references(self, field_name, value, value_to):
+        """Returns references to entries found by find_by()"""
+
+        if field_name == 'date':
+            # windows don't overlap, so results of shards follow each other
+            references = array('l')
+            for window in self._windows(value, value_to or value):
+                references.extend(
+                    window << 32 | position for position in
+                    self._find_in_shard(window, field_name, value, value_to))
+        elif value_to and value_to != value:
+            # results are ordered by value first
+            found = []
+            for window in self._windows():
+                shard = self._shard(window)
+                sequences = self._sequences_of(window)
+                found.extend(
+                    (shard._sortable_value_at(position, field_name),
+                     sequences[position], window << 32 | position)
+                    for position in self._find_in_shard(window, field_name,
+                                                        value, value_to))
+            found.sort()
+            references = array('l', (reference
+                                     for _, _, reference in found))
+        else:
+            references = self._merged_references(
+                [(window, self._find_in_shard(window, field_name, value,
+                                              value_to))
+                 for window in self._windows()])
+        return references
+
+    def _find_in_shard(self, window, field_name, value, value_to):
+        shard = self._shard(window)
+        with shard._lock:
+            return shard._bucket(field_name).find(
+                *shard._marshall_range(field_name, value, value_to))
+
+    @_synchronized
+    def query(self, lazy=False, **conditions):
+        """
+        Find all log entries matching all given conditions, see
+        LogContainer.query(). Only shards of windows within date condition
+        are searched.
+        """
+
+        for field_name in conditions:
+            self._bucket(field_name)
+        date = conditions.get('date')
+        if date is None:
+            windows = self._windows()
+        elif isinstance(date, tuple):
+            windows = self._windows(date[0], date[1] or date[0])
+        else:
+            windows = self._windows(date, date)
+
+        found = []
+        for window in windows:
+            shard = self._shard(window)
+            with shard._lock:
+                found.append((window, shard._query_positions(conditions)))
+        return self._found(self._merged_references(found), lazy)
+
+    @_synchronized
+    def aggregate(self, group_by=(), interval=None, date_range=None):
+        """
+        Counts entries grouped by values of fields and by time intervals,
+        see CustomLog.aggregate(). Only shards of windows within date_range
+        are counted.
+        """
+
+        windows = self._windows(*date_range) if date_range \
+            else self._windows()
+        aggregated = {}
+        for window in windows:
+            counts = self._shard(window).aggregate(group_by, interval,
+                                                   date_range)
+            for key, count in counts.iteritems():
+                aggregated[key] = aggregated.get(key, 0) + count
+        return aggregated
+
+    @_synchronized
+    def trace(self, sessionid=None, requestid=None):
+        """
+        Returns Trace of entries of the session or of the request ordered
+        by date, see CustomLog.trace()
+        """
+
+        if (sessionid is None) == (requestid is None):
+            raise ValueError("Either sessionid or requestid has to be given")
+        # windows follow each other, so do traces of their shards
+        entries = []
+        for window in self._windows():
+            entries.extend(self._shard(window).trace(sessionid, requestid))
+        return Trace(entries)
+
+    @_synchronized
+    def evict(self, before):
+        """
+        Drops shards of windows which end before the given date, including
+        spilled ones. Returns number of dropped entries.
+        """
+
+        evicted = sum(self._drop_window(window)
+                      for window in self._windows_before(before))
+        self._drop_evicted_sources()
+        return evicted
+
+    def _drop_window(self, window):
+        """Drops shard of window, returns number of its entries"""
+
+        if window in self._spilled:
+            path, count = self._spilled.pop(window)
+            del self._spilled_sequences[window]
+            self._opened.pop(window, None)
+            os.remove(path)
+            os.remove(path + '.sequences')
+        else:
+            del self._sequences[window]
+            count = self._shards.pop(window)._count()
+        del self._created[window]
+        self._dropped += count
+        if self._result_cache is not None:
+            # cached results may refer to entries of the window
+            self._result_cache.clear()
+        return count
+
+    def _drop_evicted_sources(self):
+        """Drops sources which entries were all evicted"""
+
+        def evicted(source):
+            _, first, end = source
+            for sequences in self._sequences.itervalues():
+                index = bisect.bisect_left(sequences, first)
+                if index < len(sequences) and sequences[index] < end:
+                    return False
+            # entries of spilled shards aren't in memory, their sequence
+            # numbers are only known to be within bounds
+            return not any(first <= last and low < end
+                           for low, last
+                           in self._spilled_sequences.itervalues())
+
+        self._sources = [source for source in self._sources
+                         if not evicted(source)]
+
+    def _current_positions(self, references, dropped):
+        if dropped == self._dropped:
+            return references
+        # references to evicted shards, or to shards of the same windows
+        # created after the eviction, are skipped
+        created = self._created
+        return [reference for reference in references
+                if created.get(reference >> 32, dropped + 1) <= dropped]
+
+    # retention evicts whole shards, oldest first, the latest one is kept
+    # even if it exceeds the limits on its own
+
+    def _evict_first(self, count):
+        evicted = 0
+        for window in self._windows()[:-1]:
+            if evicted >= count:
+                break
+            evicted += self._drop_window(window)
+        self._drop_evicted_sources()
+        return evicted
+
+    def _evict_older(self, date):
+        return self.evict(self._epoch + timedelta(seconds=date))
+
+    def _first_date(self):
+        # start of the first window, entries of a window may be evicted
+        # only once the whole window is old enough
+        return self._windows()[0] * self._partition
+
+    def _latest(self):
+        return self._shard(self._windows()[-1])._latest()
+
+    def _memory_usage(self):
+        cache = self._result_cache
+        usage = {'entries': 0, 'indexes': {},
+                 'result_cache': cache.size if cache is not None else 0,
+                 'traces': {},
+                 'sequences': sum(sys.getsizeof(sequences)
+                                  for sequences in self._sequences.values())}
+        for shard in self._shards.values():
+            for component, size in shard._memory_usage().iteritems():
+                if isinstance(size, dict):
+                    for field, field_size in size.iteritems():
+                        usage[component][field] = (
+                            usage[component].get(field, 0) + field_size)
+                else:
+                    usage[component] += size
+        return usage
+
+    @_synchronized
+    def spill(self, before, directory):
+        """
+        Saves shards of windows which end before the given date to snapshot
+        files in directory and drops them from memory. Searches open
+        spilled shards while they read them, only a few recently read ones
+        are kept open. Shard is loaded back to stay in memory, and its
+        files are deleted, once entries are added to its window.
+        """
+
+        for window in self._windows_before(before):
+            if window not in self._shards:
+                continue
+            path = os.path.join(directory, 'shard-%d.snapshot' % window)
+            shard = self._shards.pop(window)
+            shard.save(path)
+            sequences = self._sequences.pop(window)
+            with open(path + '.sequences', 'wb') as sequences_file:
+                sequences.tofile(sequences_file)
+            self._spilled[window] = (path, shard._count())
+            self._spilled_sequences[window] = (
+                (sequences[0], sequences[-1]) if sequences else (0, -1))
+
+    def _windows_before(self, date):
+        last = self._window_of(date)
+        # window ends before the date if the date is in a later window or
+        # right at the start of the next one
+        return [window for window in self._windows()
+                if window < last]
+
+    def _open_spilled(self, window):
+        """Returns spilled shard of window and its sequence numbers"""
+
+        # columnar module depends on logparser, which this one extends
+        from .columnar import ColumnarCustomLog
+
+        opened = self._opened.pop(window, None)
+        if opened is None:
+            path, count = self._spilled[window]
+            sequences = array('l')
+            with open(path + '.sequences', 'rb') as sequences_file:
+                sequences.fromfile(sequences_file, count)
+            opened = (ColumnarCustomLog.open(path), sequences)
+        self._opened[window] = opened
+        while len(self._opened) > self._opened_limit:
+            self._opened.popitem(last=False)
+        return opened
+
+    def _load_spilled(self, window):
+        """Loads spilled shard of window back as shard_type"""
+
+        from .columnar import ColumnarCustomLog
+
+        path, _ = self._spilled[window]
+        if issubclass(self._shard_type, ColumnarCustomLog):
+            shard = self._shard_type.open(path)
+            sequences = self._sequences_of(window)
+        else:
+            opened, sequences = self._open_spilled(window)
+            shard = self._shard_type(self._parser, self._shard_fields)
+            shard.extend(opened.entries)
+        del self._spilled[window]
+        del self._spilled_sequences[window]
+        self._opened.pop(window, None)
+        self._shards[window] = shard
+        self._sequences[window] = sequences
+        os.remove(path)
+        os.remove(path + '.sequences')
+        return shard
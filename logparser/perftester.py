@@ -1,62 +1,520 @@
 from functools import wraps
-from datetime import datetime
+from timeit import default_timer
+import csv
 import gc
+import json
+import math
+import sys
+import threading
+
+# garbage collection is off while any thread measures a function and
+# restored when the last one finishes
+_gc_lock = threading.Lock()
+_gc_pauses = [0, False]
+
+
+def _pause_gc():
+    with _gc_lock:
+        if not _gc_pauses[0]:
+            _gc_pauses[1] = gc.isenabled()
+            gc.disable()
+        _gc_pauses[0] += 1
+
+
+def _resume_gc():
+    with _gc_lock:
+        _gc_pauses[0] -= 1
+        if not _gc_pauses[0] and _gc_pauses[1]:
+            gc.enable()
+
+
+class RunningStats(object):
+    """Aggregates samples in constant memory.
+
+    Count, min, max, mean and variance are updated with each sample
+    (Welford's method). Percentiles are estimated from a histogram with
+    logarithmic buckets, each power of two is split into _subbuckets
+    buckets, so an estimate is within 1/_subbuckets of the real value."""
+
+    _subbuckets = 16
+
+    def __init__(self):
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.mean = 0.0
+        # sum of squared differences from the mean
+        self._m2 = 0.0
+        # number of samples by bucket
+        self._histogram = {}
+
+    def add(self, sample):
+        """Adds sample"""
+        self.count += 1
+        delta = sample - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (sample - self.mean)
+        if self.min is None or sample < self.min:
+            self.min = sample
+        if self.max is None or sample > self.max:
+            self.max = sample
+        bucket = self._bucket(sample)
+        self._histogram[bucket] = self._histogram.get(bucket, 0) + 1
+
+    def merge(self, other):
+        """Adds samples aggregated by other RunningStats"""
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self._m2 += (other._m2
+                     + delta * delta * self.count * other.count / count)
+        self.mean += delta * other.count / count
+        self.count = count
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+        for bucket, bucket_count in other._histogram.iteritems():
+            self._histogram[bucket] = (self._histogram.get(bucket, 0)
+                                       + bucket_count)
+
+    def _bucket(self, sample):
+        if sample <= 0:
+            return None
+        mantissa, exponent = math.frexp(sample)
+        return (exponent * self._subbuckets
+                + int((mantissa - 0.5) * 2 * self._subbuckets))
+
+    def _bucket_middle(self, bucket):
+        if bucket is None:
+            return 0.0
+        exponent, index = divmod(bucket, self._subbuckets)
+        return math.ldexp(0.5 + (index + 0.5) / (2.0 * self._subbuckets),
+                          exponent)
+
+    @property
+    def variance(self):
+        """Population variance of samples"""
+        return self._m2 / self.count if self.count else 0.0
+
+    def percentile(self, percent):
+        """Estimates value which percent of samples don't exceed"""
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(percent / 100.0 * self.count)))
+        seen = 0
+        # samples of zero or less are in bucket None which sorts first
+        for bucket in sorted(self._histogram):
+            seen += self._histogram[bucket]
+            if seen >= rank:
+                break
+        return min(max(self._bucket_middle(bucket), self.min), self.max)
+
+
+def _percentile(sorted_samples, percent):
+    """Returns value which percent of sorted_samples don't exceed"""
+    rank = max(1, int(math.ceil(percent / 100.0 * len(sorted_samples))))
+    return sorted_samples[rank - 1]
+
+
+def qualified_name(f):
+    """Returns name of function f qualified by its module and, for methods,
+    by its class. Functions decorated with PerformanceTester.test have the
+    name they're tested under, see PerformanceTester.test."""
+    name = getattr(f, '_qualified_name', None)
+    if name is not None:
+        return name
+    name = getattr(f, '__qualname__', None)
+    if name is not None:
+        return '%s.%s' % (f.__module__, name)
+    owner = getattr(f, 'im_class', None)
+    if owner is None:
+        return '%s.%s' % (f.__module__, f.__name__)
+    return '%s.%s.%s' % (owner.__module__, owner.__name__, f.__name__)
+
+
+def _class_body_name(f, frame):
+    """Returns name of function f qualified by the class if frame is the
+    body of the class f is defined in, None otherwise"""
+    namespace = frame.f_locals
+    if (frame.f_code.co_name == '<module>'
+            or namespace.get('__module__') != getattr(f, '__module__', None)
+            or getattr(f, '__qualname__', None) is not None
+            or hasattr(f, 'im_class')):
+        return None
+    return '%s.%s.%s' % (f.__module__, frame.f_code.co_name, f.__name__)
+
+
+def _merge_calls(merged, calls):
+    """Adds calls of a call tree to merged call tree"""
+    for stack, (count, inclusive, exclusive) in calls.iteritems():
+        stack_calls = merged.get(stack)
+        if stack_calls is None:
+            stack_calls = merged[stack] = [0, 0.0, 0.0]
+        stack_calls[0] += count
+        stack_calls[1] += inclusive
+        stack_calls[2] += exclusive
+
+
+class _ThreadStats(object):
+    """Run times collected by one thread"""
+
+    def __init__(self):
+        # run times by function
+        self.run_times = {}
+        # [number of calls, inclusive time, exclusive time] by stack of
+        # functions, outermost first
+        self.calls = {}
+        # [stack, time spent in nested calls] of calls in progress
+        self.frames = []
+
 
 class PerformanceTester(object):
     """Tool to measure run time of functions. Use PerformanceTester.test
-    function as a decorator to collect performance data"""
+    function as a decorator to collect performance data
 
-    def __init__(self):
-        self.stats = {}
+    Functions are told apart by their qualified names, eg.
+    'logparser.logparser.CustomLog.load', see qualified_name().
+
+    By default all run times are kept in lists in stats. With
+    streaming=True stats hold RunningStats instead, which take the same
+    memory however many times functions are called, percentiles are
+    estimated then.
+
+    Calls of decorated functions made from other decorated functions are
+    tracked as a call tree, see call_tree(). Time of a call excluding its
+    nested decorated calls is its exclusive time.
+
+    Each thread collects run times on its own, they're merged when stats
+    are read. Run times of threads which ended are folded into shared
+    stats once another thread starts measuring or stats are read, so
+    threads started eg. for each request don't add up. Garbage
+    collection is disabled while any thread measures a function, unless
+    disable_gc=False.
+
+    Run times collected in other processes, eg. workers of a pool, are
+    sent with export() and added with merge():
+
+        # in the worker
+        return result, perf_tester.export()
+
+        # in the parent
+        result, stats = async_result.get()
+        perf_tester.merge(stats)
+
+    Results can be written as JSON, CSV or as collapsed stacks which
+    flame graph tools read, see write_json(), write_csv() and
+    write_collapsed()."""
+
+    def __init__(self, streaming=False, disable_gc=True):
+        self.streaming = streaming
+        self.disable_gc = disable_gc
+        self._local = threading.local()
+        # _ThreadStats of threads by thread, those of threads which ended
+        # and of merged testers are folded into _finished
+        self._threads = {}
+        self._finished = _ThreadStats()
+        # code of decorated functions by their names
+        self._codes = {}
+        self._lock = threading.Lock()
+        # overhead() measured for results, once
+        self._overhead = None
+
+    # percentiles of run times in results
+    percentiles = (50, 95, 99)
+
+    @property
+    def stats(self):
+        """Run times by function collected by all threads and merged"""
+        merged = {}
+        for thread in self._all_threads():
+            for name, run_times in thread.run_times.items():
+                self._merge_run_times(merged, name, run_times)
+        return merged
+
+    def call_tree(self):
+        """Returns dict keyed by stacks of functions, outermost first, of
+        [number of calls, inclusive time, exclusive time] of the innermost
+        function called from the others"""
+        merged = {}
+        for thread in self._all_threads():
+            _merge_calls(merged, thread.calls)
+        return merged
+
+    def _all_threads(self):
+        with self._lock:
+            self._fold_finished_threads()
+            return self._threads.values() + [self._finished]
+
+    def _fold_finished_threads(self):
+        """Folds stats of threads which ended into _finished, called with
+        the lock held"""
+        for thread, stats in self._threads.items():
+            if not thread.is_alive():
+                del self._threads[thread]
+                self._fold(stats)
+
+    def _fold(self, stats):
+        for name, run_times in stats.run_times.iteritems():
+            self._merge_run_times(self._finished.run_times, name, run_times)
+        _merge_calls(self._finished.calls, stats.calls)
+
+    def _merge_run_times(self, stats, name, run_times):
+        merged = stats.get(name)
+        if merged is None:
+            merged = stats[name] = self._new_run_times()
+        if not self.streaming:
+            if isinstance(run_times, RunningStats):
+                raise ValueError("Streaming stats can't be merged into "
+                                 "stored samples")
+            merged.extend(run_times)
+        elif isinstance(run_times, RunningStats):
+            merged.merge(run_times)
+        else:
+            for run_time in run_times:
+                merged.add(run_time)
+
+    def _new_run_times(self):
+        return RunningStats() if self.streaming else []
+
+    def _thread_stats(self):
+        thread = self._local.stats = _ThreadStats()
+        with self._lock:
+            self._fold_finished_threads()
+            self._threads[threading.current_thread()] = thread
+        return thread
+
+    def export(self):
+        """Returns stats to be merged into another tester and starts
+        collecting anew. Shouldn't be called while measured functions
+        run"""
+        exported = {'stats': self.stats, 'calls': self.call_tree()}
+        with self._lock:
+            for thread in self._threads.values() + [self._finished]:
+                thread.run_times.clear()
+                thread.calls.clear()
+        return exported
+
+    def merge(self, exported):
+        """Adds stats returned by export() of another tester"""
+        thread = _ThreadStats()
+        for name, run_times in exported['stats'].iteritems():
+            self._merge_run_times(thread.run_times, name, run_times)
+        _merge_calls(thread.calls, exported['calls'])
+        with self._lock:
+            self._fold(thread)
 
     def test(self, f):
         """Decorator to be used on a function under test.
-        Collects run time data"""
+        Collects run time data
+
+        Methods decorated in the class body are named by the class too.
+        Different functions of the same name, eg. lambdas, are told apart
+        by the line they're defined on added to the name of all but the
+        first one, eg. 'module.<lambda>:12'."""
+
+        name = (_class_body_name(f, sys._getframe(1))
+                or qualified_name(f))
+        code = getattr(getattr(f, 'im_func', f), '__code__', None)
+        with self._lock:
+            registered = self._codes.setdefault(name, code)
+            if code is not None and registered != code:
+                name = '%s:%d' % (name, code.co_firstlineno)
+                self._codes.setdefault(name, code)
+        local = self._local
+        thread_stats = self._thread_stats
+        new_run_times = self._new_run_times
+        streaming = self.streaming
+        disable_gc = self.disable_gc
+        timer = default_timer
 
         @wraps(f)
         def wrapper(*args, **kwds):
-            # garbage collection off to prevent from spikes in data
-            # copied from timeit module
-            gc_state = gc.isenabled()
-            gc.disable()
+            if disable_gc:
+                # garbage collection off to prevent from spikes in data
+                # copied from timeit module
+                _pause_gc()
             try:
-                start = datetime.now()
-                result = f(*args, **kwds)
-                end = datetime.now()
+                try:
+                    thread = local.stats
+                except AttributeError:
+                    thread = thread_stats()
+                frames = thread.frames
+                stack = frames[-1][0] + (name,) if frames else (name,)
+                frame = [stack, 0.0]
+                frames.append(frame)
+                try:
+                    start = timer()
+                    result = f(*args, **kwds)
+                    seconds_elapsed = timer() - start
+                finally:
+                    frames.pop()
+                if frames:
+                    frames[-1][1] += seconds_elapsed
 
-                seconds_elapsed = (end - start).total_seconds()
-                self.stats.setdefault(f.__name__, []).append(seconds_elapsed)
+                run_times = thread.run_times.get(name)
+                if run_times is None:
+                    run_times = thread.run_times[name] = new_run_times()
+                if streaming:
+                    run_times.add(seconds_elapsed)
+                else:
+                    run_times.append(seconds_elapsed)
+                calls = thread.calls.get(stack)
+                if calls is None:
+                    calls = thread.calls[stack] = [0, 0.0, 0.0]
+                calls[0] += 1
+                calls[1] += seconds_elapsed
+                calls[2] += seconds_elapsed - frame[1]
             finally:
-                if gc_state:
-                    gc.enable()
+                if disable_gc:
+                    _resume_gc()
             return result
 
+        wrapper._qualified_name = name
         return wrapper
 
     def results(self):
-        """Aggregates results of tests performed"""
+        """Aggregates results of tests performed
+
+        Besides statistics of run times, total_time is the time spent in
+        calls of a function (recursive calls counted once) and
+        exclusive_time is that time excluding nested decorated calls.
+        sample_overhead and call_overhead are the overhead of the test
+        decorator, see overhead(), the same for all functions; it's
+        measured on the first call."""
+        overhead = self._measured_overhead()
+        totals = {}
+        for stack, (_, inclusive, exclusive) in \
+                self.call_tree().iteritems():
+            total = totals.setdefault(stack[-1], [0.0, 0.0])
+            if stack[-1] not in stack[:-1]:
+                total[0] += inclusive
+            total[1] += exclusive
+
         aggregated = {}
         for func_name, run_times in self.stats.iteritems():
-            num_samples = len(run_times)
-            min_time = min(run_times)
-            max_time = max(run_times)
-            avg_time = sum(run_times)/float(num_samples)
-            aggregated[func_name] = {
-                'num_samples': num_samples,
-                'min_time': min_time,
-                'max_time': max_time,
-                'avg_time': avg_time,
-            }
+            if self.streaming:
+                result = {
+                    'num_samples': run_times.count,
+                    'min_time': run_times.min,
+                    'max_time': run_times.max,
+                    'avg_time': run_times.mean,
+                    'variance': run_times.variance,
+                }
+                for percent in self.percentiles:
+                    result['p%d' % percent] = run_times.percentile(percent)
+            else:
+                num_samples = len(run_times)
+                avg_time = sum(run_times)/float(num_samples)
+                result = {
+                    'num_samples': num_samples,
+                    'min_time': min(run_times),
+                    'max_time': max(run_times),
+                    'avg_time': avg_time,
+                    'variance': sum((run_time - avg_time) ** 2
+                                    for run_time in run_times) / num_samples,
+                }
+                sorted_times = sorted(run_times)
+                for percent in self.percentiles:
+                    result['p%d' % percent] = _percentile(sorted_times,
+                                                          percent)
+            result['total_time'], result['exclusive_time'] = totals.get(
+                func_name, (0.0, 0.0))
+            result['sample_overhead'] = overhead['sample']
+            result['call_overhead'] = overhead['call']
+            aggregated[func_name] = result
         return aggregated
 
+    def overhead(self, calls=10000):
+        """Measures overhead of the test decorator, returns dict of seconds:
+
+            sample - run time measured for a function doing nothing, it's
+                     included in every sample
+            call - how much longer a decorated function call takes"""
+
+        tester = PerformanceTester(self.streaming, self.disable_gc)
+
+        def noop():
+            pass
+
+        decorated = tester.test(noop)
+        timer = default_timer
+        start = timer()
+        for _ in xrange(calls):
+            noop()
+        plain_time = timer() - start
+        start = timer()
+        for _ in xrange(calls):
+            decorated()
+        decorated_time = timer() - start
+        return {
+            'sample': tester._average(tester.stats[qualified_name(noop)]),
+            'call': max(0.0, (decorated_time - plain_time) / calls),
+        }
+
+    def _average(self, run_times):
+        if self.streaming:
+            return run_times.mean
+        return sum(run_times) / float(len(run_times))
+
+    def _measured_overhead(self):
+        if self._overhead is None:
+            self._overhead = self.overhead()
+        return self._overhead
+
+    # columns of CSV results
+    result_fields = (['num_samples', 'min_time', 'max_time', 'avg_time',
+                      'variance']
+                     + ['p%d' % percent for percent in percentiles]
+                     + ['total_time', 'exclusive_time',
+                        'sample_overhead', 'call_overhead'])
+
+    def write_json(self, stream):
+        """Writes results and the call tree as JSON"""
+        json.dump({
+            'functions': self.results(),
+            'calls': [{'stack': list(stack), 'num_calls': count,
+                       'inclusive_time': inclusive,
+                       'exclusive_time': exclusive}
+                      for stack, (count, inclusive, exclusive)
+                      in sorted(self.call_tree().iteritems())],
+        }, stream, indent=2, sort_keys=True)
+
+    def write_csv(self, stream):
+        """Writes results as CSV, one row per function"""
+        writer = csv.writer(stream)
+        writer.writerow(['function'] + self.result_fields)
+        for func_name, result in sorted(self.results().iteritems()):
+            writer.writerow([func_name] + [result[field]
+                                           for field in self.result_fields])
+
+    def write_collapsed(self, stream):
+        """Writes call tree as collapsed stacks: stack of functions joined
+        with ';' and exclusive time in microseconds on each line, the
+        format flamegraph.pl and other flame graph tools read"""
+        for stack, (_, _, exclusive) in sorted(self.call_tree().iteritems()):
+            stream.write('%s %d\n' % (';'.join(stack),
+                                       int(round(exclusive * 1e6))))
+
     def print_results(self):
         """Prints results of test performed"""
-        form = ("Function: %s\nNum samples: %d\nMin: %0.20f secs\n"
-                   "Max: %0.20f secs\nAverage: %0.20f secs")
+        form = ("Function: %s\nNum samples: %d\nMin: %0.9f secs\n"
+                   "Max: %0.9f secs\nAverage: %0.9f secs")
+        percentile_form = "P%d: %0.9f secs"
+        totals_form = "Total: %0.9f secs\nExclusive: %0.9f secs"
 
-        for func_name, result in self.results().iteritems():
+        for func_name, result in sorted(self.results().iteritems()):
             print form % (func_name,
                           result['num_samples'],
-                          round(result['min_time'], 2),
-                          round(result['max_time'], 2),
-                          round(result['avg_time'], 2))
+                          result['min_time'],
+                          result['max_time'],
+                          result['avg_time'])
+            for percent in self.percentiles:
+                print percentile_form % (percent, result['p%d' % percent])
+            print totals_form % (result['total_time'],
+                                 result['exclusive_time'])
+
+        overhead = self._measured_overhead()
+        print ("Overhead: %0.9f secs per sample, %0.9f secs per call"
+               % (overhead['sample'], overhead['call']))
@@ -0,0 +1,283 @@
+"""
+Module provides a server sharing one loaded log with many clients.
+
+The server loads a log file once and answers searches over a TCP or Unix
+socket, eg:
+
+    python -m logparser.serve --address localhost:8470 app.log
+    python -m logparser.serve --address /tmp/logparser.sock app.log
+
+Clients connect with logparser.client.LogClient. The protocol is line
+delimited JSON. Each request is one line:
+
+    {"id": 1, "method": "find_by",
+     "params": {"field_name": "loglevel", "value": "ERROR"}}
+
+and is answered by one line per found entry followed by a final line:
+
+    {"id": 1, "entry": ["2012-09-13 16:04:50", "ERROR", "SID:34523", ...]}
+    {"id": 1, "done": true, "count": 1}
+
+or by an error line:
+
+    {"id": 1, "error": "Field message doesn't exist or doesn't support ..."}
+
+Dates are given and returned in CustomLog.date_format. Requests of
+a client are answered in order. Found entries are read from the log and
+sent in chunks only when the client's socket can take more data, so
+a client reading a huge result slowly doesn't make the server buffer it.
+
+Sockets are served by asyncore in a single thread, clients are served
+concurrently.
+"""
+
+import argparse
+import asynchat
+import asyncore
+from datetime import datetime
+import json
+import os
+import socket
+
+from . import logparser
+
+# strings are bytes in logs, latin-1 maps each byte to a character and back
+_encoding = 'latin-1'
+
+
+def parse_address(address):
+    """
+    Returns socket address from 'host:port' or path of a Unix socket,
+    addresses which are already tuples are returned as they are
+    """
+
+    if isinstance(address, tuple) or os.sep in address:
+        return address
+    host, separator, port = address.rpartition(':')
+    if not separator or not port.isdigit():
+        raise ValueError("Invalid address '%s', expected host:port or "
+                         "path of a Unix socket" % address)
+    return host, int(port)
+
+
+def address_family(address):
+    """Returns socket family of address returned by parse_address()"""
+    return socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+
+
+def encode_message(message):
+    """Returns protocol line of message"""
+    return json.dumps(message, encoding=_encoding) + '\n'
+
+
+def decode_message(line):
+    """Returns message from protocol line, strings are returned as bytes"""
+    return _to_bytes(json.loads(line, encoding=_encoding))
+
+
+def _to_bytes(value):
+    if isinstance(value, unicode):
+        return value.encode(_encoding)
+    if isinstance(value, list):
+        return [_to_bytes(item) for item in value]
+    if isinstance(value, dict):
+        return dict([(_to_bytes(key), _to_bytes(item))
+                     for key, item in value.iteritems()])
+    return value
+
+
+class LogServer(asyncore.dispatcher):
+    """
+    LogServer answers searches of log_container sent to address, see
+    module docstring for the protocol, eg:
+
+        server = LogServer(log_container, ('localhost', 8470))
+        server.serve_forever()
+
+    serve_forever() runs until shutdown() is called, eg. from another
+    thread.
+    """
+
+    def __init__(self, log_container, address, backlog=128):
+        # sockets of each server are polled separately from other servers
+        asyncore.dispatcher.__init__(self, map={})
+        self.log_container = log_container
+        address = parse_address(address)
+        self.create_socket(address_family(address), socket.SOCK_STREAM)
+        if isinstance(address, tuple):
+            self.set_reuse_addr()
+        self.bind(address)
+        self.listen(backlog)
+        self.address = self.socket.getsockname()
+        self._serving = False
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            LogChannel(self, pair[0])
+
+    def serve_forever(self, poll_interval=0.5):
+        """Serves clients until shutdown() is called"""
+
+        self._serving = True
+        try:
+            while self._serving:
+                asyncore.loop(poll_interval, map=self._map, count=1)
+        finally:
+            asyncore.close_all(self._map)
+            if address_family(self.address) == socket.AF_UNIX:
+                os.remove(self.address)
+
+    def shutdown(self):
+        """Stops serve_forever() within poll_interval"""
+        self._serving = False
+
+    # methods callable by clients, find_entries_* functions take
+    # the container as the first argument
+    methods = {
+        'find_by': None,
+        'query': None,
+        'find_entries_with_log_level':
+            logparser.find_entries_with_log_level,
+        'find_entries_with_business_id':
+            logparser.find_entries_with_business_id,
+        'find_entries_with_session_id':
+            logparser.find_entries_with_session_id,
+        'find_entries_within_date_range':
+            logparser.find_entries_within_date_range,
+    }
+
+    def search(self, method, params):
+        """Returns ResultView of entries found by method called with params"""
+
+        if method not in self.methods:
+            raise ValueError("Unknown method '%s'" % method)
+        log_container = self.log_container
+        if method == 'find_by':
+            params = dict(params)
+            if params.get('field_name') == 'date':
+                for name in ('value', 'value_to'):
+                    params[name] = self._date(params.get(name))
+            return log_container.find_by(lazy=True, **params)
+        if method == 'query':
+            conditions = {}
+            for field_name, value in params.iteritems():
+                if isinstance(value, list):
+                    value = tuple(value)
+                if field_name == 'date':
+                    value = (tuple(self._date(date) for date in value)
+                             if isinstance(value, tuple)
+                             else self._date(value))
+                conditions[field_name] = value
+            return log_container.query(lazy=True, **conditions)
+        return self.methods[method](log_container, lazy=True, **params)
+
+    def _date(self, value):
+        if isinstance(value, str):
+            return datetime.strptime(value, self.log_container.date_format)
+        return value
+
+
+class LogChannel(asynchat.async_chat):
+    """LogChannel serves requests of one client of LogServer"""
+
+    def __init__(self, server, sock):
+        asynchat.async_chat.__init__(self, sock, map=server._map)
+        self.server = server
+        self._request = []
+        self.set_terminator('\n')
+
+    def collect_incoming_data(self, data):
+        self._request.append(data)
+
+    def found_terminator(self):
+        line = ''.join(self._request)
+        self._request = []
+        if not line.strip():
+            return
+        request_id = None
+        try:
+            request = decode_message(line)
+            request_id = request.get('id')
+            found = self.server.search(request['method'],
+                                       request.get('params') or {})
+        except Exception as error:
+            self.push(encode_message({'id': request_id,
+                                      'error': str(error)}))
+            return
+        self.push_with_producer(ResultProducer(
+            request_id, found, self.server.log_container.date_format))
+
+
+class ResultProducer(object):
+    """
+    ResultProducer encodes found entries in chunks as asynchat asks for
+    more data to send
+    """
+
+    def __init__(self, request_id, found, date_format):
+        self._request_id = request_id
+        self._found = found
+        self._date_format = date_format
+        self._offset = 0
+        self._done = False
+
+    # entries encoded at once
+    chunk_size = 256
+
+    def more(self):
+        if self._done:
+            return ''
+        found = self._found
+        chunk = found[self._offset:self._offset + self.chunk_size]
+        self._offset += len(chunk)
+        lines = [encode_message({
+            'id': self._request_id,
+            'entry': [entry.date.strftime(self._date_format)]
+                     + list(entry[1:])})
+                 for entry in chunk]
+        if self._offset >= len(found):
+            lines.append(encode_message({'id': self._request_id,
+                                         'done': True,
+                                         'count': len(found)}))
+            self._done = True
+        return ''.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m logparser.serve',
+        description='Loads log file and serves searches of its entries')
+    parser.add_argument('path', help='log file to load')
+    parser.add_argument('--address', default='localhost:8470',
+                        help='host:port or path of a Unix socket to listen '
+                             'on (default: %(default)s)')
+    parser.add_argument('--columnar', action='store_true',
+                        help='store entries in columns to save memory')
+    parser.add_argument('--follow', type=float, metavar='SECONDS',
+                        help='load entries appended to the log every '
+                             'SECONDS')
+    args = parser.parse_args(argv)
+
+    if args.columnar:
+        from .columnar import ColumnarCustomLog
+        log_container = ColumnarCustomLog()
+    else:
+        log_container = logparser.CustomLog()
+    if args.follow:
+        follower = log_container.follow(args.path, args.follow)
+    else:
+        # mapped messages would crash the server once the log is truncated
+        log_container.load_file(args.path, mmap=False)
+    server = LogServer(log_container, args.address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.follow:
+            follower.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+from nose.tools import *
+from logparser.benchmark import compare, generate_log, run_benchmark
+from logparser.logparser import CustomLog
+from cStringIO import StringIO
+
+
+def generated_log(num_entries, **options):
+    stream = StringIO()
+    generate_log(stream, num_entries, **options)
+    return stream.getvalue()
+
+
+def test_generated_log_is_reproducible():
+    assert_equal(generated_log(1000), generated_log(1000))
+    assert_not_equal(generated_log(1000), generated_log(1000, seed=1))
+
+
+def test_generated_log_has_given_shape():
+    log_container = CustomLog()
+    log_container.load(StringIO(generated_log(
+        2000, sessions=50, businesses=5, multiline_ratio=0.2,
+        disorder_ratio=0.1)), bulk=True)
+    entries = log_container.entries
+    assert_equal(2000, len(entries))
+    assert_equal(50, len(set(entry.sessionid for entry in entries)))
+    assert_equal(5, len(set(entry.businessid for entry in entries)))
+    multiline = sum('\n' in entry.message for entry in entries)
+    assert_true(300 < multiline < 500, multiline)
+    out_of_order = sum(earlier.date > later.date
+                       for earlier, later in zip(entries, entries[1:]))
+    assert_true(100 < out_of_order < 300, out_of_order)
+
+
+def test_benchmark_measures_each_operation():
+    results = run_benchmark([200], repeat=2)
+    assert_equal(['200'], results.keys())
+    measured = results['200']
+    assert_equal(sorted(['load', 'peak_memory',
+                         'find_entries_with_log_level',
+                         'find_entries_with_business_id',
+                         'find_entries_with_session_id',
+                         'find_entries_within_date_range']),
+                 sorted(measured))
+    assert_equal(1, measured['load']['num_samples'])
+    assert_true(measured['load']['entries_per_sec'] > 0)
+    assert_equal(4, measured['find_entries_with_session_id']['num_samples'])
+    assert_true(measured['peak_memory'] > 0)
+
+
+def test_compare_reports_regressions_beyond_tolerance():
+    def results(load_time, search_time, memory):
+        return {'1000': {
+            'peak_memory': memory,
+            'load': {'avg_time': load_time, 'p95': load_time},
+            'find_entries_with_log_level': {'avg_time': search_time,
+                                            'p95': search_time}}}
+
+    baseline = results(1.0, 0.01, 1000)
+    assert_equal([], compare(results(1.2, 0.005, 1000), baseline))
+    assert_equal([('1000', 'process', 'peak_memory', 1000, 2000),
+                  ('1000', 'find_entries_with_log_level', 'avg_time',
+                   0.01, 0.02),
+                  ('1000', 'find_entries_with_log_level', 'p95', 0.01, 0.02)],
+                 compare(results(1.2, 0.02, 2000), baseline))
+    assert_equal([('1000', 'load', 'avg_time', 1.0, 1.2),
+                  ('1000', 'load', 'p95', 1.0, 1.2)],
+                 compare(results(1.2, 0.01, 1000), baseline, tolerance=0.1))
+    # sizes missing in the baseline aren't compared
+    assert_equal([], compare({'10': baseline['1000']}, baseline))
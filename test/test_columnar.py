@@ -0,0 +1,255 @@
+from nose.tools import *
+from logparser import logparser
+from logparser.columnar import ColumnarCustomLog
+from cStringIO import StringIO
+from datetime import datetime, timedelta
+import json
+import os
+import struct
+import tempfile
+
+log_sample = """
+2012-09-13 16:04:22 DEBUG SID:34523 BID:1329 RID:65d33 'Starting new session'
+2012-09-13 16:04:30 DEBUG SID:34523 BID:1329 RID:54f22 'Authenticating User'
+2012-09-13 16:05:30 DEBUG SID:42111 BID:319 RID:65a23 'Starting new session'
+2012-09-13 16:04:50 ERROR SID:34523 BID:1329 RID:54ff3 'Missing
+Authentication token'
+2012-09-13 16:05:31 DEBUG SID:42111 BID:319 RID:86472 'Authenticating User'
+2012-09-13 16:05:31 DEBUG SID:42111 BID:319 RID:7a323 'Deleting asset
+with ID 543234'
+2012-09-13 16:05:32 WARN SID:42111 BID:319 RID:7a323 'Invalid asset ID'
+"""
+
+
+def load_containers(stream_data, bulk=False):
+    containers = []
+    for container_type in (logparser.CustomLog, ColumnarCustomLog):
+        log_container = container_type()
+        log_container.load(StringIO(stream_data), bulk=bulk)
+        containers.append(log_container)
+    return containers
+
+
+def test_columnar_entries_are_same_as_custom_log_entries():
+    custom_log, columnar_log = load_containers(log_sample)
+    assert_equal(7, len(columnar_log.entries))
+    assert_equal(custom_log.entries, columnar_log.entries)
+    assert_equal([str(entry) for entry in custom_log.entries],
+                 [str(entry) for entry in columnar_log.entries])
+    assert_equal(logparser.CustomLog.LogEntry,
+                 type(columnar_log.entries[0]))
+
+
+def test_columnar_entries_share_dates():
+    custom_log, columnar_log = load_containers(log_sample * 2)
+    columnar_log._max_cached_dates = 4
+    entries = columnar_log.entries
+    assert_equal(custom_log.entries, entries)
+    assert_true(entries[0].date is entries[7].date)
+    assert_equal(custom_log.entries, columnar_log.entries)
+
+def test_columnar_search_results_are_same_as_custom_log_results():
+    for bulk in (False, True):
+        custom_log, columnar_log = load_containers(log_sample, bulk)
+        for find, args in [
+                (logparser.find_entries_with_log_level, ['DEBUG']),
+                (logparser.find_entries_with_log_level, ['ERROR']),
+                (logparser.find_entries_with_business_id, ['BID:319']),
+                (logparser.find_entries_with_session_id, ['SID:34523']),
+                (logparser.find_entries_with_session_id, ['SID:1']),
+                (logparser.find_entries_within_date_range,
+                 ['2012-09-13 16:04:30', '2012-09-13 16:05:31'])]:
+            assert_equal(find(custom_log, *args), find(columnar_log, *args))
+
+
+def test_columnar_range_search_on_ids():
+    custom_log, columnar_log = load_containers(log_sample)
+    assert_equal(custom_log.find_by('sessionid', 'SID:1', 'SID:4'),
+                 columnar_log.find_by('sessionid', 'SID:1', 'SID:4'))
+
+
+def test_columnar_keeps_columns_consistent_on_bad_entry():
+    columnar_log = ColumnarCustomLog()
+    entry = columnar_log.LogEntry(datetime(2012, 1, 1), 'INFO', 'SID:1',
+                                  'BID:2', 'RID:3', "'A'")
+    assert_raises(ValueError, columnar_log.append, entry)
+    assert_equal([], columnar_log.entries)
+
+
+def test_columnar_query_gives_same_results_as_custom_log():
+    custom_log, columnar_log = load_containers(log_sample * 3)
+    conditions = dict(loglevel='DEBUG', sessionid='SID:42111',
+                      date=(datetime(2012, 9, 13, 16, 5, 30),
+                            datetime(2012, 9, 13, 16, 5, 31)))
+    assert_equal(9, len(custom_log.query(**conditions)))
+    assert_equal(custom_log.query(**conditions),
+                 columnar_log.query(**conditions))
+
+
+def test_columnar_lazy_find_fetches_same_entries():
+    custom_log, columnar_log = load_containers(log_sample * 3)
+    view = columnar_log.find_by('date', datetime(2012, 9, 13, 16, 4, 30),
+                                datetime(2012, 9, 13, 16, 5, 31), lazy=True)
+    found = custom_log.find_by('date', datetime(2012, 9, 13, 16, 4, 30),
+                               datetime(2012, 9, 13, 16, 5, 31))
+    assert_equal(len(found), view.count())
+    assert_equal(found, list(view))
+    assert_equal(found[1:4], view.page(1, 3))
+
+
+def test_columnar_aggregate_gives_same_counts_as_custom_log():
+    from logparser import columnar
+    custom_log, columnar_log = load_containers(log_sample * 3)
+    date_range = (datetime(2012, 9, 13, 16, 4, 30),
+                  datetime(2012, 9, 13, 16, 5, 31))
+    numpy = columnar.numpy
+    try:
+        for columnar.numpy in set([numpy, None]):
+            for kwds in [dict(group_by=['businessid', 'loglevel'],
+                              interval='1m'),
+                         dict(group_by=['sessionid'], interval='10s',
+                              date_range=date_range),
+                         dict(interval='1h'),
+                         dict(group_by=['loglevel'],
+                              interval=timedelta(minutes=1)),
+                         dict(interval=30.0),
+                         dict(group_by=['loglevel', 'requestid']),
+                         dict()]:
+                assert_equal(custom_log.aggregate(**kwds),
+                             columnar_log.aggregate(**kwds))
+    finally:
+        columnar.numpy = numpy
+
+
+def snapshot_path():
+    fd, path = tempfile.mkstemp(suffix='.snapshot')
+    os.close(fd)
+    return path
+
+
+def test_snapshot_reopens_same_entries_and_indexes():
+    path = snapshot_path()
+    try:
+        for searchable_fields in (None, ['date', 'loglevel', 'sessionid',
+                                         'businessid']):
+            columnar_log = ColumnarCustomLog(
+                searchable_fields=searchable_fields)
+            columnar_log.load(StringIO(log_sample), bulk=True)
+            columnar_log.save(path)
+            reopened = ColumnarCustomLog.open(path)
+
+            assert_equal(columnar_log.entries, reopened.entries)
+            assert_equal(columnar_log._index_spec(), reopened._index_spec())
+            for field, value, value_to in [
+                    ('loglevel', 'DEBUG', None),
+                    ('sessionid', 'SID:34523', None),
+                    ('businessid', 'BID:1', 'BID:9'),
+                    ('date', datetime(2012, 9, 13, 16, 4, 30),
+                     datetime(2012, 9, 13, 16, 5, 31))]:
+                assert_equal(columnar_log.find_by(field, value, value_to),
+                             reopened.find_by(field, value, value_to))
+
+            # reopened container can be extended
+            reopened.load(StringIO(log_sample))
+            assert_equal(6, len(reopened.find_by('sessionid', 'SID:34523')))
+    finally:
+        os.remove(path)
+
+
+def test_snapshot_header_is_data_only():
+    path = snapshot_path()
+    try:
+        columnar_log = ColumnarCustomLog()
+        columnar_log.append(columnar_log.LogEntry(
+            datetime(2012, 9, 13, 16, 4, 22), 'DEBUG', 'SID:\xe9',
+            'BID:1', 'RID:1', "'Entry'"))
+        columnar_log.save(path)
+        with open(path, 'rb') as snapshot:
+            snapshot.seek(len(ColumnarCustomLog._snapshot_magic))
+            size, = struct.unpack('<Q', snapshot.read(8))
+            header = json.loads(snapshot.read(size))
+        assert_equal(ColumnarCustomLog._snapshot_version, header['version'])
+        reopened = ColumnarCustomLog.open(path)
+        assert_equal(columnar_log.entries, reopened.entries)
+        assert_equal(str, type(reopened.entries[0].sessionid))
+        assert_equal(1, len(reopened.find_by('sessionid', 'SID:\xe9')))
+
+        # snapshots of other versions, eg. with pickled headers, are
+        # rejected
+        with open(path, 'r+b') as snapshot:
+            snapshot.seek(len(ColumnarCustomLog._snapshot_magic) + 8)
+            snapshot.write('\x80\x02')
+        assert_raises(ValueError, ColumnarCustomLog.open, path)
+    finally:
+        os.remove(path)
+
+def test_custom_log_snapshot_opens_as_columnar():
+    path = snapshot_path()
+    try:
+        custom_log, _ = load_containers(log_sample)
+        custom_log.save(path)
+        reopened = ColumnarCustomLog.open(path)
+        assert_equal(custom_log.entries, reopened.entries)
+        assert_equal(custom_log.find_by('loglevel', 'WARN'),
+                     reopened.find_by('loglevel', 'WARN'))
+    finally:
+        os.remove(path)
+
+
+def test_snapshot_is_validated_against_source_log():
+    path = snapshot_path()
+    source = snapshot_path()
+    try:
+        with open(source, 'wb') as source_file:
+            source_file.write(log_sample)
+        columnar_log = ColumnarCustomLog()
+        columnar_log.load_file(source)
+        columnar_log.save(path, source=source)
+        assert_equal(columnar_log.entries,
+                     ColumnarCustomLog.open(path, source=source).entries)
+
+        with open(source, 'ab') as source_file:
+            source_file.write(log_sample)
+        assert_raises(ValueError, ColumnarCustomLog.open, path, source)
+        assert_raises(ValueError, ColumnarCustomLog.open, source)
+    finally:
+        os.remove(path)
+        os.remove(source)
+
+
+def test_columnar_trace_is_same_as_custom_log_trace():
+    custom_log, columnar_log = load_containers(log_sample * 2)
+    for ids in [{'sessionid': 'SID:34523'}, {'requestid': 'RID:7a323'},
+                {'sessionid': 'SID:1'}]:
+        custom_trace = custom_log.trace(**ids)
+        columnar_trace = columnar_log.trace(**ids)
+        assert_equal(custom_trace.entries, columnar_trace.entries)
+        assert_equal(custom_trace.gaps, columnar_trace.gaps)
+
+
+def test_columnar_retention_gives_same_results_as_custom_log():
+    custom_log, columnar_log = load_containers(log_sample * 3)
+    assert_true(columnar_log.memory_usage()['entries']
+                < custom_log.memory_usage()['entries'])
+    for log_container in (custom_log, columnar_log):
+        log_container.trace(sessionid='SID:42111')
+        assert_equal(19, log_container.retain(max_entries=3))
+    assert_equal(custom_log.entries, columnar_log.entries)
+    for field, value, value_to in [
+            ('loglevel', 'DEBUG', None), ('sessionid', 'SID:42111', None),
+            ('businessid', 'BID:1', 'BID:5'),
+            ('date', datetime(2012, 9, 13, 16, 5), None)]:
+        assert_equal(custom_log.find_by(field, value, value_to),
+                     columnar_log.find_by(field, value, value_to))
+    assert_equal(custom_log.trace(sessionid='SID:42111').entries,
+                 columnar_log.trace(sessionid='SID:42111').entries)
+    # values no entry has are dropped from the dictionaries
+    assert_equal(['SID:42111'], columnar_log._dictionaries['sessionid'])
+    assert_equal(['DEBUG', 'WARN'],
+                 sorted(columnar_log._dictionaries['loglevel']))
+    columnar_log.retain()
+    columnar_log.load(StringIO(log_sample))
+    assert_equal(custom_log.entries + load_containers(log_sample)[0].entries,
+                 columnar_log.entries)
+    assert_equal(['ERROR'], [entry.loglevel for entry in
+                             columnar_log.find_by('loglevel', 'ERROR')])
@@ -1,8 +1,16 @@
 from nose.tools import *
+from nose import SkipTest
 from logparser import logparser 
 from cStringIO import StringIO
-from datetime import datetime
+from datetime import datetime, timedelta
 from collections import namedtuple
+import bz2
+import gzip
+import os
+import tempfile
+import threading
+import time
+import zlib
 
 # tests for Custom log_container format
 def load_fa_container(stream_data):
@@ -127,3 +135,865 @@ def test_range_searching_with_no_matching_entries():
     log_container, entries = load_container()
     result = log_container.find_by('a', 10, 20)
     assert_equal([], result)
+
+
+def test_extend_gives_same_search_results_as_append():
+    log_container, entries = load_container()
+    bulk_container = logparser.LogContainer(['a'])
+    bulk_container.extend(entries)
+
+    assert_equal(entries, bulk_container.entries)
+    assert_equal(log_container.find_by('a', 2), bulk_container.find_by('a', 2))
+    assert_equal(log_container.find_by('a', 1, 3),
+                 bulk_container.find_by('a', 1, 3))
+
+
+def test_append_after_extend_is_searchable():
+    log_container = logparser.LogContainer(['a'])
+    log_container.extend([Entry(3, '+'), Entry(1, '-')])
+    log_container.append(Entry(2, '/'))
+    assert_equal([Entry(1, '-'), Entry(2, '/'), Entry(3, '+')],
+                 log_container.find_by('a', 1, 3))
+    log_container.extend([Entry(2, '%')])
+    assert_equal([Entry(2, '/'), Entry(2, '%')],
+                 log_container.find_by('a', 2))
+
+
+def test_extending_entries_with_no_searchable_fields_raises_error():
+    log_container = logparser.LogContainer(['c'])
+    assert_raises(ValueError, log_container.extend, [Entry(1, '+')])
+
+
+def test_bulk_load_gives_same_entries_and_results():
+    stream = """2012-01-01 00:00:00 DEBUG SID:1 BID:2 RID:3 'A
+B'
+2011-12-31 23:58:00 ERROR SID:4 BID:2 RID:5 'V'
+2011-12-31 23:59:00 DEBUG SID:1 BID:6 RID:7 'W'"""
+    log_container = load_fa_container(stream)
+    bulk_container = logparser.CustomLog()
+    bulk_container.load(StringIO(stream), bulk=True)
+
+    assert_equal(log_container.entries, bulk_container.entries)
+    for field, value in [('loglevel', 'DEBUG'), ('sessionid', 'SID:1'),
+                         ('businessid', 'BID:2')]:
+        assert_equal(log_container.find_by(field, value),
+                     bulk_container.find_by(field, value))
+    assert_equal(
+        logparser.find_entries_within_date_range(
+            log_container, '2011-12-31 23:58:00', '2012-01-01 00:00:00'),
+        logparser.find_entries_within_date_range(
+            bulk_container, '2011-12-31 23:58:00', '2012-01-01 00:00:00'))
+
+
+def test_parsers_produce_identical_entries():
+    stream = """2012-01-01 00:00:00 DEBUG SID:1 BID:2 RID:3 'A
+
+B'
+2011-12-31 23:58:00 DEBUG SID:4 BID:2 RID:5 'V'
+2011-12-31 23:58:00 ERROR SID:4 BID:2 RID:5 'W'\r
+continued'
+2011-12-31  23:58:00 ERROR SID:4 BID:2 RID:5 'X'
+2011-12-31 23:59:00 WARN SID:1 BID:6 RID:7a 'Y' 
+2011-12-31 23:59:01 WARN SID:1 BID:6 RID:7b 'Z'
+"""
+    regex_container = logparser.CustomLog(parser='regex')
+    regex_container.load(StringIO(stream))
+    fast_container = logparser.CustomLog(parser='fast')
+    fast_container.load(StringIO(stream))
+
+    assert_equal(4, len(regex_container.entries))
+    assert_equal(regex_container.entries, fast_container.entries)
+    assert_equal("'W'\r\ncontinued'", fast_container.entries[2].message)
+
+
+def test_fast_parser_falls_back_to_regex_for_unusual_lines():
+    # line with a newline inside the message, the regexp only matches
+    # the part before it
+    lines = ["2012-01-01 00:00:00 DEBUG SID:1 BID:2 RID:3 'A\nB'\n",
+             "C'\n"]
+    regex_container = logparser.CustomLog(parser='regex')
+    regex_container.load(lines)
+    fast_container = logparser.CustomLog(parser='fast')
+    fast_container.load(lines)
+    assert_equal("'A\nC'", fast_container.entries[0].message)
+    assert_equal(regex_container.entries, fast_container.entries)
+
+
+def test_fast_parser_rejects_malformed_dates_like_regex():
+    fast_container = logparser.CustomLog(parser='fast')
+    fast_container.load(StringIO(
+        "2012-01-0x 00:00:00 DEBUG SID:1 BID:2 RID:3 'A'"))
+    assert_false(fast_container.entries)
+    assert_raises(ValueError, load_fa_container,
+                  "2012-13-01 00:00:00 DEBUG SID:1 BID:2 RID:3 'A'")
+
+
+def test_unknown_parser_raises_error():
+    assert_raises(ValueError, logparser.CustomLog, parser='yacc')
+
+
+multiline_stream = """
+2012-09-13 16:04:22 DEBUG SID:34523 BID:1329 RID:65d33 'Starting new session'
+2012-09-13 16:04:30 DEBUG SID:34523 BID:1329 RID:54f22 'Authenticating User'
+2012-09-13 16:05:30 DEBUG SID:42111 BID:319 RID:65a23 'Starting new session'
+2012-09-13 16:04:50 ERROR SID:34523 BID:1329 RID:54ff3 'Missing
+Authentication token'
+2012-09-13 16:05:31 DEBUG SID:42111 BID:319 RID:86472 'Authenticating User'
+2012-09-13 16:05:31 DEBUG SID:42111 BID:319 RID:7a323 'Deleting asset
+
+with ID 543234'
+2012-09-13 16:05:32 WARN SID:42111 BID:319 RID:7a323 'Invalid asset ID'
+2012-09-13 16:05:33 WARN SID:42111 BID:319 RID:7a324 'Never
+2012-09-13 16:05:34 WARN SID:42111 BID:319 RID:7a325 'Finished'
+"""
+
+
+def write_log_file(data):
+    fd, path = tempfile.mkstemp(suffix='.log')
+    with os.fdopen(fd, 'wb') as log_file:
+        log_file.write(data)
+    return path
+
+
+def test_parallel_load_gives_same_entries_as_load():
+    path = write_log_file(multiline_stream * 3)
+    try:
+        expected = load_fa_container(multiline_stream * 3).entries
+        # chunk sizes that split entries and multiline messages
+        for chunk_size in (1, 17, 100, 10000):
+            log_container = logparser.CustomLog()
+            log_container.load_parallel(path, workers=1,
+                                        chunk_size=chunk_size)
+            assert_equal(expected, log_container.entries)
+
+        log_container = logparser.CustomLog()
+        log_container.load_parallel(path, workers=2, chunk_size=50)
+        assert_equal(expected, log_container.entries)
+        assert_equal(
+            load_fa_container(multiline_stream * 3).find_by('loglevel',
+                                                            'WARN'),
+            log_container.find_by('loglevel', 'WARN'))
+    finally:
+        os.remove(path)
+
+
+def test_mapped_load_gives_same_entries_as_load():
+    stream = multiline_stream + "2012-09-13 16:05:35 WARN SID:1 BID:2 RID:3 'A'"
+    path = write_log_file(stream)
+    try:
+        expected = load_fa_container(stream)
+        for mapped in (True, False):
+            log_container = logparser.CustomLog()
+            log_container.load_file(path, mmap=mapped)
+            assert_equal(expected.entries, log_container.entries)
+            assert_equal([str(entry) for entry in expected.entries],
+                         [str(entry) for entry in log_container.entries])
+            assert_equal(expected.find_by('sessionid', 'SID:42111'),
+                         log_container.find_by('sessionid', 'SID:42111'))
+    finally:
+        os.remove(path)
+
+
+def test_mapped_entry_message_is_read_on_access():
+    path = write_log_file(multiline_stream)
+    try:
+        log_container = logparser.CustomLog()
+        log_container.load_file(path, mmap=True)
+        entry = log_container.entries[3]
+        assert_true(isinstance(entry, log_container.MappedLogEntry))
+        assert_equal("'Missing\nAuthentication token'", entry.message)
+        assert_equal(entry.message, entry[5])
+        assert_equal("ERROR", entry.loglevel)
+        assert_equal("'A'", entry._replace(message="'A'").message)
+    finally:
+        os.remove(path)
+
+
+def test_mapped_load_of_empty_file_adds_no_entry():
+    path = write_log_file('')
+    try:
+        log_container = logparser.CustomLog()
+        log_container.load_file(path, mmap=True)
+        assert_false(log_container.entries)
+    finally:
+        os.remove(path)
+
+
+def test_loaded_file_can_be_truncated():
+    path = write_log_file(multiline_stream)
+    try:
+        log_container = logparser.CustomLog()
+        log_container.load_file(path)
+        open(path, 'w').close()
+        assert_equal("'Missing\nAuthentication token'",
+                     log_container.entries[3].message)
+    finally:
+        os.remove(path)
+
+
+def test_compressed_load_gives_same_entries_as_load():
+    stream = multiline_stream * 50 + \
+        "2012-09-13 16:05:35 WARN SID:1 BID:2 RID:3 'A'"
+    expected = load_fa_container(stream).entries
+    half = len(stream) // 2
+    for compress in [lambda data: zlib.compress(data),
+                     lambda data: gzip_compress(data),
+                     lambda data: gzip_compress(data[:half])
+                     + gzip_compress(data[half:]),
+                     bz2.compress,
+                     lambda data: bz2.compress(data[:half])
+                     + bz2.compress(data[half:])]:
+        path = write_log_file(compress(stream))
+        try:
+            log_container = logparser.CustomLog()
+            # small blocks split lines, messages and streams
+            log_container._compressed_block_size = 97
+            log_container._read_ahead_blocks = 2
+            log_container.load_file(path)
+            if compress(stream).startswith('x'):
+                # zlib stream without gzip header isn't recognised
+                assert_equal([], log_container.entries)
+            else:
+                assert_equal(expected, log_container.entries)
+        finally:
+            os.remove(path)
+
+
+def test_zstd_load_reads_all_frames():
+    if logparser.zstandard is None:
+        raise SkipTest("zstandard isn't installed")
+    stream = multiline_stream * 50
+    half = len(stream) // 2
+    compress = logparser.zstandard.ZstdCompressor().compress
+    path = write_log_file(compress(stream[:half]) + compress(stream[half:]))
+    try:
+        log_container = logparser.CustomLog()
+        log_container._compressed_block_size = 97
+        log_container.load_file(path)
+        assert_equal(load_fa_container(stream).entries,
+                     log_container.entries)
+    finally:
+        os.remove(path)
+
+
+def gzip_compress(data):
+    compressed = StringIO()
+    with gzip.GzipFile(fileobj=compressed, mode='wb') as gzip_file:
+        gzip_file.write(data)
+    return compressed.getvalue()
+
+
+def test_corrupted_compressed_file_raises_error():
+    for data, error in [
+            (gzip_compress(multiline_stream * 50)[:40] + 'x' * 100, IOError),
+            (bz2.compress(multiline_stream * 50)[:-10], EOFError)]:
+        path = write_log_file(data)
+        try:
+            assert_raises(error, logparser.CustomLog().load_file, path)
+        finally:
+            os.remove(path)
+
+
+def write_log_files(streams):
+    paths = [write_log_file(streams[0]),
+             write_log_file(gzip_compress(streams[1]))]
+    paths.extend(write_log_file(stream) for stream in streams[2:])
+    return paths
+
+
+interleaved_streams = [
+    """2012-09-13 16:04:22 DEBUG SID:1 BID:1 RID:1 'A'
+2012-09-13 16:06:00 ERROR SID:1 BID:1 RID:2 'B
+continued'
+2012-09-13 16:05:00 DEBUG SID:1 BID:1 RID:3 'C'
+""",
+    """2012-09-13 16:04:00 DEBUG SID:2 BID:1 RID:4 'D'
+2012-09-13 16:05:00 WARN SID:2 BID:1 RID:5 'E'
+""",
+    "",
+    """2012-09-13 16:05:30 DEBUG SID:3 BID:2 RID:6 'F'
+2012-09-13 16:04:22 DEBUG SID:3 BID:2 RID:7 'G'""",
+]
+
+
+def test_load_many_gives_same_results_as_loading_each_file():
+    paths = write_log_files(interleaved_streams)
+    try:
+        expected = logparser.CustomLog()
+        for stream in interleaved_streams:
+            expected.load(StringIO(stream))
+        for workers in (1, 2):
+            log_container = logparser.CustomLog(searchable_fields=[
+                'date', 'loglevel', ('sessionid', 'hash'), 'businessid'])
+            log_container.load_many(paths, workers=workers)
+            assert_equal(expected.entries, log_container.entries)
+            for field, value, value_to in [
+                    ('date', datetime(2012, 9, 13, 16, 4, 22),
+                     datetime(2012, 9, 13, 16, 5, 30)),
+                    ('date', datetime(2012, 9, 13, 16, 5), None),
+                    ('loglevel', 'DEBUG', None),
+                    ('sessionid', 'SID:3', None),
+                    ('businessid', 'BID:1', 'BID:2')]:
+                assert_equal(expected.find_by(field, value, value_to),
+                             log_container.find_by(field, value, value_to))
+    finally:
+        for path in paths:
+            os.remove(path)
+
+
+def test_load_many_records_source_of_entries():
+    paths = write_log_files(interleaved_streams)
+    try:
+        log_container = logparser.CustomLog()
+        log_container.load(StringIO(
+            "2012-09-13 16:04:00 DEBUG SID:4 BID:1 RID:8 'H'\n"
+            "2012-09-13 16:05:00 WARN SID:4 BID:1 RID:9 'I'\n"))
+        log_container.load_many(paths, workers=1)
+        assert_equal([(paths[0], 2, 5), (paths[1], 5, 7), (paths[2], 7, 7),
+                      (paths[3], 7, 9)], log_container.sources)
+        entries = log_container.entries
+        assert_equal([None, None, paths[0], paths[0], paths[0], paths[1],
+                      paths[1], paths[3], paths[3]],
+                     [log_container.source_of(entry) for entry in entries])
+    finally:
+        for path in paths:
+            os.remove(path)
+
+
+def test_sorted_index_orders_by_value_then_position():
+    index = logparser.SortedIndex()
+    index.insert(2, 0)
+    index.add(1, 1)
+    index.add(2, 2)
+    index.insert(1, 3)
+    assert_equal([1, 3, 0, 2], list(index.find(1, 2)))
+    assert_equal([0, 2], list(index.find(2, 2)))
+    assert_equal([], list(index.find(3, 4)))
+    assert_equal(4, len(index))
+
+
+def test_hash_index_finds_values_and_ranges():
+    index = logparser.HashIndex()
+    index.insert(2, 0)
+    index.add(1, 1)
+    index.insert(2, 2)
+    index.insert(1, 3)
+    assert_equal([0, 2], list(index.find(2, 2)))
+    assert_equal([1, 3, 0, 2], list(index.find(1, 2)))
+    assert_equal([], list(index.find(5, 5)))
+    assert_equal(4, len(index))
+
+
+def test_hash_indexed_container_gives_same_results_as_sorted():
+    sorted_container, entries = load_container()
+    hash_container = logparser.LogContainer([('a', 'hash')])
+    hash_container.extend(entries)
+    for value, value_to in [(2, None), (10, None), (2, 3), (10, 20)]:
+        assert_equal(sorted_container.find_by('a', value, value_to),
+                     hash_container.find_by('a', value, value_to))
+
+
+def test_custom_log_index_types_can_be_chosen():
+    stream = """2012-01-01 00:00:00 DEBUG SID:1 BID:2 RID:3 'A'
+2011-12-31 23:58:00 ERROR SID:10 BID:2 RID:5 'V'
+2011-12-31 23:59:00 DEBUG SID:1 BID:6 RID:7 'W'"""
+    hash_container = load_fa_container(stream)
+    sorted_container = logparser.CustomLog(searchable_fields=[
+        'date', 'loglevel', 'sessionid', 'businessid'])
+    sorted_container.load(StringIO(stream))
+    for field, value, value_to in [('loglevel', 'DEBUG', None),
+                                   ('sessionid', 'SID:1', None),
+                                   ('sessionid', 'SID:1', 'SID:5'),
+                                   ('businessid', 'BID:2', None)]:
+        assert_equal(sorted_container.find_by(field, value, value_to),
+                     hash_container.find_by(field, value, value_to))
+
+
+def test_unknown_index_type_raises_error():
+    assert_raises(ValueError, logparser.LogContainer, [('a', 'btree')])
+
+
+def test_token_index_finds_terms_phrases_and_prefixes():
+    index = logparser.TokenIndex()
+    index.insert("'Missing\nAuthentication token'", 0)
+    index.add("'Authenticating User'", 1)
+    index.insert("'Token of user'", 2)
+    assert_equal([0, 2], list(index.find('token', 'token')))
+    assert_equal([0], list(index.find('Authentication Token',
+                                      'Authentication Token')))
+    assert_equal([], list(index.find('token authentication',
+                                     'token authentication')))
+    assert_equal([0, 1], list(index.find('authentic*', 'authentic*')))
+    assert_equal([2], list(index.find('of us*', 'of us*')))
+    assert_equal([], list(index.find("''", "''")))
+    assert_equal(2, index.count('user', 'user'))
+    assert_raises(ValueError, index.find, 'a', 'b')
+    restored = logparser.TokenIndex.from_state(index.state())
+    assert_equal([0], list(restored.find('missing authentication',
+                                         'missing authentication')))
+
+
+def load_text_container(stream_data, bulk=False):
+    log_container = logparser.CustomLog(searchable_fields=[
+        'date', 'loglevel', 'sessionid', 'businessid', ('message', 'text')])
+    log_container.load(StringIO(stream_data), bulk=bulk)
+    return log_container
+
+
+def test_message_search_gives_same_results_as_scan():
+    for bulk in (False, True):
+        log_container = load_text_container(multiline_stream * 2, bulk)
+        for phrase, words in [('session', ['session']),
+                              ('authentication token',
+                               ['authentication', 'token']),
+                              ('ID 543234', ['id', '543234'])]:
+            expected = [entry for entry in log_container.entries
+                        if ' '.join(words) in ' '.join(
+                            entry.message.lower().strip("'").split())]
+            assert_true(expected)
+            assert_equal(expected, logparser.find_entries_with_message(
+                log_container, phrase))
+
+
+def test_message_search_combines_with_field_filters():
+    log_container = load_text_container(multiline_stream)
+    assert_equal([entry for entry in log_container.entries
+                  if entry.sessionid == 'SID:42111'
+                  and 'Authenticating' in entry.message],
+                 log_container.query(message='authenticat*',
+                                     sessionid='SID:42111'))
+    assert_equal([], log_container.query(message='token', loglevel='DEBUG'))
+
+
+def test_message_condition_is_searched_once():
+    log_container = load_text_container(multiline_stream * 10)
+    bucket = log_container._buckets['message']
+    searches = []
+    find = bucket.find
+
+    def counted_find(value, value_to):
+        searches.append(value)
+        return find(value, value_to)
+
+    bucket.find = counted_find
+    for conditions in [dict(message='authenticat*'),
+                       dict(message='authenticat*', sessionid='SID:42111'),
+                       dict(message='token', loglevel='DEBUG')]:
+        del searches[:]
+        found = log_container.query(**conditions)
+        assert_equal(1, len(searches))
+    assert_equal([], found)
+
+def test_query_matches_all_conditions_in_log_order():
+    log_container = load_fa_container(multiline_stream * 2)
+    date_from = datetime(2012, 9, 13, 16, 4, 30)
+    date_to = datetime(2012, 9, 13, 16, 5, 31)
+
+    found = log_container.query(loglevel='DEBUG', businessid='BID:319',
+                                date=(date_from, date_to))
+    expected = [entry for entry in log_container.entries
+                if entry.loglevel == 'DEBUG' and entry.businessid == 'BID:319'
+                and date_from <= entry.date <= date_to]
+    assert_equal(6, len(found))
+    assert_equal(expected, found)
+
+
+def test_query_with_single_or_no_conditions():
+    log_container = load_fa_container(multiline_stream)
+    assert_equal(log_container.find_by('sessionid', 'SID:34523'),
+                 log_container.query(sessionid='SID:34523'))
+    assert_equal([], log_container.query(sessionid='SID:34523',
+                                         loglevel='WARN'))
+    assert_equal(log_container.entries, log_container.query())
+
+
+def test_query_by_nonsearchable_field_raises_error():
+    log_container = load_fa_container(multiline_stream)
+    assert_raises(ValueError, log_container.query, requestid='RID:65d33')
+
+
+def test_lazy_find_returns_view_of_results():
+    log_container = load_fa_container(multiline_stream * 3)
+    found = log_container.find_by('loglevel', 'DEBUG')
+    view = logparser.find_entries_with_log_level(log_container, 'DEBUG',
+                                                 lazy=True)
+    assert_true(isinstance(view, logparser.ResultView))
+    assert_equal(len(found), len(view))
+    assert_equal(len(found), view.count())
+    assert_equal(found, list(view))
+    assert_equal(found[2], view[2])
+    assert_equal(found[-1], view[-1])
+    assert_equal(found[3:7], list(view[3:7]))
+    assert_equal(found[10:], view.page(10, 50))
+    assert_equal([], view.page(100, 50))
+
+
+def test_lazy_query_returns_view_of_results():
+    log_container = load_fa_container(multiline_stream * 3)
+    view = log_container.query(lazy=True, sessionid='SID:42111',
+                               loglevel='DEBUG')
+    assert_equal(log_container.query(sessionid='SID:42111',
+                                     loglevel='DEBUG'), list(view))
+    assert_equal(log_container.entries, list(log_container.query(lazy=True)))
+
+
+def test_aggregate_counts_by_fields_and_intervals():
+    log_container = load_fa_container(multiline_stream)
+    counts = log_container.aggregate(group_by=['businessid', 'loglevel'],
+                                     interval='1m')
+    assert_equal({
+        (datetime(2012, 9, 13, 16, 4), 'BID:1329', 'DEBUG'): 2,
+        (datetime(2012, 9, 13, 16, 4), 'BID:1329', 'ERROR'): 1,
+        (datetime(2012, 9, 13, 16, 5), 'BID:319', 'DEBUG'): 3,
+        (datetime(2012, 9, 13, 16, 5), 'BID:319', 'WARN'): 2,
+    }, counts)
+
+
+def test_aggregate_within_date_range():
+    log_container = load_fa_container(multiline_stream)
+    counts = log_container.aggregate(
+        group_by=['loglevel'],
+        date_range=(datetime(2012, 9, 13, 16, 4, 50),
+                    datetime(2012, 9, 13, 16, 5, 31)))
+    assert_equal({('ERROR',): 1, ('DEBUG',): 3}, counts)
+    assert_equal({(): 4}, log_container.aggregate(
+        date_range=(datetime(2012, 9, 13, 16, 4, 50),
+                    datetime(2012, 9, 13, 16, 5, 31))))
+
+
+def test_result_cache_counts_hits_and_misses():
+    log_container = load_fa_container(multiline_stream)
+    assert_equal(None, log_container.result_cache)
+    cache = log_container.cache_results()
+    errors = logparser.find_entries_with_log_level(log_container, 'ERROR')
+    assert_equal(errors, logparser.find_entries_with_log_level(
+        log_container, 'ERROR'))
+    assert_equal((1, 1), (cache.hits, cache.misses))
+    assert_equal(1, len(cache))
+    log_container.cache_results(0)
+    assert_equal(None, log_container.result_cache)
+
+
+def test_cached_results_follow_appended_entries():
+    for bulk in (False, True):
+        log_container = load_fa_container(multiline_stream)
+        cache = log_container.cache_results()
+        date_from = datetime(2012, 9, 13, 16, 5)
+        date_to = datetime(2012, 9, 13, 16, 5, 30)
+        searches = [('loglevel', 'DEBUG', None),
+                    ('sessionid', 'SID:42111', None),
+                    ('date', date_from, date_to),
+                    ('date', datetime(2012, 9, 13, 16, 4), date_from)]
+        for search in searches:
+            log_container.find_by(*search)
+        log_container.load(StringIO(
+            "2012-09-13 16:05:10 DEBUG SID:42111 BID:319 RID:1 'More'\n"
+            "2012-09-13 16:05:11 ERROR SID:5 BID:319 RID:2 'Other'\n"),
+            bulk=bulk)
+        # the range which new entries fall within is dropped
+        assert_equal(3, len(cache))
+        uncached = load_fa_container(multiline_stream)
+        uncached.extend(log_container.entries[-2:])
+        for search in searches:
+            assert_equal(uncached.find_by(*search),
+                         log_container.find_by(*search))
+        assert_equal(3, cache.hits)
+
+
+def test_result_cache_keeps_size_bound():
+    log_container = load_fa_container(multiline_stream * 10)
+    cache = log_container.cache_results(max_size=1000)
+    log_container.find_by('loglevel', 'DEBUG')
+    log_container.find_by('loglevel', 'WARN')
+    log_container.find_by('loglevel', 'ERROR')
+    assert_true(cache.size <= 1000)
+    assert_equal(2, len(cache))
+    log_container.find_by('loglevel', 'ERROR')
+    assert_equal(1, cache.hits)
+    log_container.find_by('loglevel', 'DEBUG')
+    assert_equal(1, cache.hits)
+
+
+def test_text_search_results_are_dropped_on_append():
+    log_container = load_text_container(multiline_stream)
+    cache = log_container.cache_results()
+    assert_equal(1, len(log_container.find_by('message', 'token')))
+    log_container.load(StringIO(
+        "2012-09-13 16:05:10 DEBUG SID:1 BID:319 RID:1 'Token'\n"))
+    assert_equal(0, len(cache))
+    assert_equal(2, len(log_container.find_by('message', 'token')))
+
+
+def test_trace_orders_entries_by_date():
+    log_container = load_fa_container(multiline_stream)
+    trace = log_container.trace(sessionid='SID:34523')
+    assert_equal(sorted(log_container.find_by('sessionid', 'SID:34523'),
+                        key=lambda entry: entry.date),
+                 trace.entries)
+    assert_equal(['RID:65d33', 'RID:54f22', 'RID:54ff3'],
+                 [entry.requestid for entry in trace])
+    assert_equal(datetime(2012, 9, 13, 16, 4, 22), trace.start)
+    assert_equal(timedelta(seconds=28), trace.duration)
+    assert_equal([timedelta(seconds=8), timedelta(seconds=20)], trace.gaps)
+    assert_equal(timedelta(seconds=20), trace.max_gap)
+    assert_equal(timedelta(seconds=14), trace.mean_gap)
+
+    trace = log_container.trace(requestid='RID:7a323')
+    assert_equal(2, len(trace))
+    assert_equal(timedelta(seconds=1), trace.duration)
+
+
+def test_trace_includes_entries_added_later():
+    log_container = load_fa_container(multiline_stream)
+    assert_equal(3, len(log_container.trace(sessionid='SID:34523')))
+    log_container.load(StringIO(
+        "2012-09-13 16:04:00 DEBUG SID:34523 BID:1329 RID:1 'Early'\n"
+        "2012-09-13 16:06:00 DEBUG SID:34523 BID:1329 RID:2 'Late'\n"))
+    trace = log_container.trace(sessionid='SID:34523')
+    assert_equal(['RID:1', 'RID:65d33', 'RID:54f22', 'RID:54ff3', 'RID:2'],
+                 [entry.requestid for entry in trace])
+    assert_equal(timedelta(minutes=2), trace.duration)
+
+
+def test_trace_of_unknown_or_missing_id():
+    log_container = load_fa_container(multiline_stream)
+    trace = log_container.trace(requestid='RID:0')
+    assert_equal([], trace.entries)
+    assert_equal(None, trace.start)
+    assert_equal(timedelta(0), trace.duration)
+    assert_raises(ValueError, log_container.trace)
+    assert_raises(ValueError, log_container.trace, 'SID:1', 'RID:1')
+
+
+def test_parse_interval():
+    assert_equal(30, logparser.parse_interval('30s'))
+    assert_equal(300, logparser.parse_interval('5m'))
+    assert_equal(7200, logparser.parse_interval('2h'))
+    assert_equal(86400, logparser.parse_interval('1d'))
+    assert_equal(90, logparser.parse_interval(90))
+    assert_raises(ValueError, logparser.parse_interval, '5 minutes')
+    assert_raises(ValueError, logparser.parse_interval, 0)
+
+
+def test_follow_loads_appended_entries_only():
+    path = write_log_file("2012-01-01 00:00:00 DEBUG SID:1 BID:2 RID:3 'A'\n"
+                          "2012-01-01 00:00:01 ERROR SID:1 BID:2 RID:4 'B\n")
+    try:
+        log_container = logparser.CustomLog()
+        follower = log_container.follow(path)
+        assert_equal(["'A'"], [e.message for e in log_container.entries])
+
+        with open(path, 'ab') as log_file:
+            # rest of the multiline message and an incomplete line
+            log_file.write("C'\n2012-01-01 00:00:02 WARN SID:5 BID:2 RID:5 'D")
+        assert_equal(1, follower.refresh())
+        assert_equal(["'A'", "'B\nC'"],
+                     [e.message for e in log_container.entries])
+        assert_equal(2, len(log_container.find_by('sessionid', 'SID:1')))
+
+        with open(path, 'ab') as log_file:
+            log_file.write("'\n")
+        assert_equal(1, follower.refresh())
+        assert_equal(0, follower.refresh())
+        assert_equal(["'D'"], [e.message for e in
+                               log_container.find_by('loglevel', 'WARN')])
+        assert_equal(os.path.getsize(path), follower.offset)
+        follower.stop()
+    finally:
+        os.remove(path)
+
+
+def test_follow_handles_truncation_and_rotation():
+    path = write_log_file("2012-01-01 00:00:00 DEBUG SID:1 BID:2 RID:3 'A'\n")
+    try:
+        log_container = logparser.CustomLog()
+        follower = log_container.follow(path)
+
+        # truncated and rewritten
+        with open(path, 'wb') as log_file:
+            log_file.write("2012-01-01 00:00:01 DEBUG SID:1 BID:2 RID:3 'B'\n")
+        assert_equal(1, follower.refresh())
+
+        # rotated, entry appended to the old file before rotation is loaded
+        with open(path, 'ab') as log_file:
+            log_file.write("2012-01-01 00:00:02 DEBUG SID:1 BID:2 RID:3 'C'\n")
+        os.rename(path, path + '.1')
+        with open(path, 'wb') as log_file:
+            log_file.write("2012-01-01 00:00:03 DEBUG SID:1 BID:2 RID:3 'D'\n")
+        assert_equal(2, follower.refresh())
+        follower.stop()
+        assert_equal(["'A'", "'B'", "'C'", "'D'"],
+                     [e.message for e in log_container.entries])
+    finally:
+        os.remove(path)
+        os.remove(path + '.1')
+
+
+def test_follow_refreshes_in_background():
+    path = write_log_file('')
+    try:
+        log_container = logparser.CustomLog()
+        follower = log_container.follow(path, interval=0.01)
+        with open(path, 'ab') as log_file:
+            log_file.write("2012-01-01 00:00:00 DEBUG SID:1 BID:2 RID:3 'A'\n")
+        for _ in range(500):
+            if log_container.find_by('businessid', 'BID:2'):
+                break
+            time.sleep(0.01)
+        follower.stop()
+        assert_equal(1, len(log_container.find_by('businessid', 'BID:2')))
+    finally:
+        os.remove(path)
+
+
+def numbered_stream(first, last):
+    """Entries a minute apart, numbers in their sessions and messages"""
+    return ''.join(
+        "%s %s SID:%d BID:%d RID:%x 'Entry %d'\n" % (
+            (datetime(2012, 9, 13) + timedelta(minutes=number)).strftime(
+                logparser.CustomLog.date_format),
+            ('DEBUG', 'WARN', 'ERROR')[number % 3], number % 7,
+            number % 2, number, number)
+        for number in xrange(first, last))
+
+
+def assert_same_searches(expected, log_container):
+    assert_equal(expected.entries, log_container.entries)
+    for field, value, value_to in [
+            ('date', datetime(2012, 9, 13, 1), datetime(2012, 9, 13, 2)),
+            ('loglevel', 'ERROR', None),
+            ('sessionid', 'SID:3', None),
+            ('businessid', 'BID:0', 'BID:1'),
+            ('message', 'entry', None)]:
+        assert_equal(expected.find_by(field, value, value_to),
+                     log_container.find_by(field, value, value_to))
+    assert_equal(expected.query(sessionid='SID:5', loglevel='WARN'),
+                 log_container.query(sessionid='SID:5', loglevel='WARN'))
+    assert_equal(expected.trace(sessionid='SID:2').entries,
+                 log_container.trace(sessionid='SID:2').entries)
+
+
+def test_retention_evicts_first_entries_in_batches():
+    for bulk in (False, True):
+        log_container = load_text_container(numbered_stream(0, 80), bulk)
+        cache = log_container.cache_results()
+        log_container.find_by('sessionid', 'SID:3')
+        log_container.trace(sessionid='SID:2')
+        assert_equal(31, log_container.retain(max_entries=55))
+        assert_same_searches(load_text_container(numbered_stream(31, 80)),
+                             log_container)
+        # compacted cached result was used
+        assert_equal(1, cache.hits)
+
+        # limit is exceeded by the 56th entry, 10% below it are kept
+        log_container.load(StringIO(numbered_stream(80, 86)), bulk)
+        assert_equal(55, len(log_container.entries))
+        log_container.load(StringIO(numbered_stream(86, 87)), bulk)
+        assert_same_searches(load_text_container(numbered_stream(38, 87)),
+                             log_container)
+
+        log_container.retain()
+        log_container.load(StringIO(numbered_stream(87, 101)), bulk)
+        assert_equal(63, len(log_container.entries))
+
+
+def test_retention_evicts_entries_older_than_max_age():
+    log_container = load_text_container(numbered_stream(0, 100))
+    # latest entry is at 1:39, once there are entries older than
+    # 10 minutes, entries within 9 minutes are kept
+    log_container.retain(max_age='10m')
+    assert_equal(datetime(2012, 9, 13, 1, 30), log_container.entries[0].date)
+    log_container.load(StringIO(numbered_stream(100, 101)))
+    assert_equal(11, len(log_container.entries))
+    log_container.load(StringIO(numbered_stream(101, 102)))
+    assert_equal(datetime(2012, 9, 13, 1, 32), log_container.entries[0].date)
+
+
+def test_retention_keeps_memory_within_max_bytes():
+    log_container = load_fa_container(numbered_stream(0, 1000))
+    max_bytes = log_container.memory_usage()['total'] // 2
+    log_container.retain(max_bytes=max_bytes)
+    log_container.load(StringIO(numbered_stream(1000, 3000)), bulk=True)
+    entries = log_container.entries
+    assert_true(300 < len(entries) < 500, len(entries))
+    assert_equal(2999, int(entries[-1].message.split()[1][:-1]))
+    assert_true(log_container.memory_usage()['total'] <= max_bytes * 1.1)
+
+
+def test_memory_usage_by_component():
+    log_container = load_text_container(numbered_stream(0, 100))
+    log_container.cache_results()
+    log_container.trace(sessionid='SID:1')
+    log_container.find_by('loglevel', 'DEBUG')
+    usage = log_container.memory_usage()
+    assert_equal(sorted(['entries', 'indexes', 'result_cache', 'traces',
+                         'total']), sorted(usage))
+    assert_equal(sorted(['date', 'loglevel', 'sessionid', 'businessid',
+                         'message']), sorted(usage['indexes']))
+    assert_equal(['sessionid'], usage['traces'].keys())
+    assert_true(all(size > 0 for size in usage['indexes'].values()))
+    assert_equal(usage['entries'] + usage['result_cache']
+                 + sum(usage['indexes'].values())
+                 + sum(usage['traces'].values()), usage['total'])
+
+    log_container.retain(max_entries=20)
+    evicted_usage = log_container.memory_usage()
+    assert_true(evicted_usage['entries'] < usage['entries'] / 2)
+    assert_true(evicted_usage['indexes']['message']
+                < usage['indexes']['message'] / 2)
+
+
+def test_lazy_results_skip_evicted_entries():
+    log_container = load_fa_container(numbered_stream(0, 20))
+    found = log_container.find_by('businessid', 'BID:1', lazy=True)
+    second_half = found[5:]
+    log_container.retain(max_entries=10)
+    expected = [entry for entry in log_container.entries
+                if entry.businessid == 'BID:1']
+    assert_equal(expected, list(found))
+    assert_equal(expected, list(second_half))
+    assert_equal(expected[-1], found[-1])
+    assert_raises(IndexError, found.__getitem__, 0)
+
+
+def test_lazy_results_can_be_read_while_entries_are_evicted():
+    log_container = load_fa_container(numbered_stream(0, 100))
+    log_container.retain(max_entries=100)
+    entries = load_fa_container(numbered_stream(100, 3100)).entries
+
+    def load():
+        for entry in entries:
+            log_container.append(entry)
+
+    loader = threading.Thread(target=load)
+    loader.start()
+    try:
+        while loader.is_alive():
+            found = log_container.find_by('businessid', 'BID:1', lazy=True)
+            found._chunk_size = 1
+            numbers = [int(entry.message.split()[1][:-1])
+                       for entry in found]
+            assert_equal(sorted(numbers), numbers)
+            assert_true(all(number % 2 == 1 for number in numbers))
+            try:
+                assert_equal('BID:1', found[-1].businessid)
+            except IndexError:
+                # entry was evicted
+                pass
+    finally:
+        loader.join()
+
+def test_sources_follow_evicted_entries():
+    paths = write_log_files(interleaved_streams)
+    try:
+        log_container = logparser.CustomLog()
+        log_container.load_many(paths, workers=1)
+        log_container.retain(max_entries=4)
+        assert_equal([(paths[1], 3, 5), (paths[2], 5, 5), (paths[3], 5, 7)],
+                     log_container.sources)
+        assert_equal([paths[1], paths[3], paths[3]],
+                     [log_container.source_of(entry)
+                      for entry in log_container.entries])
+    finally:
+        for path in paths:
+            os.remove(path)
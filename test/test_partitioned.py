@@ -0,0 +1,279 @@
+from nose.tools import *
+from logparser import logparser
+from logparser.partitioned import PartitionedCustomLog
+from cStringIO import StringIO
+from datetime import datetime
+import os
+import shutil
+import tempfile
+import threading
+
+log_sample = """
+2012-09-13 16:04:22 DEBUG SID:34523 BID:1329 RID:65d33 'Starting new session'
+2012-09-13 16:04:30 DEBUG SID:34523 BID:1329 RID:54f22 'Authenticating User'
+2012-09-13 16:05:30 DEBUG SID:42111 BID:319 RID:65a23 'Starting new session'
+2012-09-13 16:04:50 ERROR SID:34523 BID:1329 RID:54ff3 'Missing
+Authentication token'
+2012-09-13 16:05:31 DEBUG SID:42111 BID:319 RID:86472 'Authenticating User'
+2012-09-13 16:07:31 DEBUG SID:42111 BID:319 RID:7a323 'Deleting asset
+with ID 543234'
+2012-09-13 16:07:32 WARN SID:42111 BID:319 RID:7a323 'Invalid asset ID'
+2012-09-13 16:04:59 WARN SID:34523 BID:1329 RID:5ab12 'Late entry'
+"""
+
+
+def load_containers(stream_data, bulk=False):
+    custom_log = logparser.CustomLog()
+    custom_log.load(StringIO(stream_data), bulk=bulk)
+    partitioned_log = PartitionedCustomLog(partition='1m')
+    partitioned_log.load(StringIO(stream_data), bulk=bulk)
+    return custom_log, partitioned_log
+
+
+def test_partitioned_entries_are_same_as_custom_log_entries():
+    for bulk in (False, True):
+        custom_log, partitioned_log = load_containers(log_sample, bulk)
+        assert_equal(8, len(partitioned_log.entries))
+        assert_equal(custom_log.entries, partitioned_log.entries)
+        assert_equal([datetime(2012, 9, 13, 16, 4),
+                      datetime(2012, 9, 13, 16, 5),
+                      datetime(2012, 9, 13, 16, 7)],
+                     partitioned_log.windows)
+
+
+def test_partitioned_search_results_are_same_as_custom_log_results():
+    custom_log, partitioned_log = load_containers(log_sample)
+    for find, args in [
+            (logparser.find_entries_with_log_level, ['DEBUG']),
+            (logparser.find_entries_with_log_level, ['WARN']),
+            (logparser.find_entries_with_business_id, ['BID:319']),
+            (logparser.find_entries_with_session_id, ['SID:34523']),
+            (logparser.find_entries_with_session_id, ['SID:1']),
+            (logparser.find_entries_within_date_range,
+             ['2012-09-13 16:04:30', '2012-09-13 16:05:31']),
+            (logparser.find_entries_within_date_range,
+             ['2012-09-13 16:06:00', '2012-09-13 16:06:59'])]:
+        assert_equal(find(custom_log, *args), find(partitioned_log, *args))
+    assert_equal(custom_log.find_by('sessionid', 'SID:1', 'SID:4'),
+                 partitioned_log.find_by('sessionid', 'SID:1', 'SID:4'))
+
+
+def test_partitioned_cached_results_follow_changes():
+    for bulk in (False, True):
+        custom_log, partitioned_log = load_containers(log_sample)
+        cache = partitioned_log.cache_results()
+        searches = [('loglevel', 'DEBUG', None),
+                    ('sessionid', 'SID:1', 'SID:4'),
+                    ('date', datetime(2012, 9, 13, 16, 4),
+                     datetime(2012, 9, 13, 16, 5, 30))]
+        for search in searches:
+            partitioned_log.find_by(*search)
+        assert_equal(3, len(cache))
+        new_entries = ("2012-09-13 16:04:40 DEBUG SID:2 BID:1 RID:1 'A'\n"
+                       "2012-09-13 16:06:00 ERROR SID:3 BID:1 RID:2 'B'\n")
+        custom_log.load(StringIO(new_entries), bulk=bulk)
+        partitioned_log.load(StringIO(new_entries), bulk=bulk)
+        # ranges which new entries fall within are dropped
+        assert_equal(1, len(cache))
+        for search in searches:
+            assert_equal(custom_log.find_by(*search),
+                         partitioned_log.find_by(*search))
+        assert_equal(1, cache.hits)
+        assert_true(partitioned_log.memory_usage()['result_cache'] > 0)
+        partitioned_log.evict(datetime(2012, 9, 13, 16, 5))
+        assert_equal(0, len(cache))
+        assert_equal([entry for entry in custom_log.find_by(*searches[0])
+                      if entry.date >= datetime(2012, 9, 13, 16, 5)],
+                     partitioned_log.find_by(*searches[0]))
+
+def test_partitioned_query_and_aggregate():
+    custom_log, partitioned_log = load_containers(log_sample)
+    date_range = (datetime(2012, 9, 13, 16, 4, 30),
+                  datetime(2012, 9, 13, 16, 7, 31))
+    for conditions in [{},
+                       {'sessionid': 'SID:42111', 'loglevel': 'DEBUG'},
+                       {'date': date_range, 'loglevel': 'WARN'}]:
+        assert_equal(custom_log.query(**conditions),
+                     partitioned_log.query(**conditions))
+    view = partitioned_log.query(lazy=True, loglevel='DEBUG')
+    assert_equal(custom_log.query(loglevel='DEBUG')[1:3], list(view[1:3]))
+    for args in [{'group_by': ['loglevel']},
+                 {'group_by': ['sessionid'], 'interval': '30s'},
+                 {'group_by': ['loglevel'], 'date_range': date_range}]:
+        assert_equal(custom_log.aggregate(**args),
+                     partitioned_log.aggregate(**args))
+
+
+def test_partitioned_trace_is_same_as_custom_log_trace():
+    custom_log, partitioned_log = load_containers(log_sample)
+    for ids in [{'sessionid': 'SID:34523'}, {'sessionid': 'SID:42111'},
+                {'requestid': 'RID:7a323'}]:
+        assert_equal(custom_log.trace(**ids).entries,
+                     partitioned_log.trace(**ids).entries)
+    assert_equal(custom_log.trace(sessionid='SID:42111').duration,
+                 partitioned_log.trace(sessionid='SID:42111').duration)
+
+
+def test_partitioned_load_many_records_sources():
+    paths = []
+    try:
+        for stream in (log_sample, log_sample):
+            fd, path = tempfile.mkstemp(suffix='.log')
+            with os.fdopen(fd, 'wb') as log_file:
+                log_file.write(stream)
+            paths.append(path)
+        partitioned_log = PartitionedCustomLog(partition='1m')
+        partitioned_log.load_many(paths, workers=1)
+        custom_log = load_containers(log_sample * 2)[0]
+        assert_equal(custom_log.entries, partitioned_log.entries)
+        assert_equal([(paths[0], 0, 8), (paths[1], 8, 16)],
+                     partitioned_log.sources)
+        assert_equal(paths[0],
+                     partitioned_log.source_of(partitioned_log.entries[7]))
+    finally:
+        for path in paths:
+            os.remove(path)
+
+
+def test_partitioned_rejects_bad_entries():
+    partitioned_log = PartitionedCustomLog()
+    assert_raises(ValueError, partitioned_log.append, ('no', 'date'))
+    assert_raises(ValueError, partitioned_log.find_by, 'message', 'x')
+    assert_equal([], partitioned_log.entries)
+
+
+def test_partitioned_evict():
+    custom_log, partitioned_log = load_containers(log_sample)
+    assert_equal(4, partitioned_log.evict(datetime(2012, 9, 13, 16, 5, 30)))
+    assert_equal([entry for entry in custom_log.entries
+                  if entry.date >= datetime(2012, 9, 13, 16, 5)],
+                 partitioned_log.entries)
+    assert_equal([], partitioned_log.find_by('loglevel', 'ERROR'))
+
+
+def test_partitioned_spill_loads_shards_back():
+    custom_log, partitioned_log = load_containers(log_sample)
+    directory = tempfile.mkdtemp()
+    try:
+        partitioned_log.spill(datetime(2012, 9, 13, 16, 7), directory)
+        assert_equal(4, len(os.listdir(directory)))
+        assert_equal(custom_log.find_by('sessionid', 'SID:42111')[-2:],
+                     partitioned_log.find_by('date',
+                                             datetime(2012, 9, 13, 16, 7),
+                                             datetime(2012, 9, 13, 16, 8)))
+        assert_equal(4, len(os.listdir(directory)))
+        assert_equal(custom_log.find_by('loglevel', 'ERROR'),
+                     partitioned_log.find_by('loglevel', 'ERROR'))
+        assert_equal(custom_log.entries, partitioned_log.entries)
+        assert_equal(custom_log.trace(sessionid='SID:34523').entries,
+                     partitioned_log.trace(sessionid='SID:34523').entries)
+        # searches only open spilled shards
+        assert_equal(4, len(os.listdir(directory)))
+        assert_equal(1, len(partitioned_log._shards))
+        assert_true(len(partitioned_log._opened)
+                    <= partitioned_log._opened_limit)
+
+        # shard is loaded back as shard_type once its window gets entries
+        new_entry = ("2012-09-13 16:05:40 WARN SID:1 BID:1 RID:1 'New'\n")
+        custom_log.load(StringIO(new_entry))
+        partitioned_log.load(StringIO(new_entry))
+        assert_equal(2, len(os.listdir(directory)))
+        assert_equal(logparser.CustomLog,
+                     type(partitioned_log._shards[
+                         partitioned_log._window_of(
+                             datetime(2012, 9, 13, 16, 5))]))
+        assert_equal(custom_log.entries, partitioned_log.entries)
+        assert_equal(custom_log.find_by('sessionid', 'SID:1', 'SID:4'),
+                     partitioned_log.find_by('sessionid', 'SID:1', 'SID:4'))
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_partitioned_retention_evicts_whole_shards():
+    custom_log, partitioned_log = load_containers(log_sample)
+    usage = partitioned_log.memory_usage()
+    assert_true(usage['sequences'] > 0)
+    assert_equal(sorted(['date', 'loglevel', 'sessionid', 'businessid']),
+                 sorted(usage['indexes']))
+
+    # shard of 16:04 ends over 2 minutes before 16:07:32, shard of 16:05
+    # doesn't, though some of its entries are older
+    assert_equal(4, partitioned_log.retain(max_age='2m'))
+    assert_equal([entry for entry in custom_log.entries
+                  if entry.date >= datetime(2012, 9, 13, 16, 5)],
+                 partitioned_log.entries)
+    assert_equal(2, partitioned_log.retain(max_entries=3))
+    assert_equal(custom_log.find_by('sessionid', 'SID:42111')[-2:],
+                 partitioned_log.entries)
+    assert_true(partitioned_log.memory_usage()['total'] < usage['total'])
+
+
+def test_partitioned_retention_keeps_the_latest_shard():
+    partitioned_log = PartitionedCustomLog(partition='1h')
+    partitioned_log.retain(max_entries=50)
+    stream = ''.join("2012-09-13 16:%02d:00 DEBUG SID:1 BID:1 RID:%x 'A'\n"
+                     % (number // 2, number) for number in xrange(120))
+    partitioned_log.load(StringIO(stream))
+    # all entries are in one window, which is never evicted
+    assert_equal(120, len(partitioned_log.entries))
+    partitioned_log.load(StringIO(
+        "2012-09-13 17:00:00 DEBUG SID:2 BID:1 RID:1 'B'\n"))
+    assert_equal(['SID:2'], [entry.sessionid
+                             for entry in partitioned_log.entries])
+
+
+def test_partitioned_lazy_results_skip_evicted_shards():
+    partitioned_log = load_containers(log_sample)[1]
+    found = partitioned_log.find_by('sessionid', 'SID:34523', lazy=True)
+    all_found = partitioned_log.find_by('loglevel', 'DEBUG', lazy=True)
+    partitioned_log.evict(datetime(2012, 9, 13, 16, 5))
+    assert_equal([], list(found))
+    assert_raises(IndexError, found.__getitem__, 0)
+    # shard of a window evicted after the search is created again
+    partitioned_log.load(StringIO(
+        "2012-09-13 16:04:10 DEBUG SID:1 BID:1 RID:1 'New'\n"))
+    assert_equal([], list(found))
+    assert_equal(['16:05:30', '16:05:31', '16:07:31'],
+                 [entry.date.strftime('%H:%M:%S') for entry in all_found])
+
+
+def test_partitioned_lazy_results_can_be_read_while_shards_are_evicted():
+    stream = ''.join("2012-09-13 %02d:%02d:00 DEBUG SID:%d BID:1 RID:%x 'A'\n"
+                     % (number // 60, number % 60, number, number)
+                     for number in xrange(1400))
+    entries = load_containers(stream)[0].entries
+    partitioned_log = PartitionedCustomLog(partition='1m')
+    partitioned_log.extend(entries[:100])
+    partitioned_log.retain(max_entries=100)
+
+    def load():
+        for entry in entries[100:]:
+            partitioned_log.append(entry)
+
+    loader = threading.Thread(target=load)
+    loader.start()
+    try:
+        while loader.is_alive():
+            found = partitioned_log.find_by('businessid', 'BID:1', lazy=True)
+            found._chunk_size = 1
+            numbers = [int(entry.sessionid[4:]) for entry in found]
+            assert_equal(sorted(set(numbers)), numbers)
+    finally:
+        loader.join()
+
+def test_partitioned_eviction_drops_sources_of_evicted_entries():
+    paths = []
+    try:
+        for stream in ("2012-09-13 16:04:00 DEBUG SID:1 BID:1 RID:1 'A'\n",
+                       "2012-09-13 16:06:00 DEBUG SID:2 BID:1 RID:2 'B'\n"):
+            fd, path = tempfile.mkstemp()
+            os.write(fd, stream)
+            os.close(fd)
+            paths.append(path)
+        partitioned_log = PartitionedCustomLog(partition='1m')
+        partitioned_log.load_many(paths, workers=1)
+        partitioned_log.evict(datetime(2012, 9, 13, 16, 5))
+        assert_equal([(paths[1], 1, 2)], partitioned_log.sources)
+    finally:
+        for path in paths:
+            os.remove(path)
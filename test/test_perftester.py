@@ -1,7 +1,21 @@
 from nose.tools import *
-from logparser.perftester import PerformanceTester
+from logparser import perftester
+from logparser.perftester import PerformanceTester, RunningStats, \
+    qualified_name
+from timeit import default_timer
+from cStringIO import StringIO
+import csv
+import gc
+import json
+import multiprocessing
+import threading
 import time
 
+
+def noop():
+    pass
+
+
 def test_performance_tester():
     perf_tester = PerformanceTester()
 
@@ -18,8 +32,8 @@ def test_performance_tester():
     test_fn1()
     
     results = perf_tester.results()
-    assert_equal(['test_fn1'], results.keys())
-    result = results['test_fn1']
+    assert_equal([qualified_name(test_fn1)], results.keys())
+    result = results[qualified_name(test_fn1)]
     assert_equal(1, result['num_samples'])
     assert_equal(result['min_time'], result['max_time'])
     assert_equal(result['min_time'], result['avg_time'])
@@ -27,7 +41,7 @@ def test_performance_tester():
     # 2nd call
     test_fn1()
 
-    result = perf_tester.results()['test_fn1']
+    result = perf_tester.results()[qualified_name(test_fn1)]
     assert_equal(2, result['num_samples'])
     assert_not_equal(result['min_time'], result['max_time'])
     # assert_almost_equal?
@@ -38,5 +52,270 @@ def test_performance_tester():
     test_fn2()
 
     # both stats should be present
-    assert_true('test_fn1' in perf_tester.results())
-    assert_true('test_fn2' in perf_tester.results())
+    assert_true(qualified_name(test_fn1) in perf_tester.results())
+    assert_true(qualified_name(test_fn2) in perf_tester.results())
+
+
+def test_streaming_results_match_stored_samples():
+    samples = [0.001 * (i % 97 + 1) for i in range(5000)] + [0.0, 2.5]
+    stored = PerformanceTester()
+    streaming = PerformanceTester(streaming=True)
+    for perf_tester in (stored, streaming):
+        # timer of the tester starts each sample at 0 and ends it at
+        # the sample's value
+        times = []
+        for sample in samples:
+            times.extend([0.0, sample])
+        perftester.default_timer = iter(times).next
+        try:
+            fn = perf_tester.test(lambda: None)
+        finally:
+            perftester.default_timer = default_timer
+        for _ in samples:
+            fn()
+
+    expected = stored.results()[qualified_name(fn)]
+    result = streaming.results()[qualified_name(fn)]
+    assert_equal(len(samples), result['num_samples'])
+    assert_equal(expected['num_samples'], result['num_samples'])
+    for key in ('min_time', 'max_time', 'avg_time', 'variance'):
+        assert_almost_equal(expected[key], result[key], places=9)
+    for key in ('p50', 'p95', 'p99'):
+        # estimates are within 1/16 of the real values
+        assert_true(abs(expected[key] - result[key]) <= expected[key] / 16,
+                    (key, expected[key], result[key]))
+    assert_equal(0.097, expected['p99'])
+    assert_equal(0.049, expected['p50'])
+
+
+def test_running_stats_take_constant_memory():
+    stats = RunningStats()
+    for i in xrange(100000):
+        stats.add(1e-6 * (1 + i % 1000))
+    assert_true(len(stats._histogram) < 200)
+    assert_equal(1e-6, stats.min)
+    assert_equal(None, RunningStats().percentile(50))
+
+
+def test_overhead_is_measured():
+    for streaming in (False, True):
+        overhead = PerformanceTester(streaming).overhead(calls=1000)
+        assert_true(0 <= overhead['sample'] < 0.001)
+        assert_true(0 <= overhead['call'] < 0.001)
+
+
+def test_threads_collect_run_times_separately():
+    for streaming in (False, True):
+        perf_tester = PerformanceTester(streaming)
+        fn = perf_tester.test(lambda: None)
+        threads = [threading.Thread(target=lambda: [fn() for _ in range(500)])
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        fn()
+        assert_equal(2001,
+                     perf_tester.results()[qualified_name(fn)]['num_samples'])
+
+
+def test_stats_of_ended_threads_are_folded():
+    for streaming in (False, True):
+        perf_tester = PerformanceTester(streaming)
+        fn = perf_tester.test(noop)
+        for _ in range(20):
+            thread = threading.Thread(target=lambda: [fn(), fn()])
+            thread.start()
+            thread.join()
+            assert_true(len(perf_tester._threads) <= 1)
+        assert_equal(40, perf_tester.results()[qualified_name(fn)]
+                     ['num_samples'])
+        assert_equal({}, perf_tester._threads)
+        assert_equal(40, perf_tester.call_tree()[(qualified_name(fn),)][0])
+
+def test_gc_stays_disabled_until_last_measurement_ends():
+    perf_tester = PerformanceTester()
+    states = []
+
+    @perf_tester.test
+    def outer():
+        inner()
+        states.append(gc.isenabled())
+
+    @perf_tester.test
+    def inner():
+        states.append(gc.isenabled())
+
+    assert_true(gc.isenabled())
+    outer()
+    assert_equal([False, False], states)
+    assert_true(gc.isenabled())
+
+    untouched = PerformanceTester(disable_gc=False).test(
+        lambda: states.append(gc.isenabled()))
+    untouched()
+    assert_equal([False, False, True], states)
+
+
+def measure_in_worker(calls):
+    worker_fn = worker_tester.test(noop)
+    for _ in range(calls):
+        worker_fn()
+    return worker_tester.export()
+
+
+worker_tester = PerformanceTester(streaming=True)
+
+
+def test_stats_of_worker_processes_are_merged():
+    for streaming in (False, True):
+        perf_tester = PerformanceTester(streaming)
+        perf_tester.test(noop)()
+        pool = multiprocessing.Pool(2)
+        try:
+            for stats in pool.map(measure_in_worker, [10, 20, 30]):
+                if streaming:
+                    perf_tester.merge(stats)
+                else:
+                    # streaming stats can't become stored samples
+                    assert_raises(ValueError, perf_tester.merge, stats)
+        finally:
+            pool.close()
+            pool.join()
+        expected = 61 if streaming else 1
+        result = perf_tester.results()[qualified_name(noop)]
+        assert_equal(expected, result['num_samples'])
+
+    # stored samples can be merged into streaming stats
+    stored = PerformanceTester()
+    stored.test(noop)()
+    streaming = PerformanceTester(streaming=True)
+    streaming.merge(stored.export())
+    assert_equal(1, streaming.results()[qualified_name(noop)]['num_samples'])
+    assert_equal({}, stored.results())
+
+
+class Loader(object):
+    def load(self):
+        pass
+
+
+class_tester = PerformanceTester()
+
+
+class Appender(object):
+    @class_tester.test
+    def append(self):
+        pass
+
+
+class OtherAppender(Appender):
+    @class_tester.test
+    def append(self):
+        Appender.append(self)
+
+
+def test_functions_are_told_apart_by_qualified_names():
+    perf_tester = PerformanceTester()
+    perf_tester.test(Loader().load)()
+    perf_tester.test(Loader.load)(Loader())
+    perf_tester.test(time.sleep)(0)
+    perf_tester.test(time.sleep)(0)
+    load = __name__ + '.Loader.load'
+    assert_equal(sorted([load, 'time.sleep']),
+                 sorted(perf_tester.results().keys()))
+    assert_equal(2, perf_tester.results()[load]['num_samples'])
+
+
+def test_methods_decorated_in_class_body_are_told_apart():
+    OtherAppender().append()
+    results = class_tester.results()
+    assert_equal(sorted([__name__ + '.Appender.append',
+                         __name__ + '.OtherAppender.append']),
+                 sorted(results.keys()))
+    assert_equal([1, 1], [result['num_samples']
+                          for result in results.values()])
+    assert_equal(__name__ + '.Appender.append',
+                 qualified_name(Appender.append))
+
+
+def test_functions_of_the_same_name_are_told_apart_by_lines():
+    perf_tester = PerformanceTester()
+    first = lambda: None
+    second = lambda: None
+    perf_tester.test(first)()
+    perf_tester.test(second)()
+    perf_tester.test(first)()
+    assert_equal(sorted([__name__ + '.<lambda>',
+                         '%s.<lambda>:%d' % (__name__,
+                                             second.__code__.co_firstlineno)]),
+                 sorted(perf_tester.results().keys()))
+    assert_equal(2, perf_tester.results()[__name__ + '.<lambda>']
+                 ['num_samples'])
+
+
+def nested_profile():
+    perf_tester = PerformanceTester()
+    times = iter([0.0, 1.0, 3.0, 4.0, 4.5, 10.0,
+                  10.0, 12.0]).next
+    perftester.default_timer = times
+    try:
+        @perf_tester.test
+        def load():
+            append()
+            append()
+
+        @perf_tester.test
+        def append():
+            pass
+    finally:
+        perftester.default_timer = default_timer
+    # load: 0-10 calls append 1-3 and 4-4.5, then append alone 10-12
+    load()
+    append()
+    return perf_tester, qualified_name(load), qualified_name(append)
+
+
+def test_nested_calls_give_inclusive_and_exclusive_times():
+    perf_tester, load, append = nested_profile()
+    assert_equal({(load,): [1, 10.0, 7.5], (load, append): [2, 2.5, 2.5],
+                  (append,): [1, 2.0, 2.0]}, perf_tester.call_tree())
+    results = perf_tester.results()
+    assert_equal((10.0, 7.5), (results[load]['total_time'],
+                               results[load]['exclusive_time']))
+    assert_equal((4.5, 4.5), (results[append]['total_time'],
+                              results[append]['exclusive_time']))
+
+
+def test_results_export_formats():
+    perf_tester, load, append = nested_profile()
+
+    stream = StringIO()
+    perf_tester.write_collapsed(stream)
+    assert_equal(['%s 2000000' % append, '%s 7500000' % load,
+                  '%s;%s 2500000' % (load, append)],
+                 stream.getvalue().splitlines())
+
+    stream = StringIO()
+    perf_tester.write_json(stream)
+    exported = json.loads(stream.getvalue())
+    assert_equal((1, 3), (exported['functions'][load]['num_samples'],
+                          exported['functions'][append]['num_samples']))
+    overhead = perf_tester.overhead()
+    assert_true(0 <= exported['functions'][load]['call_overhead']
+                < overhead['call'] * 10 + 0.0001)
+    assert_equal(exported['functions'][load]['sample_overhead'],
+                 exported['functions'][append]['sample_overhead'])
+    assert_equal({'stack': [load, append], 'num_calls': 2,
+                  'inclusive_time': 2.5, 'exclusive_time': 2.5},
+                 exported['calls'][2])
+
+    stream = StringIO()
+    perf_tester.write_csv(stream)
+    rows = list(csv.reader(StringIO(stream.getvalue())))
+    assert_equal(['function'] + PerformanceTester.result_fields, rows[0])
+    assert_equal([append, '3'], rows[1][:2])
+    row = dict(zip(rows[0], rows[2]))
+    assert_equal('7.5', row['exclusive_time'])
+    assert_almost_equal(exported['functions'][load]['call_overhead'],
+                        float(row['call_overhead']))
@@ -0,0 +1,122 @@
+from nose.tools import *
+from logparser import logparser
+from logparser.client import LogClient
+from logparser.serve import LogServer, parse_address
+from cStringIO import StringIO
+from datetime import datetime
+import os
+import shutil
+import tempfile
+import threading
+
+log_sample = """
+2012-09-13 16:04:22 DEBUG SID:34523 BID:1329 RID:65d33 'Starting new session'
+2012-09-13 16:04:30 DEBUG SID:34523 BID:1329 RID:54f22 'Authenticating User'
+2012-09-13 16:05:30 DEBUG SID:42111 BID:319 RID:65a23 'Starting new session'
+2012-09-13 16:04:50 ERROR SID:34523 BID:1329 RID:54ff3 'Missing
+Authentication token'
+2012-09-13 16:05:31 DEBUG SID:42111 BID:319 RID:86472 'Authenticating User'
+2012-09-13 16:05:31 DEBUG SID:42111 BID:319 RID:7a323 'Deleting asset
+with ID 543234'
+2012-09-13 16:05:32 WARN SID:42111 BID:319 RID:7a323 'Invalid asset ID \xe9'
+"""
+
+
+def start_server(log_container, address=('localhost', 0)):
+    server = LogServer(log_container, address)
+    thread = threading.Thread(target=server.serve_forever,
+                              kwargs={'poll_interval': 0.05})
+    thread.daemon = True
+    thread.start()
+    return server, thread
+
+
+def stop_server(server, thread):
+    server.shutdown()
+    thread.join(5)
+    assert_false(thread.is_alive())
+
+
+def load_container(stream_data):
+    log_container = logparser.CustomLog()
+    log_container.load(StringIO(stream_data))
+    return log_container
+
+
+def test_parse_address():
+    assert_equal(('localhost', 8470), parse_address('localhost:8470'))
+    assert_equal(('', 8470), parse_address(':8470'))
+    assert_equal('/tmp/log.sock', parse_address('/tmp/log.sock'))
+    assert_equal(('::1', 1), parse_address(('::1', 1)))
+    assert_raises(ValueError, parse_address, 'localhost')
+
+
+def test_client_gets_same_results_as_local_search():
+    log_container = load_container(log_sample)
+    server, thread = start_server(log_container)
+    try:
+        with LogClient(server.address, timeout=5) as client:
+            for method, args in [
+                    ('find_entries_with_log_level', ['DEBUG']),
+                    ('find_entries_with_log_level', ['WARN']),
+                    ('find_entries_with_business_id', ['BID:319']),
+                    ('find_entries_with_session_id', ['SID:1']),
+                    ('find_entries_within_date_range',
+                     ['2012-09-13 16:04:30', '2012-09-13 16:05:31'])]:
+                assert_equal(getattr(logparser, method)(log_container, *args),
+                             list(getattr(client, method)(*args)))
+            date_from = datetime(2012, 9, 13, 16, 4, 30)
+            date_to = datetime(2012, 9, 13, 16, 5, 31)
+            assert_equal(log_container.find_by('date', date_from, date_to),
+                         list(client.find_by('date', date_from, date_to)))
+            assert_equal(
+                log_container.query(loglevel='DEBUG',
+                                    date=(date_from, date_to)),
+                list(client.query(loglevel='DEBUG',
+                                  date=(date_from, date_to))))
+    finally:
+        stop_server(server, thread)
+
+
+def test_server_reports_errors_and_keeps_serving():
+    server, thread = start_server(load_container(log_sample))
+    try:
+        with LogClient(server.address, timeout=5) as client:
+            assert_raises(ValueError, list, client.find_by('message', 'A'))
+            assert_raises(ValueError, list, client.search('delete'))
+            # results left unread are skipped
+            client.find_entries_with_log_level('DEBUG')
+            assert_equal(1, len(list(
+                client.find_entries_with_log_level('ERROR'))))
+            # so are results closed when read halfway
+            results = client.find_entries_with_log_level('DEBUG')
+            next(results)
+            results.close()
+            assert_equal(['ERROR'], [entry.loglevel for entry in
+                                     client.find_entries_with_log_level(
+                                         'ERROR')])
+    finally:
+        stop_server(server, thread)
+
+
+def test_clients_are_served_concurrently_over_unix_socket():
+    log_container = load_container(log_sample * 500)
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'log.sock')
+    server, thread = start_server(log_container, path)
+    try:
+        slow_client = LogClient(path, timeout=5)
+        client = LogClient(path, timeout=5)
+        # the first client reads a huge result slowly, others don't wait
+        huge = slow_client.find_entries_with_log_level('DEBUG')
+        first = next(huge)
+        assert_equal(500, len(list(
+            client.find_entries_with_log_level('WARN'))))
+        assert_equal(log_container.find_by('loglevel', 'DEBUG'),
+                     [first] + list(huge))
+        slow_client.close()
+        client.close()
+    finally:
+        stop_server(server, thread)
+        shutil.rmtree(directory)
+    assert_false(os.path.exists(path))